@@ -0,0 +1,53 @@
+''' nRF Cloud account cache module '''
+import hashlib
+import json
+import os
+import time
+
+class Account_Cache():
+    ''' On-disk cache of the nRF Cloud account details and device list of an API key. Entries
+    older than the maximum age in seconds are ignored. The API key itself is not stored '''
+    MAX_AGE = 24 * 60 * 60
+
+    def __init__(self, directory, api_key, max_age=MAX_AGE):
+        key = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+        self.__path = os.path.join(directory, 'account-' + key + '.json')
+        self.__max_age = max_age
+        self.__entries = self.__read()
+
+    def __read(self):
+        try:
+            with open(self.__path) as cache_file:
+                entries = json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(entries, dict):
+            return {}
+        return entries
+
+    def __write(self):
+        tmp_path = self.__path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.__path), exist_ok=True)
+            # Account details and device IDs are only readable by the owner
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as cache_file:
+                json.dump(self.__entries, cache_file)
+            os.replace(tmp_path, self.__path)
+        except OSError as err:
+            print('Could not write account cache ' + self.__path + ': ' + str(err))
+
+    def get(self, name):
+        ''' Get a cached value if it is younger than the maximum age. Returns None otherwise '''
+        entry = self.__entries.get(name)
+        if not isinstance(entry, dict) or time.time() - entry.get('saved', 0) > self.__max_age:
+            return None
+        return entry.get('value')
+
+    def put(self, name, value):
+        ''' Store a value and write the cache to disk '''
+        self.__entries[name] = {
+                'saved': time.time(),
+                'value': value
+                }
+        self.__write()
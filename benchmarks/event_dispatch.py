@@ -0,0 +1,211 @@
+''' Gateway event dispatch benchmark
+
+Feeds gateway messages straight into the CLI's event decoding and event_dispatch handlers, with
+no MQTT broker and with console output discarded, and reports for each event type:
+
+- events/s: events handled per second of handler time
+- p50/p99: decode and handler latency of an event in microseconds
+- peak B: memory allocated at the peak of handling one event (tracemalloc)
+- blocks: memory blocks left allocated per event, a steady non-zero value is a leak
+
+Events are synthetic, or recorded by the CLI with --journal.
+
+Run from the repository root: python benchmarks/event_dispatch.py [--journal DIR]
+'''
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+import mesh_journal
+
+def model_message(idx):
+    ''' Generic OnOff Status from one of 100 nodes '''
+    return {
+            'type': 'receive_model_message',
+            'netIndex': 0,
+            'appIndex': 0,
+            'sourceAddress': 2 + idx % 100,
+            'destinationAddress': 0xC000,
+            'opcode': 0x8204,
+            'payload': [{'byte': idx % 2}, {'byte': 1 - idx % 2}, {'byte': 0x41}]
+            }
+
+def health_faults(idx):
+    ''' Current health faults of a node '''
+    return {
+            'type': 'health_faults_current',
+            'address': 2 + idx % 100,
+            'testId': 0,
+            'companyId': 0x0059,
+            'faults': [{'fault': fault} for fault in range(idx % 4)]
+            }
+
+def node_list(nodes):
+    ''' Node list of a network of nodes with two elements each '''
+    def event(_idx):
+        ''' Node list event, the same for every index '''
+        return {
+                'type': 'node_list',
+                'nodes': [{
+                    'address': 1 + 2 * idx,
+                    'uuid': '{:032x}'.format(idx),
+                    'elementCount': 2,
+                    'netIndex': 0
+                    } for idx in range(nodes)]
+                }
+    return event
+
+def feature(state):
+    ''' Supported node feature in a given state '''
+    return {'support': True, 'state': state}
+
+def node_discover(idx):
+    ''' Discovery result of a light node with two elements '''
+    address = 2 + 2 * (idx % 100)
+    models = [0x1000, 0x1002, 0x1006, 0x1009]
+    return {
+            'type': 'node_discover_result',
+            'timestamp': 0,
+            'error': 0,
+            'status': 0,
+            'address': address,
+            'uuid': '{:032x}'.format(address),
+            'deviceType': 'light',
+            'netIndex': 0,
+            'elementCount': 2,
+            'cid': 0x0059,
+            'pid': 0,
+            'vid': 0,
+            'crpl': 40,
+            'networkBeaconState': True,
+            'timeToLive': 5,
+            'relayFeature': dict(feature(True), retransmitCount=2, retransmitInterval=20),
+            'proxyFeature': feature(True),
+            'friendFeature': feature(False),
+            'lpnFeature': feature(False),
+            'subnets': [0],
+            'elements': [{
+                'address': address + elem,
+                'sigModels': [{
+                    'modelId': model_id,
+                    'appIndexes': [0],
+                    'subscribeAddresses': [0xC000 + elem],
+                    'publishParameters': {
+                        'address': 0xC100,
+                        'appIndex': 0,
+                        'friendCredentialFlag': False,
+                        'timeToLive': 5,
+                        'period': 0,
+                        'periodUnits': '100ms',
+                        'retransmitCount': 0,
+                        'retransmitInterval': 50
+                        }
+                    } for model_id in models],
+                'vendorModels': []
+                } for elem in range(2)]
+            }
+
+def synthetic(count, nodes):
+    ''' Get count raw messages of each synthetic event type '''
+    makers = [model_message, health_faults, node_list(nodes), node_discover]
+    return [json.dumps({'type': 'event', 'event': make(idx)}).encode()
+            for make in makers for idx in range(count)]
+
+def recorded(directory):
+    ''' Get the raw messages of a journal directory '''
+    return [bytes(payload) for _, payload in mesh_journal.replay(directory)]
+
+def handle(payload):
+    ''' Decode and handle one raw message. Returns the event type or None '''
+    event = main.decode_event(payload)
+    if event is None:
+        return None
+    main.handle_event(event)
+    return event['type']
+
+def percentile(values, fraction):
+    ''' Get the value at a fraction of a sorted list '''
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+def retained(func, payload):
+    ''' Get the number of memory blocks still allocated after a call '''
+    before = sys.getallocatedblocks()
+    result = func(payload)
+    return sys.getallocatedblocks() - before, result
+
+async def measure(payloads):
+    ''' Time every message, then trace the memory of every message '''
+    times = {}
+    for payload in payloads:
+        start = time.perf_counter_ns()
+        evt_type = handle(payload)
+        elapsed = time.perf_counter_ns() - start
+        if evt_type is not None:
+            times.setdefault(evt_type, []).append(elapsed)
+
+    # Blocks the measurement itself leaves allocated, including the returned event type string
+    overhead = min(retained(lambda _payload: ''.join(['event', '_type']), None)[0]
+            for _ in range(100))
+    blocks = {}
+    for payload in payloads:
+        count, evt_type = retained(handle, payload)
+        if evt_type is not None:
+            blocks.setdefault(evt_type, []).append(count - overhead)
+
+    peaks = {}
+    tracemalloc.start()
+    for payload in payloads:
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        evt_type = handle(payload)
+        if evt_type is not None:
+            peaks.setdefault(evt_type, []).append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+    return times, peaks, blocks
+
+def main_benchmark():
+    ''' Run the benchmark and print a table of the results '''
+    parser = argparse.ArgumentParser(description='Gateway event dispatch benchmark')
+    parser.add_argument('--journal', type=str, default=None,
+            help='Journal directory of recorded messages to use instead of synthetic events')
+    parser.add_argument('--events', type=int, default=2000,
+            help='Number of synthetic events of each type')
+    parser.add_argument('--nodes', type=int, default=100,
+            help='Number of nodes in synthetic node lists')
+    parser.add_argument('--store', action='store_true', default=False,
+            help='Save node lists and discovery results to a temporary topology snapshot')
+    args = parser.parse_args()
+
+    payloads = recorded(args.journal) if args.journal else synthetic(args.events, args.nodes)
+    loop = asyncio.new_event_loop()
+    # Handlers complete requests on the event loop, so they run inside it as in a session
+    main.pending.attach(loop)
+    with tempfile.TemporaryDirectory() as directory:
+        if args.store:
+            main.store.open(os.path.join(directory, 'topology.db'), 'benchmark')
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            times, peaks, blocks = loop.run_until_complete(measure(payloads))
+        main.store.close()
+    loop.close()
+
+    print('{:<24}{:>8}{:>11}{:>9}{:>9}{:>10}{:>8}'.format('Event type', 'Events', 'Events/s',
+        'p50 us', 'p99 us', 'Peak B', 'Blocks'))
+    for evt_type in sorted(times):
+        values = sorted(times[evt_type])
+        count = len(values)
+        print('{:<24}{:>8}{:>11.0f}{:>9.1f}{:>9.1f}{:>10.0f}{:>8.2f}'.format(evt_type, count,
+            count / (sum(values) / 1e9), percentile(values, 0.5) / 1e3,
+            percentile(values, 0.99) / 1e3, sum(peaks[evt_type]) / count,
+            sum(blocks[evt_type]) / count))
+
+if __name__ == '__main__':
+    main_benchmark()
@@ -0,0 +1,89 @@
+''' Model message payload codec benchmark
+
+Compares bytes payloads, converted to the gateway's list of byte dictionaries only at the MQTT
+boundary, against building and keeping the list of byte dictionaries throughout:
+
+- codec: building a wire payload from byte values, and reading byte values from a wire payload
+- message: the same including json.dumps or json.loads of a message carrying the payload
+- memory: bytes held per received payload after decoding
+
+Run from the repository root: python benchmarks/payload_codec.py
+'''
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from byte_codec import payload_from_wire
+from byte_codec import payload_to_wire
+from byte_codec import wire_default
+
+SIZES = [2, 8, 32, 128]
+NUMBER = 20000
+
+def list_encode(data):
+    ''' Previous form: one new dictionary per byte '''
+    return [{'byte': byte} for byte in data]
+
+def list_decode(payload):
+    ''' Previous form: handlers index the dictionaries, here every byte once '''
+    return [byte['byte'] for byte in payload]
+
+def list_dumps(data):
+    return json.dumps({'payload': list_encode(data)})
+
+def bytes_dumps(data):
+    return json.dumps({'payload': data}, default=wire_default)
+
+def list_loads(text):
+    return list_decode(json.loads(text)['payload'])
+
+def bytes_loads(text):
+    return payload_from_wire(json.loads(text)['payload'])
+
+def held_size(payload):
+    ''' Get the bytes of memory a payload object and its items hold '''
+    size = sys.getsizeof(payload)
+    if isinstance(payload, list):
+        size += sum(sys.getsizeof(item) for item in payload)
+    return size
+
+def per_call(func, arg):
+    ''' Get the best time of a call in microseconds '''
+    return min(timeit.repeat(lambda: func(arg), number=NUMBER, repeat=5)) / NUMBER * 1e6
+
+def print_row(cells):
+    print('{:>6}'.format(cells[0]) + ''.join('{:>12.2f}'.format(cell) for cell in cells[1:]))
+
+def main():
+    header = '{:>6}'.format('Bytes') + ''.join('{:>12}'.format(name) for name in
+            ['Encode old', 'Encode new', 'Decode old', 'Decode new'])
+    print('Codec cost per payload (us)')
+    print(header)
+    for size in SIZES:
+        data = bytes(range(size))
+        wire = list_encode(data)
+        assert payload_to_wire(data) == wire and payload_from_wire(wire) == data
+        print_row([size, per_call(list_encode, data), per_call(payload_to_wire, data),
+            per_call(list_decode, wire), per_call(payload_from_wire, wire)])
+
+    print('\nMessage cost including JSON (us)')
+    print(header)
+    for size in SIZES:
+        data = bytes(range(size))
+        text = list_dumps(data)
+        assert bytes_dumps(data) == text and bytes_loads(text) == data
+        print_row([size, per_call(list_dumps, data), per_call(bytes_dumps, data),
+            per_call(list_loads, text), per_call(bytes_loads, text)])
+
+    print('\nMemory held per received payload (bytes)')
+    print('{:>6}{:>12}{:>12}'.format('Bytes', 'Old', 'New'))
+    for size in SIZES:
+        wire = json.loads(list_dumps(bytes(range(size))))['payload']
+        print('{:>6}{:>12}{:>12}'.format(size, held_size(wire),
+            held_size(payload_from_wire(wire))))
+
+if __name__ == '__main__':
+    main()
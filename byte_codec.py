@@ -1,4 +1,6 @@
 ''' Byte codec module '''
+import operator
+
 def uint8(number):
     ''' Get a hexadecimal formatted string of an unsigned 8-bit integer '''
     return '0x{:02x}'.format(number)
@@ -10,3 +12,22 @@ def uint16(number):
 def uint32(number):
     ''' Get a hexadecimal formatted string of an unsigned 32-bit integer '''
     return '0x{:08x}'.format(number)
+
+# Wire form of each byte value. The dictionaries are shared and must not be modified
+_WIRE_BYTES = tuple({'byte': value} for value in range(256))
+_wire_byte = _WIRE_BYTES.__getitem__
+_byte_value = operator.itemgetter('byte')
+
+def payload_to_wire(payload):
+    ''' Get the gateway's list of byte dictionaries form of a bytes-like payload '''
+    return list(map(_wire_byte, payload))
+
+def payload_from_wire(payload):
+    ''' Get the bytes of a payload in the gateway's list of byte dictionaries form '''
+    return bytes(map(_byte_value, payload))
+
+def wire_default(obj):
+    ''' JSON encoder hook that writes bytes-like payloads in the gateway's wire form '''
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return payload_to_wire(obj)
+    raise TypeError('Object of type ' + type(obj).__name__ + ' is not JSON serializable')
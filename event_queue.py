@@ -0,0 +1,78 @@
+''' Gateway event queue module '''
+import queue
+import threading
+import traceback
+
+POLICIES = ['block', 'drop']
+
+class Event_Queue():
+    ''' Bounded queue that hands gateway events from the MQTT network loop to a worker thread,
+    so slow handlers and console output cannot stall the network loop. When the queue is full
+    the block policy makes the network loop wait up to block_timeout seconds for room before
+    discarding the new event, and the drop policy discards it right away '''
+    SIZE = 1000
+    # Longest the network loop waits for room, it cannot send or receive anything meanwhile
+    BLOCK_TIMEOUT = 1
+
+    def __init__(self, handler, size=SIZE, policy='block', block_timeout=BLOCK_TIMEOUT):
+        if policy not in POLICIES:
+            raise ValueError('Unknown event queue policy: ' + policy)
+        self.policy = policy
+        self.size = size
+        self.block_timeout = block_timeout
+        self.received = 0
+        self.handled = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.max_depth = 0
+        self.__handler = handler
+        self.__queue = queue.Queue(size)
+        self.__worker = None
+
+    def start(self):
+        ''' Start the worker thread that calls the handler for each event '''
+        self.__worker = threading.Thread(target=self.__run, daemon=True)
+        self.__worker.start()
+
+    def stop(self, timeout=None):
+        ''' Let the worker thread handle the queued events and stop '''
+        if self.__worker is None:
+            return
+        self.__queue.put(None)
+        self.__worker.join(timeout)
+        self.__worker = None
+
+    def put(self, event):
+        ''' Queue an event for the worker thread. Returns False if the event was dropped '''
+        self.received += 1
+        try:
+            self.__queue.put_nowait(event)
+        except queue.Full:
+            if self.policy == 'drop':
+                self.dropped += 1
+                return False
+            self.blocked += 1
+            try:
+                self.__queue.put(event, timeout=self.block_timeout)
+            except queue.Full:
+                self.dropped += 1
+                return False
+        self.max_depth = max(self.max_depth, self.__queue.qsize())
+        return True
+
+    def depth(self):
+        ''' Get the number of events waiting for the worker thread '''
+        return self.__queue.qsize()
+
+    def __run(self):
+        while True:
+            event = self.__queue.get()
+            if event is None:
+                return
+            try:
+                self.__handler(event)
+            except Exception:
+                # A failing handler must not stop the events that follow
+                print('ERROR: event handler failed')
+                traceback.print_exc()
+            self.handled += 1
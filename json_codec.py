@@ -0,0 +1,64 @@
+''' Gateway message JSON codec module '''
+import json
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKENDS = ['auto', 'json', 'orjson']
+
+class Json_Codec():
+    ''' Encode operations and decode events on the MQTT path, using orjson if it is installed.
+    Counts received messages and the time spent parsing them '''
+    # Every gateway event has this string as the value of its type field
+    __EVENT = b'"event"'
+
+    def __init__(self, default=None, backend='auto'):
+        if backend == 'orjson' and orjson is None:
+            raise ValueError('orjson is not installed')
+        if backend == 'auto':
+            backend = 'json' if orjson is None else 'orjson'
+        self.backend = backend
+        self.__default = default
+        self.received = 0
+        self.skipped = 0
+        self.errors = 0
+        self.parse_seconds = 0.0
+        self.parse_max = 0.0
+
+    def dumps(self, msg):
+        ''' Encode an operation message. Returns bytes with orjson or str with json '''
+        if self.backend == 'orjson':
+            return orjson.dumps(msg, default=self.__default)
+        return json.dumps(msg, default=self.__default)
+
+    def loads_event(self, payload):
+        ''' Decode a message received from the gateway. Returns None unless it is an event.
+        Payloads that cannot hold an event are skipped without being parsed '''
+        self.received += 1
+        if isinstance(payload, str):
+            payload = payload.encode()
+        if self.__EVENT not in payload:
+            self.skipped += 1
+            return None
+        start = time.perf_counter()
+        try:
+            msg = orjson.loads(payload) if self.backend == 'orjson' else json.loads(payload)
+        except ValueError:
+            msg = None
+        elapsed = time.perf_counter() - start
+        self.parse_seconds += elapsed
+        self.parse_max = max(self.parse_max, elapsed)
+        if not isinstance(msg, dict):
+            self.errors += 1
+            return None
+        if msg.get('type') != 'event':
+            return None
+        return msg
+
+    def parse_mean(self):
+        ''' Get the mean parse time of the parsed messages in seconds '''
+        parsed = self.received - self.skipped
+        return self.parse_seconds / parsed if parsed else 0.0
@@ -1,13 +1,27 @@
 ''' Bluetooth Mesh LTE CLI Main Module'''
 import argparse
+import asyncio
+import contextlib
+import datetime
+import os
+import signal
+import sqlite3
 import sys
-import json
 import threading
+import time
 import requests
+from urllib3.util.retry import Retry
 import paho.mqtt.client as mqtt
-import paho.mqtt.publish as publish
 
+import account_cache
 import sync_sem
+import byte_codec
+import json_codec
+import event_queue
+import mqtt_loop
+import mesh_cache
+import mesh_store
+import mesh_addresses
 import mesh_beacons
 import mesh_subnets
 import mesh_app_keys
@@ -18,17 +32,61 @@ import mesh_nodes
 import mesh_node
 import mesh_subscriptions
 import mesh_models
+import mesh_plan
+import mesh_groups
+import mesh_ingest
+import mesh_journal
+import mesh_sim
+import mesh_soak
+import mesh_stats
 
 ACC_URL = 'https://api.nrfcloud.com/v1/account'
 DEV_URL = 'https://api.nrfcloud.com/v1/devices'
 AUTH_BEARER_PREFIX = 'Bearer '
 PORT                = 8883
 KEEP_ALIVE          = 30
+HTTP_TIMEOUT = (5, 30)
+HTTP_RETRIES = 3
+HTTP_PAGE_LIMIT = 100
+METRICS_INTERVAL = 60
+STATE_DIR = os.path.join(os.path.expanduser('~'), '.nrf-mesh-cli')
+MAIN_MENU = [
+        'View unprovisioned device beacons',
+        'Provision device',
+        'Provision devices from a manifest',
+        'Configure network subnets',
+        'Configure network application keys',
+        'Health client interface',
+        'View network nodes',
+        'Discover a network node',
+        'Discover all network nodes',
+        'Configure a network node',
+        'Apply a network configuration file',
+        'Reset a network node',
+        'Configure mesh model subscriptions',
+        'Send mesh model message',
+        'Send mesh model message to many destinations',
+        'View received message analytics',
+        'View operation latency',
+        'View session statistics',
+        'Quit'
+        ]
 
 live = True
 getting_input = False
+verbose = False
 api_key = None
 device_id = None
+client = None
+c2g_topic = None
+g2c_topic = None
+subscribed = None
+stopping = None
+selector = None
+session = None
+startup_phases = []
+http_session = None
+metrics_path = None
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Device Credentials Installer",
@@ -43,11 +101,78 @@ def parse_args():
     parser.add_argument("-d", "--deviceid", type=str,
                         help="Mesh gateway device ID",
                         default=None)
+    parser.add_argument("--discover-ttl", type=float,
+                        help="Seconds node discovery results are reused for, 0 to disable",
+                        default=mesh_node.Node.DISCOVER_TTL)
+    parser.add_argument("--state-dir", type=str,
+                        help="Directory for locally stored gateway state",
+                        default=STATE_DIR)
+    parser.add_argument("--no-snapshot",
+                        help="bool: Do not load or store the mesh topology snapshot",
+                        action='store_true', default=False)
+    parser.add_argument("--refresh",
+                        help="bool: Query nRF Cloud instead of using cached account details",
+                        action='store_true', default=False)
+    parser.add_argument("--cache-max-age", type=float,
+                        help="Seconds cached account details and devices stay valid",
+                        default=account_cache.Account_Cache.MAX_AGE)
+    parser.add_argument("--json-backend", type=str, choices=json_codec.BACKENDS,
+                        help="JSON library for gateway messages, auto uses orjson if installed",
+                        default='auto')
+    parser.add_argument("--event-queue", type=int,
+                        help="Number of gateway events that can wait for their handlers",
+                        default=event_queue.Event_Queue.SIZE)
+    parser.add_argument("--event-policy", type=str, choices=event_queue.POLICIES,
+                        help="What to do with gateway events when the event queue is full",
+                        default='block')
+    parser.add_argument("--ingest", type=str,
+                        help="Directory to store received model messages in for analytics",
+                        default=None)
+    parser.add_argument("--ingest-batch", type=int,
+                        help="Number of received model messages of a type written per file",
+                        default=mesh_ingest.Ingest.BATCH)
+    parser.add_argument("--journal", type=str,
+                        help="Directory to record the raw messages received from the gateway in",
+                        default=None)
+    parser.add_argument("--journal-size", type=float,
+                        help="Megabytes of messages per journal segment file",
+                        default=mesh_journal.SEGMENT_SIZE / 1024 / 1024)
+    parser.add_argument("--journal-compress",
+                        help="bool: Compress full journal segment files with zlib",
+                        action='store_true', default=False)
+    parser.add_argument("--metrics", type=str,
+                        help="File to keep operation latency statistics in, in the Prometheus " +
+                        "text format",
+                        default=None)
+    parser.add_argument("--replay", type=str,
+                        help="Handle the gateway events recorded in a journal directory and exit",
+                        default=None)
+    parser.add_argument("--simulate", type=int,
+                        help="Talk to a local simulated gateway with this many virtual nodes " +
+                        "instead of nRF Cloud",
+                        default=None)
+    parser.add_argument("--sim-latency", type=float,
+                        help="Seconds a message to a simulated node takes to be answered",
+                        default=mesh_sim.LATENCY)
+    for fault in mesh_sim.FAULTS:
+        parser.add_argument("--fault-" + fault, type=float,
+                            help="Share of simulated gateway events to " + fault,
+                            default=0.0)
+    parser.add_argument("--soak", type=float,
+                        help="Run a soak test against the simulated gateway for this many " +
+                        "seconds and exit",
+                        default=None)
+    parser.add_argument("--soak-interval", type=float,
+                        help="Seconds between soak test samples",
+                        default=mesh_soak.INTERVAL)
+    parser.add_argument("--soak-output", type=str,
+                        help="CSV file to write soak test samples to",
+                        default=None)
     return parser.parse_args()
 
 def publish_mqtt(msg):
     ''' Publish mqtt message to mesh gateway '''
-    client.publish(c2g_topic, payload=json.dumps(msg), qos=0, retain=False)
+    client.publish(c2g_topic, payload=codec.dumps(msg), qos=0, retain=False)
 
 def get_choice(options):
     ''' Get a choice from the user from a list of menu options '''
@@ -74,17 +199,26 @@ def get_choice(options):
         getting_input = False
         return choice-1
 
-sem = sync_sem.Sem()
-beacons = mesh_beacons.Beacons(sem, get_choice, publish_mqtt)
-subnets = mesh_subnets.Subnets(sem, get_choice, publish_mqtt)
-app_keys = mesh_app_keys.App_Keys(sem, subnets, get_choice, publish_mqtt)
-provision = mesh_provision.Provision(sem, beacons, subnets, publish_mqtt)
-nodes = mesh_nodes.Nodes(sem, get_choice, publish_mqtt)
-health = mesh_health.Health(sem, app_keys, nodes, get_choice, publish_mqtt)
-node = mesh_node.Node(sem, nodes, subnets, app_keys, get_choice, publish_mqtt)
-reset = mesh_reset.Reset(sem, nodes, publish_mqtt)
-subscriptions = mesh_subscriptions.Subscriptions(sem, get_choice, publish_mqtt)
-models = mesh_models.Models(sem, subnets, app_keys, get_choice, publish_mqtt)
+# Model message payloads are bytes until they are written in the gateway's wire form
+codec = json_codec.Json_Codec(byte_codec.wire_default)
+latency = mesh_stats.Latency_Stats()
+pending = sync_sem.Requests(publish_mqtt, latency)
+inventory = mesh_cache.Inventory()
+store = mesh_store.Topology_Store()
+addresses = mesh_addresses.Address_Allocator()
+beacons = mesh_beacons.Beacons(pending, inventory, get_choice)
+subnets = mesh_subnets.Subnets(pending, inventory, get_choice)
+app_keys = mesh_app_keys.App_Keys(pending, inventory, subnets, get_choice)
+provision = mesh_provision.Provision(pending, inventory, beacons, subnets, addresses, latency)
+nodes = mesh_nodes.Nodes(pending, inventory, store, addresses, get_choice)
+health = mesh_health.Health(pending, app_keys, nodes, get_choice)
+node = mesh_node.Node(pending, nodes, subnets, app_keys, store, get_choice)
+reset = mesh_reset.Reset(pending, nodes)
+subscriptions = mesh_subscriptions.Subscriptions(pending, get_choice)
+groups = mesh_groups.Group_Optimizer(nodes, node)
+ingest = mesh_ingest.Ingest(mesh_models.DECODERS, mesh_models.MODEL_MSG_ACKS)
+models = mesh_models.Models(pending, subnets, app_keys, groups, ingest, get_choice)
+planner = mesh_plan.Planner(pending, node, get_choice, latency)
 
 event_dispatch = {
         'beacon_list': beacons.evt,
@@ -111,12 +245,36 @@ def on_connect(_client, _userdata, _flags, r_c):
 
 def on_message(_client, _userdata, msg):
     ''' On MQTT message receive callback'''
-    msg_json = json.loads(msg.payload)
-    if msg_json['type'] != 'event':
-        return
+    received = time.time()
+    journal.append(msg.payload, received)
+    event = decode_event(msg.payload, received)
+    if event is not None:
+        # Handlers print to the console, which must not hold up the network loop
+        events.put(event)
+
+def decode_event(payload, received=None):
+    ''' Get the event of a message received from the gateway. Model message events get the
+    time.time() the message was received at, if given, in their receivedAt field. Returns None
+    if the message is not an event '''
+    msg_json = codec.loads_event(payload)
+    if msg_json is None:
+        return None
+    event = msg_json['event']
+    if event['type'] == 'receive_model_message':
+        if event.get('payload') is not None:
+            event['payload'] = byte_codec.payload_from_wire(event['payload'])
+        if received is not None:
+            # Handlers may get to the event long after it arrived
+            event['receivedAt'] = received
+    if 'id' in msg_json:
+        # Hand the ID of the operation this event responds to down to the request table
+        event.setdefault('id', msg_json['id'])
+    return event
+
+def handle_event(event):
+    ''' Handle a gateway event. Runs in the event queue worker thread '''
     if getting_input:
         print('\n')
-    event = msg_json['event']
     try:
         event_dispatch[event['type']](event)
     except KeyError:
@@ -124,70 +282,121 @@ def on_message(_client, _userdata, msg):
     if getting_input:
         print('\nMAIN MENU')
         print('Select from the following options:')
-        print('1. View unprovisioned device beacons')
-        print('2. Provision device')
-        print('3. Configure network subnets')
-        print('4. Configure network application keys')
-        print('5. Health Client Interface')
-        print('6. View network nodes')
-        print('7. Discover a network node')
-        print('8. Configure a network node')
-        print('9. Reset a network node')
-        print('10. Configure mesh model subscriptions')
-        print('11. Send mesh model message')
+        for idx, option in enumerate(MAIN_MENU):
+            print(str(idx+1) + '. ' + option)
         print('\n>', end='')
 
+events = event_queue.Event_Queue(handle_event)
+journal = mesh_journal.Journal()
+
 def on_subscribe(_client, _userdata, _midi, granted_qos):
     ''' On MQTT topic subscribe callback'''
     print('Subscribed to ' + g2c_topic)
     print('QOS: ' + str(granted_qos) + '\n')
-    sem.release()
-
-def http_req(req_url, req_api_key):
-    ''' Make an HTTP request '''
+    subscribed.set()
+
+def http_req(req_url, req_api_key, params=None):
+    ''' Make an HTTP GET request. Returns the decoded JSON response or None on failure '''
+    global http_session
+    if http_session is None:
+        # Reuse connections to nRF Cloud and retry transient failures with backoff
+        http_session = requests.Session()
+        retry = Retry(total=HTTP_RETRIES, backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504))
+        http_session.mount('https://', requests.adapters.HTTPAdapter(max_retries=retry))
     try:
-        resp = requests.get(req_url, headers={'Authorization': 'Bearer ' + req_api_key})
-    except requests.RequestException:
-        print('Request Exception')
-    except requests.ConnectionError:
-        print('Connection Error')
-    except requests.HTTPError:
-        print('HTTP Error')
-    except requests.TooManyRedirects:
-        print('Too many redirects')
+        resp = http_session.get(req_url, params=params, timeout=HTTP_TIMEOUT,
+                headers={'Authorization': AUTH_BEARER_PREFIX + req_api_key})
+        resp.raise_for_status()
+        return resp.json()
+    except requests.HTTPError as err:
+        print('GET Error: ' + str(err.response.status_code))
     except requests.ConnectTimeout:
         print('Connect Timeout')
     except requests.ReadTimeout:
         print('Read Timeout')
     except requests.Timeout:
         print('Timeout')
-
-    if resp.status_code != 200:
-        print('GET Error: ' + str(resp.status_code))
-
-    return resp.json()
+    except requests.ConnectionError:
+        print('Connection Error')
+    except requests.TooManyRedirects:
+        print('Too many redirects')
+    except requests.RequestException:
+        print('Request Exception')
+    except ValueError:
+        print('Invalid response')
+    return None
+
+def http_pages(req_url, req_api_key):
+    ''' Generate the items of a paginated list one page at a time. A page that cannot be
+    fetched is generated as None and ends the list '''
+    params = {'pageLimit': HTTP_PAGE_LIMIT}
+    while True:
+        resp = http_req(req_url, req_api_key, params)
+        if resp is None:
+            yield None
+            return
+        yield resp.get('items', [])
+        if not resp.get('pageNextToken'):
+            return
+        params['pageNextToken'] = resp['pageNextToken']
+
+def pick_device(pages, on_page, on_complete):
+    ''' Let the user pick a gateway device while the device list pages are still arriving.
+    on_page is called as each page arrives and on_complete with the full device list once the
+    last page has arrived '''
+    devices = []
+    lock = threading.Lock()
+    picked = threading.Event()
+
+    def receive():
+        received = []
+        for page in pages:
+            if page is None:
+                print('Device list incomplete')
+                return
+            on_page()
+            for device in page:
+                received.append(device)
+                with lock:
+                    if picked.is_set():
+                        continue
+                    devices.append(device['id'])
+                    print(str(len(devices)) + '. ' + device['id'])
+                    print('    Device Name: ' + device['name'])
+                    print('    Type       : ' + device['type'])
+                    print('    Created On : ' + device['$meta']['createdAt'])
+                    print('    Version    : ' + device['$meta']['version'])
+        on_complete(received)
+        with lock:
+            if not picked.is_set():
+                print('\n' + str(len(devices)) + ' devices listed\n\n>', end='')
+
+    print('\nSelect which gateway device to interface with:')
+    threading.Thread(target=receive, daemon=True).start()
+    while True:
+        choice = input('\n>')
+        if choice.lower() in ('exit', 'quit', 'back', 'return'):
+            return None
+        with lock:
+            try:
+                choice = int(choice)
+            except ValueError:
+                choice = 0
+            if 1 <= choice <= len(devices):
+                picked.set()
+                return devices[choice - 1]
+            if len(devices) == 0:
+                print('No devices listed yet')
+                continue
+            print('Invalid choice. You must enter a number between 1 and ' + str(len(devices)))
 
 def main_menu():
     ''' Main menu for CLI. Runs as a thread '''
-    global sem;
     global live;
 
-    sem.acquire()
     while live:
-        menu_options = [
-                'View unprovisioned device beacons',
-                'Provision device',
-                'Configure network subnets',
-                'Configure network application keys',
-                'Health client interface',
-                'View network nodes',
-                'Discover a network node',
-                'Configure a network node',
-                'Reset a network node',
-                'Configure mesh model subscriptions',
-                'Send mesh model message',
-                'Quit'
-                ]
+        menu_options = MAIN_MENU
 
         print("MAIN MENU")
         print("Select from the following options:")
@@ -201,6 +410,8 @@ def main_menu():
             beacons.request_beacons()
         elif menu_options[choice] == 'Provision device':
             provision.provision()
+        elif menu_options[choice] == 'Provision devices from a manifest':
+            provision.provision_batch()
         elif menu_options[choice] == 'Configure network subnets':
             subnets.menu()
         elif menu_options[choice] == 'Configure network application keys':
@@ -211,80 +422,422 @@ def main_menu():
             nodes.get()
         elif menu_options[choice] == 'Discover a network node':
             node.discover()
+        elif menu_options[choice] == 'Discover all network nodes':
+            node.discover_all()
         elif menu_options[choice] == 'Configure a network node':
             node.configure()
+        elif menu_options[choice] == 'Apply a network configuration file':
+            planner.menu()
         elif menu_options[choice] == 'Reset a network node':
             reset.reset()
         elif menu_options[choice] == 'Configure mesh model subscriptions':
             subscriptions.menu()
         elif menu_options[choice] == 'Send mesh model message':
             models.send_msg()
+        elif menu_options[choice] == 'Send mesh model message to many destinations':
+            models.send_bulk()
+        elif menu_options[choice] == 'View received message analytics':
+            ingest.report()
+        elif menu_options[choice] == 'View operation latency':
+            latency.report()
+            export_metrics()
+        elif menu_options[choice] == 'View session statistics':
+            print_stats()
         elif menu_options[choice] == 'Quit':
             live = False
 
-print('nRF Cloud Bluetooth Mesh Gateway Interface')
-args = parse_args()
-verbose = args.verbose
-api_key = args.apikey
-device_id = args.deviceid
-
-if api_key is None:
-    api_key = input("Enter your nRF Cloud API key: ")
-
-print('\nQuerying nRF Cloud for account details...')
-resp = http_req(ACC_URL, api_key)
-mqtt_endpoint = resp['mqttEndpoint']
-mqtt_topic_prefix = resp['mqttTopicPrefix']
-
-client_id = mqtt_topic_prefix[mqtt_topic_prefix.index('/')+1:]
-client_id = client_id[:client_id.index('/')]
-client_id = 'account-' + client_id
-
-print('    MQTT Endpoint    : ' + mqtt_endpoint)
-print('    MQTT Topix Prefix: ' + mqtt_topic_prefix)
-print('    MQTT Client ID   : ' + client_id)
-
-print('\nQuerying nRF Cloud for account devices...')
-resp = http_req(DEV_URL, api_key)
-device_list = []
-for device in resp['items']:
-    device_list.append(device['id'])
-    print('    Device ID  : ' + device['id'])
-    print('    Device Name: ' + device['name'])
-    print('    Type       : ' + device['type'])
-    print('    Created On : ' + device['$meta']['createdAt'])
-    print('    Version    : ' + device['$meta']['version'] + '\n')
-
-if device_id is None:
-    print ('\nSelect which gateway device to interface with:')
-    device = get_choice(device_list)
-    if device is None or device == -1:
-        sys.exit()
-    device_id = device_list[int(device)]
-
-g2c_topic = mqtt_topic_prefix + 'm/d/' + device_id + '/d2c'
-c2g_topic = mqtt_topic_prefix + 'm/d/' + device_id + '/c2d'
-print('    Cloud-to-Gateway MQTT Topic: ' + c2g_topic)
-print('    Gateway-to-Cloud MQTT Topic: ' + g2c_topic)
-
-print('\nConnecting to MQTT broker...\n')
-client = mqtt.Client(client_id)
-client.on_connect = on_connect
-client.on_message = on_message
-client.on_subscribe = on_subscribe
-client.tls_set(ca_certs = './credentials/caCert.crt', certfile = './credentials/clientCert.crt',\
-        keyfile = './credentials/privateKey.key', cert_reqs=mqtt.ssl.CERT_REQUIRED,\
-        tls_version=mqtt.ssl.PROTOCOL_TLS, ciphers=None)
-client.connect(mqtt_endpoint, PORT, KEEP_ALIVE)
-if not sem.acquire():
-    print('nRF Cloud connection timed out. Try again later.')
-    sys.exit()
-
-main_menu_thread = threading.Thread(target=main_menu)
-main_menu_thread.start()
-
-while live:
-    client.loop()
-
-main_menu_thread.join()
-print("Exiting...")
+def print_stats():
+    ''' Print session statistics '''
+    recent, overall = selector.rate()
+    print('SESSION STATISTICS')
+    print('    Network loop iterations/s (since last view): ' + '{:.2f}'.format(recent))
+    print('    Network loop iterations/s (session)        : ' + '{:.2f}'.format(overall))
+    print('    Network loop wakeups with ready I/O        : ' + str(selector.wakeups))
+    print('    MQTT reconnects                            : ' + str(session.reconnects))
+    print('    Pending gateway requests                   : ' + str(pending.count()))
+    print('    Inventory cache hits                       : ' + str(inventory.hits))
+    print('    Inventory cache misses                     : ' + str(inventory.misses))
+    print('    Node discovery cache hits                  : ' + str(node.cache.hits))
+    print('    Node discovery cache misses                : ' + str(node.cache.misses))
+    print('    Node discovery cache entries               : ' + str(len(node.cache)) +
+            ' (TTL ' + '{:g}'.format(node.cache.ttl) + ' s)')
+    print('    Gateway message JSON backend               : ' + codec.backend)
+    print('    Gateway messages received                  : ' + str(codec.received))
+    print('    Gateway messages skipped without parsing   : ' + str(codec.skipped))
+    print('    Gateway messages that failed to parse      : ' + str(codec.errors))
+    print('    Gateway message parse time mean/max (us)   : ' +
+            '{:.1f}'.format(codec.parse_mean() * 1e6) + ' / ' +
+            '{:.1f}'.format(codec.parse_max * 1e6))
+    print('    Event queue policy                         : ' + events.policy)
+    print('    Event queue depth now/max/size             : ' + str(events.depth()) + ' / ' +
+            str(events.max_depth) + ' / ' + str(events.size))
+    print('    Events handled                             : ' + str(events.handled))
+    print('    Events dropped with a full queue           : ' + str(events.dropped))
+    print('    Events that waited for a full queue        : ' + str(events.blocked))
+    print()
+
+def load_snapshot(path):
+    ''' Open the topology snapshot of the gateway and seed the caches with it. Returns True if
+    a previous session left a topology to start from '''
+    try:
+        store.open(path, device_id)
+    except sqlite3.Error as err:
+        print('Could not open topology snapshot ' + path + ': ' + str(err))
+        return False
+    node_list = store.load_node_list()
+    if len(node_list) == 0:
+        return False
+    inventory.update('node_list', node_list)
+    addresses.rebuild(node_list)
+    discovered = store.load_nodes()
+    # Snapshot results keep the age of their discovery, so they expire from the cache as if
+    # this session had discovered them
+    offset = time.monotonic() - time.time()
+    for details, discovered_at in discovered:
+        node.cache.put(details['address'], details, discovered_at + offset)
+    print('    Topology snapshot: ' + str(len(node_list)) + ' nodes, ' + str(len(discovered)) +
+            ' discovered')
+    return True
+
+async def reconcile_snapshot():
+    ''' Bring the topology snapshot up to date with the gateway in the background '''
+    node_list = await nodes.fetch()
+    if node_list is None:
+        return
+    node_addresses = [details['address'] for details in node_list if details['address'] != 1]
+    results = await node.discover_sweep(node_addresses)
+    failed = len([address for address, details, _ in results if details is None])
+    print('\nTopology snapshot reconciled: ' + str(len(results) - failed) + ' of ' +
+            str(len(results)) + ' nodes discovered')
+
+def startup_phase(name, start):
+    ''' Record how long a startup phase took. Returns the end time of the phase '''
+    end = time.monotonic()
+    startup_phases.append((name, end - start))
+    return end
+
+def print_startup():
+    ''' Print the time taken by each startup phase '''
+    print('STARTUP PHASES')
+    for name, elapsed in startup_phases:
+        print('    ' + '{:<18}'.format(name) + ': ' + '{:.3f}'.format(elapsed) + ' s')
+    print('    ' + '{:<18}'.format('Total') + ': ' +
+            '{:.3f}'.format(sum(elapsed for _, elapsed in startup_phases)) + ' s')
+    print()
+
+def replay_journal(directory):
+    ''' Handle the events recorded in a journal directory as if they had just arrived '''
+    if not os.path.isdir(directory):
+        sys.exit('Cannot replay journal: ' + directory + ' is not a directory')
+    loop = asyncio.new_event_loop()
+    # Handlers complete requests on the event loop, none are pending during a replay
+    pending.attach(loop)
+
+    async def replay():
+        count = 0
+        for timestamp, payload in mesh_journal.replay(directory):
+            event = decode_event(bytes(payload), timestamp)
+            if event is None:
+                continue
+            count += 1
+            print('\n[' + datetime.datetime.fromtimestamp(timestamp).isoformat(' ',
+                'milliseconds') + ']')
+            handle_event(event)
+        return count
+
+    try:
+        count = loop.run_until_complete(replay())
+    except (OSError, ValueError) as err:
+        sys.exit('Cannot replay journal: ' + str(err))
+    finally:
+        loop.close()
+    print('\nReplayed ' + str(count) + ' events from ' + directory)
+
+def export_metrics():
+    ''' Write the operation latency statistics to the --metrics file, if there is one '''
+    if metrics_path is None:
+        return
+    try:
+        latency.export(metrics_path)
+    except OSError as err:
+        print('Could not write metrics to ' + metrics_path + ': ' + str(err))
+
+async def export_metrics_loop():
+    ''' Keep the --metrics file up to date for a Prometheus textfile collector '''
+    while True:
+        await asyncio.sleep(METRICS_INTERVAL)
+        export_metrics()
+
+def run_menu(loop):
+    ''' Run the main menu and stop the session when the user quits '''
+    try:
+        main_menu()
+    finally:
+        loop.call_soon_threadsafe(stopping.set)
+
+async def run_soak(soak):
+    ''' Run a soak test on the network nodes with the console output of event handlers
+    discarded. Returns False if the gateway did not answer '''
+    # Acknowledged model messages are answered to the gateway's own address
+    if await subscriptions.subscribe([1]) is None:
+        return False
+    found = await nodes.fetch()
+    if found is None:
+        return False
+    addresses = [found_node['address'] for found_node in found if found_node['address'] != 1]
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        await soak.run(addresses or [1], stopping)
+    return True
+
+def soak_operations():
+    ''' Get the operations a soak test repeats as (name, coroutine function) pairs. Each
+    function gets a node address, its coroutine returns None if the gateway did not answer '''
+    onoff_get = mesh_models.MODEL_MSG_OPCODES['Generic OnOff Get']
+
+    async def model_message(address):
+        return (await models.fan_out(0, 0, [address], onoff_get, b''))[0][1]
+
+    return [
+            ('node_request', lambda _address: nodes.fetch()),
+            ('node_discover', node.fetch),
+            ('health_fault_get', lambda address: health.fault_get(address, 0, 0x0059)),
+            ('subnet_request', lambda _address: subnets.fetch()),
+            ('subscribe_list_request', lambda _address: subscriptions.fetch()),
+            ('send_model_message', model_message)
+            ]
+
+async def run_session(mqtt_endpoint, client_id, reconcile, simulate=None,
+        sim_latency=mesh_sim.LATENCY, faults=None, soak=None):
+    ''' Run the MQTT session on the event loop while the main menu runs in its own thread. With
+    simulate set, the session talks to a local simulated gateway with that many nodes, which
+    answer after sim_latency seconds and whose events go through the faults injector if given.
+    With soak set, the soak test runs instead of the menu '''
+    global client
+    global subscribed
+    global stopping
+    global session
+
+    loop = asyncio.get_running_loop()
+    pending.attach(loop)
+    subscribed = asyncio.Event()
+    stopping = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stopping.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    print('\nConnecting to MQTT broker...\n')
+    start = time.monotonic()
+    events.start()
+    if simulate is None:
+        client = mqtt.Client(client_id)
+        client.tls_set(ca_certs = './credentials/caCert.crt',\
+                certfile = './credentials/clientCert.crt',\
+                keyfile = './credentials/privateKey.key', cert_reqs=mqtt.ssl.CERT_REQUIRED,\
+                tls_version=mqtt.ssl.PROTOCOL_TLS, ciphers=None)
+        session = mqtt_loop.Mqtt_Loop(loop, client, KEEP_ALIVE)
+    else:
+        broker = mesh_sim.Local_Broker()
+        mesh_sim.Virtual_Gateway(loop, broker, c2g_topic, g2c_topic, simulate, sim_latency,
+                faults=faults)
+        client = mesh_sim.Local_Client(loop, broker, client_id)
+        session = mesh_sim.Local_Session(client)
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.on_subscribe = on_subscribe
+    client.connect(mqtt_endpoint, PORT, KEEP_ALIVE)
+
+    try:
+        await asyncio.wait_for(subscribed.wait(), sync_sem.Requests.TIMEOUT)
+    except asyncio.TimeoutError:
+        print('nRF Cloud connection timed out. Try again later.')
+    else:
+        startup_phase('MQTT connection', start)
+        if verbose:
+            print_startup()
+        if reconcile:
+            loop.create_task(reconcile_snapshot())
+        if metrics_path is not None:
+            loop.create_task(export_metrics_loop())
+        if soak is not None:
+            if not await run_soak(soak):
+                print('Simulated gateway did not answer, soak test not run')
+        else:
+            # The menu blocks on input(), so it runs as a daemon thread that cannot hold up exit
+            threading.Thread(target=run_menu, args=(loop,), daemon=True).start()
+            await stopping.wait()
+    await session.disconnect()
+    events.stop(sync_sem.Requests.TIMEOUT)
+
+def cloud_details(args):
+    ''' Get the MQTT endpoint and topic prefix of the nRF Cloud account, and the gateway device
+    to use. Returns the endpoint, topic prefix, client ID and the start of the next startup
+    phase '''
+    global api_key
+    global device_id
+
+    api_key = args.apikey
+    device_id = args.deviceid
+
+    if api_key is None:
+        api_key = input("Enter your nRF Cloud API key: ")
+
+    cache = account_cache.Account_Cache(args.state_dir, api_key, args.cache_max_age)
+    start = time.monotonic()
+    account = None if args.refresh else cache.get('account')
+    if account is None:
+        print('\nQuerying nRF Cloud for account details...')
+        resp = http_req(ACC_URL, api_key)
+        if resp is None:
+            sys.exit('Could not get account details from nRF Cloud')
+        account = {
+                'mqttEndpoint': resp['mqttEndpoint'],
+                'mqttTopicPrefix': resp['mqttTopicPrefix']
+                }
+        cache.put('account', account)
+    else:
+        print('\nUsing cached account details...')
+    mqtt_endpoint = account['mqttEndpoint']
+    mqtt_topic_prefix = account['mqttTopicPrefix']
+    start = startup_phase('Account details', start)
+
+    client_id = mqtt_topic_prefix[mqtt_topic_prefix.index('/')+1:]
+    client_id = client_id[:client_id.index('/')]
+    client_id = 'account-' + client_id
+
+    print('    MQTT Endpoint    : ' + mqtt_endpoint)
+    print('    MQTT Topix Prefix: ' + mqtt_topic_prefix)
+    print('    MQTT Client ID   : ' + client_id)
+
+    if device_id is None:
+        devices = None if args.refresh else cache.get('devices')
+        if devices is None:
+            print('\nQuerying nRF Cloud for account devices...')
+            pages = http_pages(DEV_URL, api_key)
+        else:
+            print('\nCached account devices (use --refresh to update):')
+            pages = [devices]
+
+        def device_page():
+            if not any(name == 'First device page' for name, _ in startup_phases):
+                startup_phase('First device page', start)
+
+        def devices_listed(received):
+            if devices is None:
+                cache.put('devices', [{
+                    'id': device['id'],
+                    'name': device['name'],
+                    'type': device['type'],
+                    '$meta': {
+                        'createdAt': device['$meta']['createdAt'],
+                        'version': device['$meta']['version']
+                        }
+                    } for device in received])
+
+        device_id = pick_device(pages, device_page, devices_listed)
+        if device_id is None:
+            sys.exit()
+        # Time spent waiting for the user is not part of startup
+        start = time.monotonic()
+    return mqtt_endpoint, mqtt_topic_prefix, client_id, start
+
+def main():
+    global verbose
+    global device_id
+    global c2g_topic
+    global g2c_topic
+    global selector
+    global codec
+    global events
+    global metrics_path
+
+    print('nRF Cloud Bluetooth Mesh Gateway Interface')
+    args = parse_args()
+    verbose = args.verbose
+    metrics_path = args.metrics
+    try:
+        codec = json_codec.Json_Codec(byte_codec.wire_default, args.json_backend)
+    except ValueError as err:
+        sys.exit(str(err))
+    events = event_queue.Event_Queue(handle_event, max(args.event_queue, 1), args.event_policy)
+    if args.ingest is not None:
+        try:
+            ingest.open(args.ingest, max(args.ingest_batch, 1))
+        except (OSError, ValueError) as err:
+            sys.exit('Cannot ingest messages: ' + str(err))
+
+    if args.replay is not None:
+        replay_journal(args.replay)
+        ingest.flush()
+        return
+    node.cache.ttl = args.discover_ttl
+    if args.soak is not None and args.simulate is None:
+        sys.exit('A soak test needs a simulated gateway, use --simulate')
+    if args.simulate is None:
+        mqtt_endpoint, mqtt_topic_prefix, client_id, start = cloud_details(args)
+    else:
+        print('\nSimulating a gateway with ' + str(args.simulate) + ' nodes...')
+        mqtt_endpoint = 'localhost'
+        mqtt_topic_prefix = mesh_sim.TOPIC_PREFIX
+        client_id = 'simulator'
+        device_id = mesh_sim.DEVICE_ID
+        start = time.monotonic()
+
+    g2c_topic = mqtt_topic_prefix + 'm/d/' + device_id + '/d2c'
+    c2g_topic = mqtt_topic_prefix + 'm/d/' + device_id + '/c2d'
+    print('    Cloud-to-Gateway MQTT Topic: ' + c2g_topic)
+    print('    Gateway-to-Cloud MQTT Topic: ' + g2c_topic)
+
+    reconcile = False
+    # A simulated topology must not end up in the state directory of real gateways
+    if not args.no_snapshot and args.simulate is None:
+        reconcile = load_snapshot(os.path.join(args.state_dir, 'topology.db'))
+    startup_phase('Topology snapshot', start)
+
+    if args.journal is not None:
+        try:
+            journal.open(args.journal, max(int(args.journal_size * 1024 * 1024), 1),
+                    args.journal_compress)
+        except OSError as err:
+            sys.exit('Cannot open journal: ' + str(err))
+
+    selector = mqtt_loop.Counting_Selector()
+    loop = asyncio.SelectorEventLoop(selector)
+    faults = None
+    rates = {fault: getattr(args, 'fault_' + fault) for fault in mesh_sim.FAULTS}
+    if args.simulate is not None and any(rates.values()):
+        try:
+            faults = mesh_sim.Fault_Injector(loop, **rates)
+        except ValueError as err:
+            sys.exit(str(err))
+    soak = None
+    if args.soak is not None:
+        soak = mesh_soak.Soak(soak_operations(), pending, args.soak, args.soak_interval,
+                out=sys.stdout, output=args.soak_output)
+    try:
+        loop.run_until_complete(run_session(mqtt_endpoint, client_id, reconcile,
+            args.simulate, args.sim_latency, faults, soak))
+    finally:
+        tasks = asyncio.all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        loop.close()
+        store.close()
+        ingest.flush()
+        journal.close()
+        export_metrics()
+    if verbose:
+        print_stats()
+        latency.report()
+    if faults is not None:
+        print('Injected faults: ' + ', '.join(fault + ' ' + str(count)
+            for fault, count in faults.counts.items()) + ' of ' + str(faults.sent) + ' events')
+    if soak is not None and not soak.report():
+        sys.exit(1)
+    print("Exiting...")
+
+if __name__ == '__main__':
+    main()
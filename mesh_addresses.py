@@ -0,0 +1,179 @@
+''' Bluetooth mesh unicast address allocation module '''
+import threading
+
+UNICAST_MIN = 0x0001
+UNICAST_MAX = 0x7FFF
+
+class Address_Allocator():
+    ''' Index of the unicast address ranges occupied by nodes. A segment tree over the unicast
+    address space tracks the longest free run of each subtree, so the first free block of a
+    given size is found, and ranges are assigned or released, in O(log n). Finding the nodes
+    that overlap a block takes O(block size + largest element count). Safe to use from any
+    thread '''
+    __SIZE = UNICAST_MAX - UNICAST_MIN + 1
+    __FREE = 0
+    __USED = 1
+
+    def __init__(self):
+        size = 4 * self.__SIZE
+        # Longest free run starting at the left edge, ending at the right edge and anywhere
+        self.__pre = [0] * size
+        self.__suf = [0] * size
+        self.__best = [0] * size
+        # Number of free addresses and of separate free runs
+        self.__free = [0] * size
+        self.__runs = [0] * size
+        # Pending assignment of a whole subtree, None if there is none
+        self.__lazy = [None] * size
+        # (element count, UUID) of the known nodes and of the blocks held for devices that are
+        # not provisioned yet, by start address
+        self.__owners = {}
+        self.__held = {}
+        self.__max_count = 1
+        self.__lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        ''' Mark every unicast address free and forget the held blocks '''
+        with self.__lock:
+            self.__held = {}
+            self.__reset()
+
+    def rebuild(self, node_list):
+        ''' Rebuild the index from a node list received from the gateway. Held blocks that no
+        listed node overlaps stay assigned, the rest are forgotten '''
+        with self.__lock:
+            self.__reset()
+            for node in node_list:
+                self.assign(node['address'], node['elementCount'], node.get('uuid'))
+            for address, (count, uuid) in list(self.__held.items()):
+                if self.conflicts(address, count):
+                    del self.__held[address]
+                else:
+                    self.assign(address, count, uuid)
+
+    def assign(self, address, count, uuid=None):
+        ''' Mark the addresses of a node with count elements as used '''
+        with self.__lock:
+            self.__owners[address] = (count, uuid)
+            self.__max_count = max(self.__max_count, count)
+            self.__update(address, count, self.__USED)
+
+    def hold(self, address, count, uuid=None):
+        ''' Assign a block of count addresses to a device that is about to be provisioned. The
+        block stays assigned across rebuilds from node lists until it is released '''
+        with self.__lock:
+            self.__held[address] = (count, uuid)
+            self.assign(address, count, uuid)
+
+    def release(self, address, count):
+        ''' Mark the addresses of a node or held block with count elements as free '''
+        with self.__lock:
+            self.__owners.pop(address, None)
+            self.__held.pop(address, None)
+            self.__update(address, count, self.__FREE)
+
+    def first_fit(self, count):
+        ''' Get the lowest address of a free block of count addresses. Returns None if the
+        address space has no such block '''
+        with self.__lock:
+            if count < 1 or self.__best[1] < count:
+                return None
+            return UNICAST_MIN + self.__find(1, 0, self.__SIZE - 1, count)
+
+    def reserve(self, count, uuid=None):
+        ''' Hold the lowest free block of count addresses. Returns None if there is none '''
+        with self.__lock:
+            address = self.first_fit(count)
+            if address is not None:
+                self.hold(address, count, uuid)
+            return address
+
+    def conflicts(self, address, count):
+        ''' Get the (address, element count, uuid) of the known nodes and held blocks whose
+        addresses overlap a block of count addresses '''
+        with self.__lock:
+            found = []
+            # Only a node starting at most the largest element count below the block can
+            # reach into it
+            for start in range(max(address - self.__max_count + 1, UNICAST_MIN),
+                    address + count):
+                owner = self.__owners.get(start)
+                if owner is not None and start + owner[0] - 1 >= address:
+                    found.append((start, owner[0], owner[1]))
+            return found
+
+    def fragmentation(self):
+        ''' Get the number of free addresses, the number of free runs, the longest free run and
+        the fraction of free addresses outside the longest free run '''
+        with self.__lock:
+            free = self.__free[1]
+            largest = self.__best[1]
+            runs = self.__runs[1]
+        fragmentation = 1 - largest / free if free else 0
+        return free, runs, largest, fragmentation
+
+    def __reset(self):
+        self.__owners = {}
+        self.__max_count = 1
+        self.__set(1, 0, self.__SIZE - 1, self.__FREE)
+
+    def __update(self, address, count, state):
+        first = max(address, UNICAST_MIN) - UNICAST_MIN
+        last = min(address + count - 1, UNICAST_MAX) - UNICAST_MIN
+        if first <= last:
+            self.__assign(1, 0, self.__SIZE - 1, first, last, state)
+
+    def __set(self, idx, low, high, state):
+        length = high - low + 1 if state == self.__FREE else 0
+        self.__pre[idx] = self.__suf[idx] = self.__best[idx] = self.__free[idx] = length
+        self.__runs[idx] = 1 if length else 0
+        self.__lazy[idx] = state
+
+    def __push(self, idx, low, high):
+        state = self.__lazy[idx]
+        if state is not None and low != high:
+            mid = (low + high) // 2
+            self.__set(2 * idx, low, mid, state)
+            self.__set(2 * idx + 1, mid + 1, high, state)
+        self.__lazy[idx] = None
+
+    def __pull(self, idx, low, high):
+        mid = (low + high) // 2
+        left, right = 2 * idx, 2 * idx + 1
+        left_len, right_len = mid - low + 1, high - mid
+        pre, suf = self.__pre, self.__suf
+        pre[idx] = pre[left] + pre[right] if pre[left] == left_len else pre[left]
+        suf[idx] = suf[right] + suf[left] if suf[right] == right_len else suf[right]
+        self.__best[idx] = max(self.__best[left], self.__best[right], suf[left] + pre[right])
+        self.__free[idx] = self.__free[left] + self.__free[right]
+        self.__runs[idx] = self.__runs[left] + self.__runs[right]
+        if suf[left] and pre[right]:
+            self.__runs[idx] -= 1
+
+    def __assign(self, idx, low, high, first, last, state):
+        if first <= low and high <= last:
+            self.__set(idx, low, high, state)
+            return
+        self.__push(idx, low, high)
+        mid = (low + high) // 2
+        if first <= mid:
+            self.__assign(2 * idx, low, mid, first, last, state)
+        if last > mid:
+            self.__assign(2 * idx + 1, mid + 1, high, first, last, state)
+        self.__pull(idx, low, high)
+
+    def __find(self, idx, low, high, count):
+        ''' Get the offset of the first free run of at least count addresses in a subtree whose
+        longest free run is known to be long enough '''
+        if low == high:
+            return low
+        self.__push(idx, low, high)
+        mid = (low + high) // 2
+        left, right = 2 * idx, 2 * idx + 1
+        if self.__best[left] >= count:
+            return self.__find(left, low, mid, count)
+        if self.__suf[left] + self.__pre[right] >= count:
+            return mid - self.__suf[left] + 1
+        return self.__find(right, mid + 1, high, count)
+
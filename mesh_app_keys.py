@@ -10,19 +10,15 @@ class App_Keys():
             'Get Application Keys'
             ]
     __APP_KEY_REQ = {
-            'id': 'randomId',
-            'type': 'operation',
-            'operation': {
-                'type': 'app_key_request'
-                }
+            'type': 'app_key_request'
             }
     __app_keys = [dict]
 
-    def __init__(self, sem, subnets, get_choice, publish):
-        self.__sem = sem
+    def __init__(self, pending, inventory, subnets, get_choice):
+        self.__pending = pending
+        self.__inventory = inventory
         self.__subnets = subnets
         self.__get_choice = get_choice
-        self.__publish = publish
 
     def __print(self):
         ''' Print the list of current application keys '''
@@ -36,12 +32,13 @@ class App_Keys():
 
     def get_choice(self):
         ''' Get an application key selection from the user '''
-        print('Acquiring application keys from gateway...')
-        self.__publish(self.__APP_KEY_REQ)
-        if not self.__sem.acquire():
+        if not self.__inventory.fresh('app_key_list'):
+            print('Acquiring application keys from gateway...')
+        app_keys = self.__pending.run(self.lookup())
+        if app_keys is None:
             return None
         choices = []
-        for app_key in self.__app_keys:
+        for app_key in app_keys:
             choices.append(uint16(app_key['appIndex']))
         if len(choices) == 0:
             print(
@@ -55,12 +52,61 @@ class App_Keys():
             choice = self.__get_choice(choices)
         if choice is None or choice == -1:
              return choice
-        return self.__app_keys[choice]['appIndex']
+        return app_keys[choice]['appIndex']
+
+    async def __request(self, operation):
+        event = await self.__pending.request(operation, 'app_key_list')
+        if event is None:
+            return None
+        return event['appKeyList']
+
+    async def fetch(self):
+        ''' Request the list of application keys from the gateway '''
+        return await self.__request(self.__APP_KEY_REQ)
+
+    async def lookup(self):
+        ''' Get the list of application keys from the inventory cache, requesting it from the
+        gateway if the cached list is stale '''
+        app_keys = self.__inventory.get('app_key_list')
+        if app_keys is None:
+            app_keys = await self.fetch()
+        return app_keys
+
+    async def add(self, app_key, app_idx, net_idx):
+        ''' Add an application key with a known key value to the gateway '''
+        app_key_add = {
+                'type': 'app_key_add',
+                'appKey': app_key,
+                'appIndex': app_idx,
+                'netIndex': net_idx
+                }
+        self.__inventory.invalidate('app_key_list')
+        return await self.__request(app_key_add)
+
+    async def generate(self, app_idx, net_idx):
+        ''' Have the gateway generate an application key '''
+        app_key_gen = {
+                'type': 'app_key_generate',
+                'appIndex': app_idx,
+                'netIndex': net_idx
+                }
+        self.__inventory.invalidate('app_key_list')
+        return await self.__request(app_key_gen)
+
+    async def delete(self, app_idx):
+        ''' Delete an application key from the gateway '''
+        app_key_del = {
+                'type': 'app_key_delete',
+                'appIndex': app_idx
+                }
+        self.__inventory.invalidate('app_key_list')
+        return await self.__request(app_key_del)
 
     def evt(self, event):
         ''' Receive an application key list from the gateway '''
         self.__app_keys = event['appKeyList'].copy()
-        self.__sem.release()
+        self.__inventory.update('app_key_list', self.__app_keys)
+        self.__pending.complete(event)
 
     def menu(self):
         print('APPLICATION KEY CONFIGURATION MENU')
@@ -75,19 +121,8 @@ class App_Keys():
             app_key = input('\nEnter 128-bit application key in hexadecimal format: ')
             app_idx = int(
                     input('Enter unsigned 16-bit application index for the application key: '), 0)
-            app_key_add = {
-                    'id': 'randomId',
-                    'type': 'operation',
-                    'operation': {
-                        'type': 'app_key_add',
-                        'appKey': app_key,
-                        'appIndex': app_idx,
-                        'netIndex': net_idx
-                        }
-                    }
             print('Adding application key...')
-            self.__publish(app_key_add)
-            if not self.__sem.acquire():
+            if self.__pending.run(self.add(app_key, app_idx, net_idx)) is None:
                 return
             self.__print()
 
@@ -97,27 +132,17 @@ class App_Keys():
                 return net_idx
             app_idx = int(
                     input('\nEnter unsigned 16-bit application index for the application key: '), 0)
-            app_key_gen = {
-                    'id': 'randomId',
-                    'type': 'operation',
-                    'operation': {
-                        'type': 'app_key_generate',
-                        'appIndex': app_idx,
-                        'netIndex': net_idx
-                        }
-                    }
             print('Generating application key...')
-            self.__publish(app_key_gen)
-            if not self.__sem.acquire():
+            if self.__pending.run(self.generate(app_idx, net_idx)) is None:
                 return
             self.__print()
 
         elif self.__MENU_CHOICES[choice] == 'Delete Application Key':
-            self.__publish(self.__APP_KEY_REQ)
-            if not self.__sem.acquire():
+            app_keys = self.__pending.run(self.lookup())
+            if app_keys is None:
                 return
             choices = []
-            for app_key in self.__app_keys:
+            for app_key in app_keys:
                 choices.append(uint16(app_key['appIndex']))
             if len(choices) == 0:
                 print('No application keys to delete')
@@ -127,23 +152,13 @@ class App_Keys():
             if choice is None or choice == -1:
                 return choice
             app_idx = int(choices[choice], 0)
-            app_key_del = {
-                    'id': 'randomId',
-                    'type': 'operation',
-                    'operation': {
-                        'type': 'app_key_delete',
-                        'appIndex': app_idx
-                        }
-                    }
             print('Deleting application key...')
-            self.__publish(app_key_del)
-            if not self.__sem.acquire():
+            if self.__pending.run(self.delete(app_idx)) is None:
                 return
             self.__print()
 
         elif self.__MENU_CHOICES[choice] == 'Get Application Keys':
             print('Getting application keys...')
-            self.__publish(self.__APP_KEY_REQ)
-            if not self.__sem.acquire():
+            if self.__pending.run(self.fetch()) is None:
                 return
             self.__print()
@@ -2,18 +2,14 @@
 class Beacons():
     ''' Unprovisioned Bluetooth mesh device beacon gateway interface '''
     __BEACON_REQ = {
-            'id': 'randomId',
-            'type': 'operation',
-            'operation': {
-                'type': 'beacon_request'
-                }
+            'type': 'beacon_request'
             }
     __beacons = [dict]
 
-    def __init__(self, sem, get_choice, publish):
-        self.__sem = sem
+    def __init__(self, pending, inventory, get_choice):
+        self.__pending = pending
+        self.__inventory = inventory
         self.__get_choice = get_choice
-        self.__publish = publish
 
     def __print_beacons(self):
         ''' Print the current list of beacons '''
@@ -27,12 +23,13 @@ class Beacons():
             print('    No Beacons\n')
 
     def get_choice(self):
-        print('Acquiring unprovisioned device beacons from gateway...')
-        self.__publish(self.__BEACON_REQ)
-        if not self.__sem.acquire():
+        if not self.__inventory.fresh('beacon_list'):
+            print('Acquiring unprovisioned device beacons from gateway...')
+        beacons = self.__pending.run(self.lookup())
+        if beacons is None:
             return None
         choices = []
-        for beacon in self.__beacons:
+        for beacon in beacons:
             choices.append(beacon['uuid'])
         if len(choices) == 0:
             print('No unprovisioned device beacons to choose from\n')
@@ -41,17 +38,32 @@ class Beacons():
         choice = self.__get_choice(choices)
         if choice is None or choice == -1:
             return choice
-        return self.__beacons[choice]['uuid']
+        return beacons[choice]['uuid']
 
     def request_beacons(self):
         ''' Request a list of unprovisioned beacons from the gateway '''
         print("Acquiring unprovisioned device beacons from gateway...\n")
-        self.__publish(self.__BEACON_REQ)
-        if not self.__sem.acquire():
+        if self.__pending.run(self.fetch()) is None:
             return
         self.__print_beacons()
 
+    async def fetch(self):
+        ''' Request the list of unprovisioned beacons from the gateway '''
+        event = await self.__pending.request(self.__BEACON_REQ, 'beacon_list')
+        if event is None:
+            return None
+        return event['beacons']
+
+    async def lookup(self):
+        ''' Get the list of unprovisioned beacons from the inventory cache, requesting it from
+        the gateway if the cached list is stale '''
+        beacons = self.__inventory.get('beacon_list')
+        if beacons is None:
+            beacons = await self.fetch()
+        return beacons
+
     def evt(self, event):
         ''' Receive beacon list event from gateway '''
         self.__beacons = event['beacons'].copy()
-        self.__sem.release()
+        self.__inventory.update('beacon_list', self.__beacons)
+        self.__pending.complete(event)
@@ -0,0 +1,103 @@
+''' Bluetooth mesh gateway response cache module '''
+import threading
+import time
+
+class Ttl_Cache():
+    ''' Cache whose entries expire after a time-to-live in seconds. Safe to use from any
+    thread '''
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.__entries = {}
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__entries)
+
+    def peek(self, key, max_age=None):
+        ''' Get a cached value that is at most max_age seconds old, by default the cache TTL,
+        without counting a hit or miss. Returns None if there is no such value '''
+        if max_age is None:
+            max_age = self.ttl
+        with self.__lock:
+            entry = self.__entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > max_age:
+            return None
+        return entry[1]
+
+    def get(self, key, max_age=None):
+        ''' Get a cached value that is at most max_age seconds old, by default the cache TTL.
+        Returns None on a miss '''
+        value = self.peek(key, max_age)
+        with self.__lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def age(self, key):
+        ''' Get the number of seconds since a value was obtained. Returns None if there is no
+        cached value '''
+        with self.__lock:
+            entry = self.__entries.get(key)
+        if entry is None:
+            return None
+        return time.monotonic() - entry[0]
+
+    def put(self, key, value, timestamp=None):
+        ''' Store a value in the cache. The timestamp is the time.monotonic() time the value
+        was obtained at, by default now '''
+        now = time.monotonic()
+        with self.__lock:
+            self.__entries[key] = (now if timestamp is None else min(timestamp, now), value)
+
+    def invalidate(self, key):
+        ''' Drop a cached value '''
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    def clear(self):
+        ''' Drop all cached values '''
+        with self.__lock:
+            self.__entries.clear()
+
+class Inventory():
+    ''' Cache of the gateway's subnet, application key, node and beacon lists. Each list is
+    refreshed by its list event and goes stale after a maximum age '''
+    MAX_AGES = {
+            'subnet_list': 300,
+            'app_key_list': 300,
+            'node_list': 60,
+            'beacon_list': 10
+            }
+
+    def __init__(self):
+        self.__cache = Ttl_Cache(0)
+
+    @property
+    def hits(self):
+        return self.__cache.hits
+
+    @property
+    def misses(self):
+        return self.__cache.misses
+
+    def fresh(self, kind):
+        ''' Check if a list is cached and has not gone stale, without counting a hit or miss '''
+        return self.__cache.peek(kind, self.MAX_AGES[kind]) is not None
+
+    def get(self, kind):
+        ''' Get a list if it has not gone stale. Returns None on a miss '''
+        return self.__cache.get(kind, self.MAX_AGES[kind])
+
+    def update(self, kind, items):
+        ''' Store a list received from the gateway '''
+        self.__cache.put(kind, items)
+
+    def invalidate(self, *kinds):
+        ''' Drop lists that an operation is about to change '''
+        for kind in kinds:
+            self.__cache.invalidate(kind)
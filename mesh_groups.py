@@ -0,0 +1,80 @@
+''' Bluetooth mesh group address optimization module '''
+
+class Group_Plan():
+    ''' Destinations that reach a set of target elements with as few messages as possible '''
+    def __init__(self, addresses, groups, unicasts, unknown_nodes):
+        # Requested destination addresses
+        self.addresses = addresses
+        # (group address, [element addresses]) pairs, each element is reached exactly once
+        self.groups = groups
+        # Addresses that are sent to directly
+        self.unicasts = unicasts
+        # Nodes without a current discovery result, so a group could also reach them
+        self.unknown_nodes = unknown_nodes
+
+    def destinations(self):
+        ''' Get the destination addresses and the element addresses that answer each one '''
+        responders = {group: elements for group, elements in self.groups}
+        responders.update({address: [address] for address in self.unicasts})
+        return [group for group, _ in self.groups] + self.unicasts, responders
+
+    def messages(self):
+        ''' Get the number of messages the plan sends '''
+        return len(self.groups) + len(self.unicasts)
+
+    def targets(self):
+        ''' Get the number of messages sending to each requested destination takes '''
+        return len(self.addresses)
+
+class Group_Optimizer():
+    ''' Find the group addresses that reach a set of nodes, using the subscriptions in the
+    current node discovery results '''
+    def __init__(self, nodes, node):
+        self.__nodes = nodes
+        self.__node = node
+
+    async def plan(self, addresses, model_id):
+        ''' Plan how to reach the given model on a list of element addresses. A group address is
+        only used if every element whose model subscribes to it is a destination that no other
+        chosen group reaches. Groups are chosen greedily by the number of destinations they
+        reach. Destinations no group reaches are sent to directly. Only discovery results
+        younger than the discovery cache TTL are used '''
+        node_list = await self.__nodes.lookup()
+        known = {}
+        unknown_nodes = []
+        for details in node_list or []:
+            node = self.__node.cache.get(details['address'])
+            if node is not None:
+                known[details['address']] = node
+            elif details['address'] != 1:
+                unknown_nodes.append(details['address'])
+
+        wanted = set(addresses)
+        targets = set()
+        subscribers = {}
+        for node in known.values():
+            for element in node['elements']:
+                for model in element['sigModels']:
+                    if model['modelId'] != model_id:
+                        continue
+                    if element['address'] in wanted:
+                        targets.add(element['address'])
+                    for sub_addr in model['subscribeAddresses']:
+                        subscribers.setdefault(sub_addr, set()).add(element['address'])
+
+        uncovered = set(targets)
+        groups = []
+        while True:
+            # Groups may not overlap, a message that reaches an element twice is not always
+            # harmless, e.g. Generic Delta Set
+            usable = [group for group, elements in subscribers.items()
+                    if len(elements) > 1 and elements <= uncovered]
+            if len(usable) == 0:
+                break
+            best = max(usable, key=lambda group: (len(subscribers[group]), -group))
+            elements = subscribers.pop(best)
+            groups.append((best, sorted(elements)))
+            uncovered -= elements
+        covered = targets - uncovered
+        unicasts = [address for address in addresses if address not in covered]
+        return Group_Plan(addresses, groups, unicasts, unknown_nodes)
@@ -17,17 +17,11 @@ class Health():
             'Set gateway\'s health client timeout'
             ]
 
-    def __init__(self, sem, app_keys, nodes, get_choice, publish):
-        self.__sem = sem
+    def __init__(self, pending, app_keys, nodes, get_choice):
+        self.__pending = pending
         self.__app_keys = app_keys
         self.__nodes = nodes
         self.__get_choice = get_choice
-        self.__publish = publish
-        self.__reg_faults = []
-        self.__test_id = None
-        self.__divisor = None
-        self.__attn = None
-        self.__timeout = None
 
     def cur_faults_evt(self, event):
         print('Received current health faults:')
@@ -43,21 +37,111 @@ class Health():
             print('        None')
 
     def reg_faults_evt(self, event):
-        self.__test_id = event['testId']
-        self.__reg_faults = event['faults'].copy()
-        self.__sem.release()
+        self.__pending.complete(event)
 
     def period_evt(self, event):
-        self.__divisor = event['divisor']
-        self.__sem.release()
+        self.__pending.complete(event)
 
     def attn_evt(self, event):
-        self.__attn = event['attention']
-        self.__sem.release()
+        self.__pending.complete(event)
 
     def timeout_evt(self, event):
-        self.__timeout = event['timeout']
-        self.__sem.release()
+        self.__pending.complete(event)
+
+    async def __request(self, operation, evt_type, field):
+        if 'address' in operation:
+            event = await self.__pending.request(operation, evt_type,
+                    {'address': operation['address']})
+        else:
+            event = await self.__pending.request(operation, evt_type)
+        if event is None:
+            return None
+        return event[field]
+
+    async def fault_get(self, addr, app_idx, cid):
+        ''' Get the registered faults of a node '''
+        health_fault_get = {
+                'type': 'health_fault_get',
+                'address': addr,
+                'appIndex': app_idx,
+                'companyId': cid
+                }
+        return await self.__request(health_fault_get, 'health_faults_registered', 'faults')
+
+    async def fault_clear(self, addr, app_idx, cid):
+        ''' Clear the registered faults of a node '''
+        health_fault_clear = {
+                'type': 'health_fault_clear',
+                'address': addr,
+                'appIndex': app_idx,
+                'companyId': cid
+                }
+        return await self.__request(health_fault_clear, 'health_faults_registered', 'faults')
+
+    async def fault_test(self, addr, app_idx, cid, tid):
+        ''' Run a self test on a node '''
+        health_fault_test = {
+                'type': 'health_fault_test',
+                'address': addr,
+                'appIndex': app_idx,
+                'companyId': cid,
+                'testId': tid,
+                }
+        return await self.__request(health_fault_test, 'health_faults_registered', 'faults')
+
+    async def period_get(self, addr, app_idx):
+        ''' Get the fast health publish period divisor of a node '''
+        health_period_get = {
+                'type': 'health_period_get',
+                'address': addr,
+                'appIndex': app_idx
+                }
+        return await self.__request(health_period_get, 'health_period', 'divisor')
+
+    async def period_set(self, addr, app_idx, divisor):
+        ''' Set the fast health publish period divisor of a node '''
+        health_period_set = {
+                'type': 'health_period_set',
+                'address': addr,
+                'appIndex': app_idx,
+                'divisor': divisor
+                }
+        return await self.__request(health_period_set, 'health_period', 'divisor')
+
+    async def attention_get(self, addr, app_idx):
+        ''' Get the attention timer of a node '''
+        health_attn_get = {
+                'type': 'health_attention_get',
+                'address': addr,
+                'appIndex': app_idx
+                }
+        return await self.__request(health_attn_get, 'health_attention', 'attention')
+
+    async def attention_set(self, addr, app_idx, attn):
+        ''' Set the attention timer of a node '''
+        health_attn_set = {
+                'type': 'health_attention_set',
+                'address': addr,
+                'appIndex': app_idx,
+                'attention': attn
+                }
+        self.__pending.post(health_attn_set)
+
+    async def client_timeout_get(self):
+        ''' Get the gateway's health client timeout '''
+        health_timeout_get = {
+            'type': 'health_client_timeout_get'
+            }
+        return await self.__request(health_timeout_get, 'health_client_timeout', 'timeout')
+
+    async def client_timeout_set(self, timeout):
+        ''' Set the gateway's health client timeout '''
+        health_timeout_set = {
+            'type': 'health_client_timeout_set',
+            'timeout': timeout
+            }
+        self.__pending.post(health_timeout_set)
+        return await self.client_timeout_get()
 
     def menu(self):
         print('HEALTH CLIENT INTERFACE MENU')
@@ -69,24 +153,14 @@ class Health():
             addr = self.__nodes.get_choice()
             app_key = self.__app_keys.get_choice()
             cid = int(input('Enter unsigned 16-bit company ID: '), 0)
-            health_fault_get = {
-                    'id': 'randomId',
-                    'type': 'operation',
-                    'operation': {
-                        'type': 'health_fault_get',
-                        'address': addr,
-                        'appIndex': app_key,
-                        'companyId': cid
-                        }
-                    }
             print('Getting registered faults...')
-            self.__publish(health_fault_get)
-            if not self.__sem.acquire():
+            faults = self.__pending.run(self.fault_get(addr, app_key, cid))
+            if faults is None:
                 return
-            if not len(self.__reg_faults):
+            if not len(faults):
                 print('    None')
             else:
-                for fault in self.__reg_faults:
+                for fault in faults:
                     print('    - ' + uint8(fault['fault']))
             print()
 
@@ -94,24 +168,14 @@ class Health():
             addr = self.__nodes.get_choice()
             app_key = self.__app_keys.get_choice()
             cid = int(input('Enter unsigned 16-bit company ID: '), 0)
-            health_fault_clear = {
-                    'id': 'randomId',
-                    'type': 'operation',
-                    'operation': {
-                        'type': 'health_fault_clear',
-                        'address': addr,
-                        'appIndex': app_key,
-                        'companyId': cid
-                        }
-                    }
             print('Clearing registered faults...')
-            self.__publish(health_fault_clear)
-            if not self.__sem.acquire():
+            faults = self.__pending.run(self.fault_clear(addr, app_key, cid))
+            if faults is None:
                 return
-            if not len(self.__reg_faults):
+            if not len(faults):
                 print('    None')
             else:
-                for fault in self.__reg_faults:
+                for fault in faults:
                     print('    - ' + uint8(fault))
             print()
             
@@ -120,133 +184,61 @@ class Health():
             app_key = self.__app_keys.get_choice()
             cid = int(input('Enter unsigned 16-bit company ID: '), 0)
             tid = int(input('Enter unsigned 8-bit test ID: '), 0)
-            health_fault_test = {
-                    'id': 'randomId',
-                    'type': 'operation',
-                    'operation': {
-                        'type': 'health_fault_test',
-                        'address': addr,
-                        'appIndex': app_key,
-                        'companyId': cid,
-                        'testId': tid,
-                        }
-                    }
             print('Testing registered faults...')
-            self.__publish(health_fault_test)
-            if not self.__sem.acquire():
+            faults = self.__pending.run(self.fault_test(addr, app_key, cid, tid))
+            if faults is None:
                 return
-            if not len(self.__reg_faults):
+            if not len(faults):
                 print('    None')
             else:
-                for fault in self.__reg_faults:
+                for fault in faults:
                     print('    - ' + uint8(fault))
             print()
 
         elif self.__MENU_CHOICES[choice] == 'Get fast health publish period divisor':
             addr = self.__nodes.get_choice()
             app_key = self.__app_keys.get_choice()
-            health_period_get = {
-                    'id': 'randomId',
-                    'type': 'operation',
-                    'operation': {
-                        'type': 'health_period_get',
-                        'address': addr,
-                        'appIndex': app_key
-                        }
-                    }
             print('Getting fast health period divisor...')
-            self.__publish(health_period_get)
-            if not self.__sem.acquire():
+            divisor = self.__pending.run(self.period_get(addr, app_key))
+            if divisor is None:
                 return
-            print('\n' + uint16(addr) + ' fast health period divisor: ' + uint8(self.__divisor) + '\n')
+            print('\n' + uint16(addr) + ' fast health period divisor: ' + uint8(divisor) + '\n')
 
         elif self.__MENU_CHOICES[choice] == 'Set fast health publish period divisor':
             addr = self.__nodes.get_choice()
             app_key = self.__app_keys.get_choice()
             divisor = int(input('Enter unsigned 8-bit fast period divisor: '))
-            health_period_set = {
-                    'id': 'randomId',
-                    'type': 'operation',
-                    'operation': {
-                        'type': 'health_period_set',
-                        'address': addr,
-                        'appIndex': app_key,
-                        'divisor': divisor
-                        }
-                    }
             print('Setting fast health period divisor...')
-            self.__publish(health_period_set)
-            if not self.__sem.acquire():
+            divisor = self.__pending.run(self.period_set(addr, app_key, divisor))
+            if divisor is None:
                 return
-            print('\n' + uint16(addr) + ' fast health period divisor: ' + uint8(self.__divisor) + '\n')
+            print('\n' + uint16(addr) + ' fast health period divisor: ' + uint8(divisor) + '\n')
 
         elif self.__MENU_CHOICES[choice] == 'Get attention timer':
             addr = self.__nodes.get_choice()
             app_key = self.__app_keys.get_choice()
-            health_attn_get = {
-                    'id': 'randomId',
-                    'type': 'operation',
-                    'operation': {
-                        'type': 'health_attention_get',
-                        'address': addr,
-                        'appIndex': app_key
-                        }
-                    }
             print('Getting attention timer...')
-            self.__publish(health_attn_get)
-            if not self.__sem.acquire():
+            attn = self.__pending.run(self.attention_get(addr, app_key))
+            if attn is None:
                 return
-            print('\n' + uint16(addr) + ' attention timer: ' + uint8(self.__attn) + '\n')
+            print('\n' + uint16(addr) + ' attention timer: ' + uint8(attn) + '\n')
 
         elif self.__MENU_CHOICES[choice] == 'Set attention timer':
             addr = self.__nodes.get_choice()
             app_key = self.__app_keys.get_choice()
             attn =  int(input('Enter unsigned 8-bit attention time: '))
-            health_attn_set = {
-                    'id': 'randomId',
-                    'type': 'operation',
-                    'operation': {
-                        'type': 'health_attention_set',
-                        'address': addr,
-                        'appIndex': app_key,
-                        'attention': attn
-                        }
-                    }
             print('\nSetting attention timer...\n')
-            self.__publish(health_attn_set)
+            self.__pending.run(self.attention_set(addr, app_key, attn))
 
         elif self.__MENU_CHOICES[choice] == 'Get gateway\'s health client timeout':
-            health_timeout_get = {
-                'id': 'randomId',
-                'type': 'operation',
-                'operation': {
-                    'type': 'health_client_timeout_get'
-                    }
-                }
-            self.__publish(health_timeout_get)
-            if not self.__sem.acquire():
+            timeout = self.__pending.run(self.client_timeout_get())
+            if timeout is None:
                 return
-            print('\nGateway health client timeout: ' + uint32(self.__timeout) + '\n')
+            print('\nGateway health client timeout: ' + uint32(timeout) + '\n')
 
         elif self.__MENU_CHOICES[choice] == 'Set gateway\'s health client timeout':
             timeout = int(input('Enter unsigned 32-bit timeout: '))
-            health_timeout_set = {
-                'id': 'randomId',
-                'type': 'operation',
-                'operation': {
-                    'type': 'health_client_timeout_set',
-                    'timeout': timeout
-                    }
-                }
-            self.__publish(health_timeout_set)
-            health_timeout_get = {
-                'id': 'randomId',
-                'type': 'operation',
-                'operation': {
-                    'type': 'health_client_timeout_get'
-                    }
-                }
-            self.__publish(health_timeout_get)
-            if not self.__sem.acquire():
+            timeout = self.__pending.run(self.client_timeout_set(timeout))
+            if timeout is None:
                 return
-            print('\nGateway health client timeout: ' + uint32(self.__timeout) + '\n')
+            print('\nGateway health client timeout: ' + uint32(timeout) + '\n')
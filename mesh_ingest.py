@@ -0,0 +1,244 @@
+''' Received model message ingestion module '''
+import glob
+import os
+import threading
+import time
+from byte_codec import uint16
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Columns every received message has, decoded fields follow as float columns with NaN for absent
+# optional fields
+BASE_COLUMNS = ['timestamp', 'source', 'destination', 'netIndex', 'appIndex', 'opcode']
+SENT_COLUMNS = ['timestamp', 'destination', 'statusOpcode']
+
+class Column_Buffer():
+    ''' Preallocated NumPy columns that rows are appended to until the buffer is full '''
+    def __init__(self, columns, capacity):
+        self.columns = columns
+        self.capacity = capacity
+        self.size = 0
+        self.__arrays = [numpy.empty(capacity, numpy.float64 if column == 'timestamp' or
+            column not in BASE_COLUMNS + SENT_COLUMNS else numpy.int32) for column in columns]
+
+    def append(self, values):
+        ''' Append a row. Returns True if the buffer is now full '''
+        for array, value in zip(self.__arrays, values):
+            array[self.size] = value
+        self.size += 1
+        return self.size == self.capacity
+
+    def arrays(self):
+        ''' Get copies of the filled part of each column by column name '''
+        return {column: array[:self.size].copy()
+                for column, array in zip(self.columns, self.__arrays)}
+
+    def clear(self):
+        ''' Drop every row '''
+        self.size = 0
+
+def concatenate(tables):
+    ''' Join tables with the same columns, given as dictionaries of arrays by column name '''
+    tables = [table for table in tables if len(table)]
+    if len(tables) == 0:
+        return {}
+    return {column: numpy.concatenate([table[column] for table in tables])
+            for column in tables[0]}
+
+def rates(table):
+    ''' Get the sources, message counts and messages per minute of each source over the time
+    the table covers '''
+    sources, counts = numpy.unique(table['source'], return_counts=True)
+    span = max(table['timestamp'].max() - table['timestamp'].min(), 1.0)
+    return sources, counts, counts * 60 / span
+
+def duty_cycles(table, column):
+    ''' Get the sources and the fraction of time each source reported a non-zero state, e.g.
+    present_onoff of Generic OnOff Status. Each state lasts until the next report from the
+    same source '''
+    order = numpy.lexsort((table['timestamp'], table['source']))
+    source = table['source'][order]
+    stamps = table['timestamp'][order]
+    state = table[column][order]
+    same = source[1:] == source[:-1]
+    durations = numpy.where(same, numpy.diff(stamps), 0.0)
+    sources, inverse = numpy.unique(source[:-1], return_inverse=True)
+    total = numpy.bincount(inverse, weights=durations, minlength=len(sources))
+    on = numpy.bincount(inverse, weights=durations * (state[:-1] > 0), minlength=len(sources))
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return sources, numpy.where(total > 0, on / total, numpy.nan)
+
+def latencies(sent, table, opcode, window):
+    ''' Get the sources and the latencies from the last acknowledged message sent to each
+    source to each status with the given opcode that it sent within window seconds '''
+    sent_mask = sent['statusOpcode'] == opcode
+    sent_to = sent['destination'][sent_mask]
+    sent_at = sent['timestamp'][sent_mask]
+    found_sources = []
+    found = []
+    for source in numpy.unique(table['source']):
+        sent_times = numpy.sort(sent_at[sent_to == source])
+        if len(sent_times) == 0:
+            continue
+        received = table['timestamp'][table['source'] == source]
+        idx = numpy.searchsorted(sent_times, received, side='right') - 1
+        delays = received[idx >= 0] - sent_times[idx[idx >= 0]]
+        delays = delays[delays <= window]
+        found_sources.append(numpy.full(len(delays), source))
+        found.append(delays)
+    if len(found) == 0:
+        return numpy.empty(0, numpy.int32), numpy.empty(0)
+    return numpy.concatenate(found_sources), numpy.concatenate(found)
+
+class Ingest():
+    ''' Store received model messages and their decoded fields in NumPy column buffers, one
+    table per opcode, and flush full buffers to .npz files in a directory. Acknowledged
+    messages sent by the CLI are stored too, so status latency can be computed '''
+    BATCH = 4096
+    # Longest time after a sent message that a status is taken as its answer
+    LATENCY_WINDOW = 30
+
+    def __init__(self, decoders, acks):
+        self.__decoders = decoders
+        self.__acks = acks
+        self.__directory = None
+        self.__batch = self.BATCH
+        self.__session = None
+        self.__sequence = 0
+        self.__tables = {}
+        self.__sent = None
+        self.__lock = threading.Lock()
+        self.rows = 0
+        self.files = 0
+
+    def open(self, directory, batch=BATCH):
+        ''' Start storing messages in a directory. Raises ValueError if NumPy is missing '''
+        if numpy is None:
+            raise ValueError('NumPy is required to ingest messages')
+        os.makedirs(directory, exist_ok=True)
+        with self.__lock:
+            self.__directory = directory
+            self.__batch = batch
+            self.__session = time.strftime('%Y%m%d-%H%M%S')
+            self.__sent = Column_Buffer(SENT_COLUMNS, batch)
+
+    def is_open(self):
+        ''' Check if messages are being stored '''
+        return self.__directory is not None
+
+    def add(self, event, record=None, timestamp=None):
+        ''' Store a received model message and its decoded record, if any. The timestamp is the
+        time.time() the message arrived at, by default now '''
+        if self.__directory is None:
+            return
+        opcode = event['opcode']
+        values = [time.time() if timestamp is None else timestamp, event['sourceAddress'],
+                event['destinationAddress'], event['netIndex'], event['appIndex'], opcode]
+        decoder = self.__decoders.get(opcode)
+        fields = []
+        if decoder is not None and record is not None:
+            # Only fixed size fields are numeric, trailing ID lists and bytes are not stored
+            fields = [field.name for field in decoder.fields]
+            values += [numpy.nan if value is None else value
+                    for value in record[:len(fields)]]
+        with self.__lock:
+            table = self.__tables.get(opcode)
+            if table is None or len(table.columns) != len(values):
+                if table is not None:
+                    self.__flush(uint16(opcode), table)
+                table = Column_Buffer(BASE_COLUMNS + fields, self.__batch)
+                self.__tables[opcode] = table
+            self.rows += 1
+            if table.append(values):
+                self.__flush(uint16(opcode), table)
+
+    def sent(self, address, opcode, timestamp=None):
+        ''' Store an acknowledged model message sent to an address. The timestamp is the
+        time.time() the message was sent at, by default now '''
+        if self.__directory is None or opcode not in self.__acks:
+            return
+        with self.__lock:
+            if self.__sent.append([time.time() if timestamp is None else timestamp, address,
+                self.__acks[opcode]]):
+                self.__flush('sent', self.__sent)
+
+    def flush(self):
+        ''' Write every buffered row to the directory '''
+        if self.__directory is None:
+            return
+        with self.__lock:
+            for opcode, table in self.__tables.items():
+                self.__flush(uint16(opcode), table)
+            self.__flush('sent', self.__sent)
+
+    def table(self, name):
+        ''' Get the stored and buffered rows of a table, an opcode or 'sent', as a dictionary
+        of arrays by column name '''
+        prefix = name if name == 'sent' else uint16(name)
+        tables = []
+        for path in sorted(glob.glob(os.path.join(self.__directory, prefix + '-*.npz'))):
+            with numpy.load(path) as data:
+                tables.append({column: data[column] for column in data.files})
+        with self.__lock:
+            buffer = self.__sent if name == 'sent' else self.__tables.get(name)
+            if buffer is not None and buffer.size:
+                tables.append(buffer.arrays())
+        # Tables of one opcode from different versions may differ in their fields
+        columns = set(tables[-1]) if len(tables) else set()
+        return concatenate([table for table in tables if set(table) == columns])
+
+    def opcodes(self):
+        ''' Get the opcodes that have stored or buffered rows '''
+        with self.__lock:
+            found = set(self.__tables)
+        for path in glob.glob(os.path.join(self.__directory, '0x*-*.npz')):
+            found.add(int(os.path.basename(path).split('-')[0], 16))
+        return sorted(found)
+
+    def report(self):
+        ''' Print the per-node rates, duty cycles and status latencies of every table '''
+        if self.__directory is None:
+            print('Message ingestion is off. Start the CLI with --ingest to turn it on\n')
+            return
+        sent = self.table('sent')
+        status_opcodes = set(self.__acks.values())
+        print('RECEIVED MESSAGE ANALYTICS (' + self.__directory + ')')
+        for opcode in self.opcodes():
+            table = self.table(opcode)
+            if len(table) == 0:
+                continue
+            decoder = self.__decoders.get(opcode)
+            name = decoder.name if decoder is not None else 'Unknown message'
+            print('    ' + name + ' (' + hex(opcode) + '): ' + str(len(table['timestamp'])) +
+                    ' messages')
+            sources, counts, per_minute = rates(table)
+            duty = {}
+            if 'present_onoff' in table:
+                duty = dict(zip(*duty_cycles(table, 'present_onoff')))
+            delays = None
+            if opcode in status_opcodes and len(sent):
+                delays = latencies(sent, table, opcode, self.LATENCY_WINDOW)
+            print('        Node    Messages  Per minute  On time  Latency p50/p99 (ms)')
+            for source, count, rate in zip(sources, counts, per_minute):
+                line = '        ' + uint16(source) + '  ' + '{:>8}'.format(count) + '  ' + \
+                        '{:>10.2f}'.format(rate) + '  '
+                on = duty.get(source, numpy.nan)
+                line += '{:>6.1f}%'.format(on * 100) if not numpy.isnan(on) else '{:>7}'.format('-')
+                if delays is not None and numpy.any(delays[0] == source):
+                    p50, p99 = numpy.percentile(delays[1][delays[0] == source], [50, 99]) * 1000
+                    line += '  ' + '{:.0f}'.format(p50) + ' / ' + '{:.0f}'.format(p99)
+                print(line)
+        print()
+
+    def __flush(self, prefix, buffer):
+        if buffer.size == 0:
+            return
+        self.__sequence += 1
+        path = os.path.join(self.__directory, prefix + '-' + self.__session + '-' +
+                '{:06d}'.format(self.__sequence) + '.npz')
+        numpy.savez(path, **buffer.arrays())
+        buffer.clear()
+        self.files += 1
@@ -0,0 +1,131 @@
+''' Gateway event journal module '''
+import glob
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+MAGIC = b'MJNL\x01'
+# Record header: payload length and receive time in seconds since the epoch
+HEADER = struct.Struct('<Id')
+SEGMENT_SIZE = 16 * 1024 * 1024
+
+class Journal():
+    ''' Append-only journal of the raw messages received from the gateway. Records are written
+    to segment files of about segment_size bytes. Full segments are compressed with zlib if
+    compress is set '''
+    def __init__(self):
+        self.__directory = None
+        self.__segment_size = SEGMENT_SIZE
+        self.__compress = False
+        self.__file = None
+        self.__path = None
+        self.__size = 0
+        self.__sequence = 0
+        self.__session = None
+        self.__lock = threading.Lock()
+        self.records = 0
+        self.segments = 0
+
+    def open(self, directory, segment_size=SEGMENT_SIZE, compress=False):
+        ''' Start journaling to a directory '''
+        os.makedirs(directory, exist_ok=True)
+        with self.__lock:
+            self.__directory = directory
+            self.__segment_size = segment_size
+            self.__compress = compress
+            self.__session = time.strftime('%Y%m%d-%H%M%S')
+
+    def close(self):
+        ''' Close the current segment '''
+        with self.__lock:
+            self.__close()
+            self.__directory = None
+
+    def append(self, payload, timestamp=None):
+        ''' Write a received message to the journal '''
+        if self.__directory is None:
+            return
+        with self.__lock:
+            if self.__file is None:
+                self.__start()
+            self.__file.write(HEADER.pack(len(payload), time.time() if timestamp is None
+                else timestamp))
+            self.__file.write(payload)
+            self.__size += HEADER.size + len(payload)
+            self.records += 1
+            if self.__size >= self.__segment_size:
+                self.__close()
+
+    def __start(self):
+        self.__sequence += 1
+        self.__path = os.path.join(self.__directory, 'journal-' + self.__session + '-' +
+                '{:06d}'.format(self.__sequence) + '.seg')
+        self.__file = open(self.__path, 'wb')
+        self.__file.write(MAGIC)
+        self.__size = len(MAGIC)
+        self.segments += 1
+
+    def __close(self):
+        if self.__file is None:
+            return
+        self.__file.close()
+        self.__file = None
+        if self.__compress:
+            with open(self.__path, 'rb') as segment:
+                data = zlib.compress(segment.read())
+            with open(self.__path + '.z', 'wb') as segment:
+                segment.write(data)
+            os.remove(self.__path)
+
+def records(data):
+    ''' Generate the (timestamp, payload) records of the contents of a segment. Payloads are
+    memoryview slices of data, so nothing is copied. A record cut short by a crash ends the
+    segment '''
+    view = memoryview(data)
+    if bytes(view[:len(MAGIC)]) != MAGIC:
+        raise ValueError('Not a journal segment')
+    offset = len(MAGIC)
+    end = len(view)
+    while offset + HEADER.size <= end:
+        length, timestamp = HEADER.unpack_from(view, offset)
+        offset += HEADER.size
+        if offset + length > end:
+            return
+        yield timestamp, view[offset:offset + length]
+        offset += length
+
+def read_segment(path):
+    ''' Generate the (timestamp, payload) records of a segment file. Uncompressed segments are
+    memory mapped and their payloads are slices of the map '''
+    if path.endswith('.z'):
+        with open(path, 'rb') as segment:
+            yield from records(zlib.decompress(segment.read()))
+        return
+    with open(path, 'rb') as segment:
+        if os.fstat(segment.fileno()).st_size == 0:
+            return
+        data = mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ)
+    found = records(data)
+    try:
+        yield from found
+    finally:
+        found.close()
+        try:
+            data.close()
+        except BufferError:
+            # The caller still holds a payload, the map is closed once it is released
+            pass
+
+def segments(directory):
+    ''' Get the segment files of a journal directory in the order they were written '''
+    paths = glob.glob(os.path.join(directory, 'journal-*.seg'))
+    paths += glob.glob(os.path.join(directory, 'journal-*.seg.z'))
+    return sorted(paths, key=lambda path: path[:-2] if path.endswith('.z') else path)
+
+def replay(directory):
+    ''' Generate the (timestamp, payload) records of every segment of a journal directory '''
+    for path in segments(directory):
+        yield from read_segment(path)
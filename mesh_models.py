@@ -1,4 +1,8 @@
 ''' Bluetooth mesh model module '''
+import asyncio
+import time
+import model_codec
+from token_bucket import Token_Bucket
 from byte_codec import uint8
 from byte_codec import uint16
 
@@ -112,6 +116,7 @@ SERVER_MODEL_MSGS = {
             'Generic Location Global Set',
             'Generic Location Global Set Unacknowledged',
             'Generic Location Local Set',
+            'Generic Location Local Set Unacknowledged'
             ],
         'Generic Manufacturer Property': [
             'Generic Manufacturer Properties Get',
@@ -144,6 +149,7 @@ MODEL_MSG_OPCODES = {
         'Generic Level Get': 0x8205,
         'Generic Level Set': 0x8206,
         'Generic Level Set Unacknowledged': 0x8207,
+        'Generic Level Status': 0x8208,
         'Generic Delta Set': 0x8209,
         'Generic Delta Set Unacknowledged': 0x820A,
         'Generic Move Set': 0x820B,
@@ -151,49 +157,157 @@ MODEL_MSG_OPCODES = {
         'Generic Default Transition Time Get': 0x820D,
         'Generic Default Transition Time Set': 0x820E,
         'Generic Default Transition Time Set Unacknowledged': 0x820F,
+        'Generic Default Transition Time Status': 0x8210,
         'Generic OnPowerUp Get': 0x8211,
+        'Generic OnPowerUp Status': 0x8212,
         'Generic OnPowerUp Set': 0x8213,
         'Generic OnPowerUp Set Unacknowledged': 0x8214,
         'Generic Power Level Get': 0x8215,
         'Generic Power Level Set': 0x8216,
         'Generic Power Level Set Unacknowledged': 0x8217,
+        'Generic Power Level Status': 0x8218,
         'Generic Power Last Get': 0x8219,
+        'Generic Power Last Status': 0x821A,
         'Generic Power Default Get': 0x821B,
+        'Generic Power Default Status': 0x821C,
         'Generic Power Range Get': 0x821D,
+        'Generic Power Range Status': 0x821E,
         'Generic Power Default Set': 0x821F,
         'Generic Power Default Set Unacknowledged': 0x8220,
         'Generic Power Range Set': 0x8221,
         'Generic Power Range Set Unacknowledged': 0x8222,
         'Generic Battery Get': 0x8223,
+        'Generic Battery Status': 0x8224,
         'Generic Location Global Get': 0x8225,
+        'Generic Location Global Status': 0x40,
         'Generic Location Local Get': 0x8226,
+        'Generic Location Local Status': 0x8227,
         'Generic Location Global Set': 0x41,
         'Generic Location Global Set Unacknowledged': 0x42,
         'Generic Location Local Set': 0x8228,
+        'Generic Location Local Set Unacknowledged': 0x8229,
         'Generic Manufacturer Properties Get': 0x822A,
+        'Generic Manufacturer Properties Status': 0x43,
         'Generic Manufacturer Property Get': 0x822B,
         'Generic Manufacturer Property Set': 0x44,
         'Generic Manufacturer Property Set Unacknowledged': 0x45,
+        'Generic Manufacturer Property Status': 0x46,
         'Generic Admin Properties Get': 0x822C,
+        'Generic Admin Properties Status': 0x47,
         'Generic Admin Property Get': 0x822D,
         'Generic Admin Property Set': 0x48,
         'Generic Admin Property Set Unacknowledged': 0x49,
+        'Generic Admin Property Status': 0x4A,
         'Generic User Properties Get': 0x822E,
+        'Generic User Properties Status': 0x4B,
         'Generic User Property Get': 0x822F,
         'Generic User Property Set': 0x4C,
         'Generic User Property Set Unacknowledged': 0x4D,
+        'Generic User Property Status': 0x4E,
         'Generic Client Properties Get': 0x4F,
+        'Generic Client Properties Status': 0x50
         }
 
+# Server model that receives the messages of each SERVER_MODEL_MSGS entry
+SERVER_MODEL_IDS = {
+        'Generic OnOff': 0x1000,
+        'Generic Level': 0x1002,
+        'Generic Default Transition Time': 0x1004,
+        'Generic Power OnOff': 0x1006,
+        'Generic Power OnOff Setup': 0x1007,
+        'Generic Power Level': 0x1009,
+        'Generic Power Level Setup': 0x100A,
+        'Generic Battery': 0x100C,
+        'Generic Location': 0x100E,
+        'Generic Location Setup': 0x100F,
+        'Generic Manufacturer Property': 0x1012,
+        'Generic Admin Property': 0x1011,
+        'Generic User Property': 0x1013,
+        'Generic Client Property': 0x1014
+        }
+
+# Status message that answers each acknowledged message
+MODEL_MSG_STATUS = {
+        'Generic OnOff Get': 'Generic OnOff Status',
+        'Generic OnOff Set': 'Generic OnOff Status',
+        'Generic Level Get': 'Generic Level Status',
+        'Generic Level Set': 'Generic Level Status',
+        'Generic Delta Set': 'Generic Level Status',
+        'Generic Move Set': 'Generic Level Status',
+        'Generic Default Transition Time Get': 'Generic Default Transition Time Status',
+        'Generic Default Transition Time Set': 'Generic Default Transition Time Status',
+        'Generic OnPowerUp Get': 'Generic OnPowerUp Status',
+        'Generic OnPowerUp Set': 'Generic OnPowerUp Status',
+        'Generic Power Level Get': 'Generic Power Level Status',
+        'Generic Power Level Set': 'Generic Power Level Status',
+        'Generic Power Last Get': 'Generic Power Last Status',
+        'Generic Power Default Get': 'Generic Power Default Status',
+        'Generic Power Default Set': 'Generic Power Default Status',
+        'Generic Power Range Get': 'Generic Power Range Status',
+        'Generic Power Range Set': 'Generic Power Range Status',
+        'Generic Battery Get': 'Generic Battery Status',
+        'Generic Location Global Get': 'Generic Location Global Status',
+        'Generic Location Global Set': 'Generic Location Global Status',
+        'Generic Location Local Get': 'Generic Location Local Status',
+        'Generic Location Local Set': 'Generic Location Local Status',
+        'Generic Manufacturer Properties Get': 'Generic Manufacturer Properties Status',
+        'Generic Manufacturer Property Get': 'Generic Manufacturer Property Status',
+        'Generic Manufacturer Property Set': 'Generic Manufacturer Property Status',
+        'Generic Admin Properties Get': 'Generic Admin Properties Status',
+        'Generic Admin Property Get': 'Generic Admin Property Status',
+        'Generic Admin Property Set': 'Generic Admin Property Status',
+        'Generic User Properties Get': 'Generic User Properties Status',
+        'Generic User Property Get': 'Generic User Property Status',
+        'Generic User Property Set': 'Generic User Property Status',
+        'Generic Client Properties Get': 'Generic Client Properties Status'
+        }
+
+# Status opcode that answers each acknowledged opcode
+MODEL_MSG_ACKS = {MODEL_MSG_OPCODES[msg]: MODEL_MSG_OPCODES[status]
+        for msg, status in MODEL_MSG_STATUS.items()}
+
+# Payload decoder of each opcode and payload encoder of each message name
+DECODERS = model_codec.decoders(MODEL_MSG_OPCODES)
+ENCODERS = model_codec.encoders(MODEL_MSG_OPCODES)
+
+def decode(opcode, payload):
+    ''' Get the record of a received model message payload, a named tuple with one item per
+    field. Returns None for unknown opcodes. Raises ValueError if the payload is malformed '''
+    decoder = DECODERS.get(opcode)
+    if decoder is None:
+        return None
+    return decoder.decode(payload)
+
+def parse_addresses(text):
+    ''' Get the addresses in a comma separated list of addresses and inclusive address
+    ranges, e.g. "0x0002-0x0010,0x0020". Raises ValueError if the list is invalid '''
+    addresses = []
+    seen = set()
+    for part in text.split(','):
+        first, _, last = part.strip().partition('-')
+        first = int(first, 0)
+        last = int(last, 0) if last else first
+        if first < 0 or last > 0xFFFF or last < first:
+            raise ValueError('Invalid address range: ' + part.strip())
+        for address in range(first, last + 1):
+            if address not in seen:
+                seen.add(address)
+                addresses.append(address)
+    return addresses
+
 class Models():
     ''' Bluetooth mesh model class '''
-    def __init__(self, sem, subnets, app_keys, get_choice, publish):
-        self.__sem = sem
+    __FAN_OUT_RATE = 5
+    __ACK_TIMEOUT = 5
+
+    def __init__(self, pending, subnets, app_keys, groups, ingest, get_choice):
+        self.__pending = pending
         self.__subnets = subnets
         self.__app_keys = app_keys
+        self.__groups = groups
+        self.__ingest = ingest
         self.__get_choice = get_choice
-        self.__publish = publish
-        self.__tid = 0
+        self.__tids = model_codec.Transactions()
 
     def __get_transition_time(self):
         while True:
@@ -225,101 +339,59 @@ class Models():
                 continue
             return delay
 
-    def __get_payload(self, msg):
-        payload = []
-        if msg == 'Generic OnOff Get':
-            return payload
-        elif msg == 'Generic OnOff Set' or msg == 'Generic OnOff Set Unacknowledged':
-            choices = ['ON', 'OFF']
-            print('Do you want to turn the model ON or OFF?')
-            choice = self.__get_choice(choices)
-            if choice is None or choice == -1:
-                return choice
-            on_off = choices[choice]
-            if on_off == 'ON':
-                payload.append({'byte': 0x01})
-            elif on_off == 'OFF':
-                payload.append({'byte': 0x00})
-            payload.append({'byte': self.__tid})
-            self.__tid = self.__tid + 1
+    def __get_number(self, field):
+        while True:
+            value = input('Enter the ' + field.label + ': ')
+            try:
+                value = int(value, 0)
+            except ValueError:
+                print('Invalid ' + field.label + '. Must be a number')
+                continue
+            return value
+
+    def __get_fields(self, msg):
+        ''' Get the field values of a SIG model message from the user, except its TID. Returns
+        None or -1 if the user went back '''
+        encoder = ENCODERS[msg]
+        fields = {}
+        for field in encoder.required:
+            if field is model_codec.TID:
+                continue
+            if field is model_codec.ON_OFF:
+                choices = ['ON', 'OFF']
+                print('Do you want to turn the model ON or OFF?')
+                choice = self.__get_choice(choices)
+                if choice is None or choice == -1:
+                    return choice
+                fields[field.name] = 1 if choices[choice] == 'ON' else 0
+            else:
+                fields[field.name] = self.__get_number(field)
+        if encoder.optional == [model_codec.TRANSITION_TIME, model_codec.DELAY]:
             tt = self.__get_transition_time()
-            if tt:
-                payload.append({'byte': tt})
-            delay = self.__get_delay()
-            if delay:
-                payload.append({'byte': delay})
-            return payload
-        else:
-            print('NOT YET SUPPORTED')
-            return
-            #'Generic Level Get': 0x8205
-            #'Generic Level Set': 0x8206
-            #'Generic Level Set Unacknowledged': 0x8207
-            #'Generic Level Status': 0x8208
-            #'Generic Delta Set': 0x8209
-            #'Generic Delta Set Unacknowledged': 0x820A
-            #'Generic Move Set': 0x820B
-            #'Generic Mode Set Unacknowledged': 0x820C
-            #'Generic Default Transition Time Get': 0x820D
-            #'Generic Default Transition Time Set': 0x820E
-            #'Generic Default Transition Time Set Unacknowledged': 0x820F
-            #'Generic Default Transition Time Status': 0x8210
-            #'Generic OnPowerUp Get': 0x8211
-            #'Generic OnPowerUp Status': 0x8212
-            #'Generic OnPowerUp Set': 0x8213
-            #'Generic OnPowerUp Set Unacknowledged': 0x8214
-            #'Generic Power Level Get': 0x8215
-            #'Generic Power Level Set': 0x8216
-            #'Generic Power Level Set Unacknowledged': 0x8217
-            #'Generic Power Level Status': 0x8218
-            #'Generic Power Last Get': 0x8219
-            #'Generic Power Last Status': 0x821A
-            #'Generic Power Default Get': 0x821B
-            #'Generic Power Default Status': 0x821C
-            #'Generic Power Range Get': 0x821D
-            #'Generic Power Range Status': 0x821E
-            #'Generic Power Default Set': 0x821F
-            #'Generic Power Default Set Unacknowledged': 0x8220
-            #'Generic Power Range Set': 0x8221
-            #'Generic Power Range Set Unacknowledged': 0x8222
-            #'Generic Battery Get': 0x8223
-            #'Generic Battery Status': 0x8224
-            #'Generic Location Global Get': 0x8225
-            #'Generic Location Global Status': 0x40
-            #'Generic Location Local Get': 0x8226
-            #'Generic Location Local Status': 0x8227
-            #'Generic Location Global Set': 0x41
-            #'Generic Location Global Set Unacknowledged': 0x42
-            #'Generic Location Local Set': 0x8228
-            #'Generic Location Local Status': 0x8229
-            #'Generic Manufacturer Properties Get': 0x822A
-            #'Generic Manufacturer Properties Status': 0x43
-            #'Generic Manufacturer Property Get': 0x822B
-            #'Generic Manufacturer Property Set': 0x44
-            #'Generic Manufacturer Property Set Unacknowledged': 0x45
-            #'Generic Manufacturer Property Status': 0x46
-            #'Generic Admin Properties Get': 0x822C
-            #'Generic Admin Properties Status': 0x47
-            #'Generic Admin Property Get': 0x822D
-            #'Generic Admin Property Set': 0x48
-            #'Generic Admin Property Set Unacknowledged': 0x49
-            #'Generic Admin Property Status': 0x4A
-            #'Generic User Properties Get': 0x822E
-            #'Generic User Properties Status': 0x4B
-            #'Generic User Property Get': 0x822F
-            #'Generic User Property Set': 0x4C
-            #'Generic User Property Set Unacknowledged': 0x4D
-            #'Generic User Property Status': 0x4E
-            #'Generic Client Properties Get': 0x4F
-            #'Generic Client Properties Status':0x50
+            if tt is not None:
+                fields['transition_time'] = tt
+                fields['delay'] = self.__get_delay() or 0
+        if encoder.trailing == model_codec.PROPERTY_VALUE:
+            while True:
+                value = input('Enter the property value as a string of hexadecimal characters: ')
+                try:
+                    fields['property_value'] = bytes.fromhex(value)
+                except ValueError:
+                    print('Invalid property value. Must be pairs of hexadecimal characters')
+                    continue
+                break
+        return fields
 
-    def send_msg(self):
-        ''' Send bluetooth mesh model message '''
+    def __get_message(self):
+        ''' Get the opcode, payload and receiving SIG model ID of a message from the user. The
+        payload is a function that gets the payload for a destination address, and the model
+        ID is None for vendor models. Returns None if the user went back or the message
+        is not supported '''
         choices = ['SIG Model', 'Vendor Model']
         print('What model type do you want to send a message to?')
         choice = self.__get_choice(choices)
         if choice is None or choice == -1:
-            return choice
+            return None
 
         if choice == 0:
             # SIG Model
@@ -343,15 +415,26 @@ class Models():
             print('Which SIG model to you want to send a message for?')
             choice = self.__get_choice(SERVER_MODEL_MSGS.keys())
             if choice is None or choice == -1:
-                return choice
+                return None
             model = list(SERVER_MODEL_MSGS.keys())[choice]
             print('Which ' + model + ' message would you like to send?')
             choice = self.__get_choice(SERVER_MODEL_MSGS[model])
             if choice is None or choice == -1:
-                return choice
+                return None
             msg = SERVER_MODEL_MSGS[model][choice]
+            fields = self.__get_fields(msg)
+            if fields is None or fields == -1:
+                return None
+            try:
+                # Check the values before any destination is asked for
+                encoder = ENCODERS[msg]
+                encoder.encode(**dict(fields, tid=0) if encoder.has_tid else fields)
+            except ValueError as err:
+                print(str(err))
+                return None
             opcode = MODEL_MSG_OPCODES[msg]
-            payload = self.__get_payload(msg)
+            payload = lambda address: self.encode(msg, address, **fields)[1]
+            model_id = SERVER_MODEL_IDS[model]
 
         elif choice == 1:
             # Vendor Model
@@ -371,24 +454,36 @@ class Models():
 
             while True:
                 payload_str = input('Enter message payload as a string of hexadecimal characters: ')
-                payload = []
-                while len(payload_str) > 0:
-                    try:
-                        byte = int(payload_str[:2], 16)
-                    except ValueError:
-                        print('Invalid byte in payload: ' + payload_str[:2] + '. Must be a ' +
-                        'hexadecimal number')
-                        continue
-                    payload.append({'byte': byte})
-                    payload_str = payload_str[2:]
+                try:
+                    raw = bytes.fromhex(payload_str)
+                except ValueError:
+                    print('Invalid payload. Must be pairs of hexadecimal characters')
+                    continue
                 break
+            payload = lambda _address: raw
+            model_id = None
 
+        return opcode, payload, model_id
+
+    def __get_keys(self):
+        ''' Get the subnet and application key to send a message with from the user. Returns
+        None if the user went back '''
         net_idx = self.__subnets.get_choice()
         if net_idx is None or net_idx == -1:
-            return net_idx
+            return None
         app_idx = self.__app_keys.get_choice()
         if app_idx is None or app_idx == -1:
-            return app_idx
+            return None
+        return net_idx, app_idx
+
+    def send_msg(self):
+        ''' Send bluetooth mesh model message '''
+        message = self.__get_message()
+        if message is None:
+            return
+        keys = self.__get_keys()
+        if keys is None:
+            return
         while True:
             address = input('\nEnter destination address of the message: ')
             try:
@@ -400,19 +495,157 @@ class Models():
                 print('Invalid destination address/ Must be a number between 0x0000 and 0xFFFF')
                 continue
             break
-        send_model_message = {
-                'id': 'randomId',
-                'type': 'operation',
-                'operation': {
-                    'type': 'send_model_message',
-                    'netIndex': net_idx,
-                    'appIndex': app_idx,
-                    'address': address,
-                    'opcode': opcode,
-                    'payload': payload
-                    }
+        self.__pending.run(self.send(*keys, address, message[0], message[1](address)))
+
+    def send_bulk(self):
+        ''' Send the same model message to many destinations at a paced rate '''
+        message = self.__get_message()
+        if message is None:
+            return
+        keys = self.__get_keys()
+        if keys is None:
+            return
+        while True:
+            addresses = input('\nEnter destination addresses and address ranges, e.g. ' +
+                    '0x0002-0x0010,0x0020: ')
+            try:
+                addresses = parse_addresses(addresses)
+            except ValueError:
+                print('Invalid destination addresses. Must be numbers between 0x0000 and 0xFFFF')
+                continue
+            break
+        while True:
+            rate = input('Enter the number of messages per second (leave blank for ' +
+                    str(self.__FAN_OUT_RATE) + '): ')
+            try:
+                rate = float(rate) if rate else self.__FAN_OUT_RATE
+            except ValueError:
+                rate = 0
+            if rate <= 0:
+                print('Invalid rate. Must be a positive number')
+                continue
+            break
+        responders = None
+        if message[2] is not None:
+            addresses, responders = self.__use_groups(addresses, message[2])
+            if addresses is None:
+                return
+        print('Sending to ' + str(len(addresses)) + ' destinations at ' + '{:g}'.format(rate) +
+                ' messages per second...')
+        start = time.monotonic()
+        results = self.__pending.run(self.fan_out(*keys, addresses, *message[:2], rate,
+            responders=responders, on_result=self.__print_fan_out_result))
+        elapsed = time.monotonic() - start
+        print('\nFan-out Summary:')
+        print('    Messages sent : ' + str(len(results)))
+        if message[0] in MODEL_MSG_ACKS:
+            acked = len([result for result in results if result[1] is not None])
+            print('    Acknowledged  : ' + str(acked) + ' of ' + str(len(results)))
+        print('    Total time    : ' + '{:.1f}'.format(elapsed) + ' s\n')
+
+    def __use_groups(self, addresses, model_id):
+        ''' Offer to reach the destinations through group addresses their models subscribe
+        to. Returns the destinations and the addresses that answer each destination '''
+        plan = self.__pending.run(self.__groups.plan(addresses, model_id))
+        if len(plan.groups) == 0:
+            return addresses, None
+        print('\nGroup addresses that reach the destinations:')
+        for group, elements in plan.groups:
+            print('    ' + uint16(group) + ': ' + ', '.join(uint16(elem) for elem in elements))
+        print('    Unicast destinations: ' + str(len(plan.unicasts)))
+        print('    Messages: ' + str(plan.messages()) + ' instead of ' + str(plan.targets()) +
+                ' (' + str(plan.targets() - plan.messages()) + ' saved)')
+        if len(plan.unknown_nodes):
+            print('    WARNING: ' + str(len(plan.unknown_nodes)) + ' nodes have no current ' +
+                    'discovery result and may also subscribe to these groups')
+        choice = self.__get_choice(['Send to group addresses', 'Send to each destination'])
+        if choice is None or choice == -1:
+            return None, None
+        if choice == 1:
+            return addresses, None
+        return plan.destinations()
+
+    def __print_fan_out_result(self, address, status, latency):
+        if latency is None:
+            print('    ' + uint16(address) + ' SENT')
+        elif status is None:
+            print('    ' + uint16(address) + ' NO STATUS')
+        else:
+            print('    ' + uint16(address) + ' STATUS  ' + '{:.2f}'.format(latency) + ' s')
+
+    def encode(self, msg, address, **fields):
+        ''' Get the opcode and payload of a SIG model message to a destination address, e.g.
+        encode('Generic Level Set', 0x0005, level=-100). Fields are named as in the decoded
+        records of the message. Each destination gets its own TID sequence unless a TID is
+        given. Raises ValueError if the fields do not fit the message '''
+        encoder = ENCODERS[msg]
+        if encoder.has_tid and 'tid' not in fields:
+            fields['tid'] = self.__tids.next(address)
+        return encoder.opcode, encoder.encode(**fields)
+
+    async def fan_out(self, net_idx, app_idx, addresses, opcode, payload, rate=__FAN_OUT_RATE,
+            burst=1, ack_timeout=__ACK_TIMEOUT, responders=None, on_result=None):
+        ''' Send a model message to each address in turn, paced by a token bucket. Messages
+        with a Status reply wait for the status of each address that answers a destination,
+        by default the destination itself. Results are (address, status, latency) tuples in
+        completion order, status is None if no status arrived and latency is None for
+        messages without a Status reply. The payload is bytes-like, or a function that gets
+        the payload for a destination address, e.g. to give each destination its own TID '''
+        bucket = Token_Bucket(rate, burst)
+        status_opcode = MODEL_MSG_ACKS.get(opcode)
+        results = []
+
+        def report(result):
+            results.append(result)
+            if on_result is not None:
+                on_result(*result)
+
+        async def acknowledged(address, start, status):
+            try:
+                status = await asyncio.wait_for(status, ack_timeout)
+            except asyncio.TimeoutError:
+                status = None
+            report((address, status, time.monotonic() - start))
+
+        acks = []
+        for address in addresses:
+            await bucket.acquire()
+            send_model_message = self.__message(net_idx, app_idx, address, opcode,
+                    payload(address) if callable(payload) else payload)
+            self.__ingest.sent(address, opcode)
+            if status_opcode is None:
+                self.__pending.post(send_model_message)
+                report((address, None, None))
+                continue
+            start = time.monotonic()
+            answering = responders.get(address, [address]) if responders else [address]
+            # The first answering address sends the message, the rest only wait for a status
+            statuses = [self.__pending.request(send_model_message, 'receive_model_message',
+                {'sourceAddress': answering[0], 'opcode': status_opcode}, None)]
+            statuses += [self.__pending.wait('receive_model_message',
+                {'sourceAddress': responder, 'opcode': status_opcode}, None)
+                for responder in answering[1:]]
+            acks += [asyncio.ensure_future(acknowledged(responder, start, status))
+                    for responder, status in zip(answering, statuses)]
+        await asyncio.gather(*acks)
+        return results
+
+    async def send(self, net_idx, app_idx, address, opcode, payload):
+        ''' Have the gateway send a mesh model message with a bytes-like payload. Model
+        messages have no operation response, acknowledged messages are answered by a received
+        model message '''
+        self.__ingest.sent(address, opcode)
+        self.__pending.post(self.__message(net_idx, app_idx, address, opcode, payload))
+
+    def __message(self, net_idx, app_idx, address, opcode, payload):
+        return {
+                'type': 'send_model_message',
+                'netIndex': net_idx,
+                'appIndex': app_idx,
+                'address': address,
+                'opcode': opcode,
+                'payload': payload
                 }
-        self.__publish(send_model_message)
 
     def __print_msg_details(self, event):
         print('    Network Index: ' + uint16(event['netIndex']))
@@ -422,95 +655,29 @@ class Models():
 
     def evt(self, event):
         ''' Receive bluetooth mesh model message from gateway '''
-        if event['opcode'] == MODEL_MSG_OPCODES['Generic OnOff Get']:
-            print('Generic OnOff Get:')
-            self.__print_msg_details(event)
-            payload = event['payload']
-
-        elif event['opcode']  == MODEL_MSG_OPCODES['Generic OnOff Set'] or \
-        event['opcode'] == MODEL_MSG_OPCODES['Generic OnOff Set Unacknowledged']:
-            print('Generic OnOff Set:')
-            self.__print_msg_details(event)
-            payload = event['payload']
-            if payload is not None and len(payload) > 0:
-                if payload[0]['byte']:
-                    print('    OnOff: ON')
-                else:
-                    print('    OnOff: OFF')
-                if len(payload) > 1:
-                    print('    TID: ' + uint8(payload[1]['byte']))
-                if len(payload) > 2:
-                    print('    Transition Time: ' + uint8(payload[2]['byte']))
-                if len(payload) > 3:
-                    print('    Delay: ' + uint8(payload[3]['byte']))
-
-        elif event['opcode'] == MODEL_MSG_OPCODES['Generic OnOff Status']:
-            print('Generic OnOff Status:')
-            self.__print_msg_details(event)
-            payload = event['payload']
-            if payload[0]['byte']:
-                print('    Present OnOff: ON')
-            else:
-                print('    Present OnOff: OFF')
-            if len(payload) > 1:
-                if payload[1]:
-                    print('    Target OnOff: ON')
-                else:
-                    print('    Target OnOff: OFF')
-            if len(payload) > 2:
-                print('    Remaining Time: ' + uint8(payload[2]['byte']))
-
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Level Get']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Level Set']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Level Set Unacknowledged']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Delta Set']: 0x8209,
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Delta Set Unacknowledged']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Move Set']: 0x820B,
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Mode Set Unacknowledged']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Default Transition Time Get']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Default Transition Time Set']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Default Transition Time Set Unacknowledged']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic OnPowerUp Get']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic OnPowerUp Set']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic OnPowerUp Set Unacknowledged']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Power Level Get']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Power Level Set']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Power Level Set Unacknowledged']: 0x8217,
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Power Last Get']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Power Default Get']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Power Range Get']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Power Default Set']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Power Default Set Unacknowledged']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Power Range Set']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Power Range Set Unacknowledged']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Battery Get']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Location Global Get']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Location Local Get']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Location Global Set']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Location Global Set Unacknowledged']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Location Local Set']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Manufacturer Properties Get']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Manufacturer Property Get']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Manufacturer Property Set']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Manufacturer Property Set Unacknowledged']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Admin Properties Get']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Admin Property Get']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Admin Property Set']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Admin Property Set Unacknowledged']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic User Properties Get']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic User Property Get']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic User Property Set']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic User Property Set Unacknowledged']:
-        #elif event['opcode'] == MODEL_MSG_OPCODES['Generic Client Properties Get']:
-        else:
+        payload = event['payload'] or b''
+        decoder = DECODERS.get(event['opcode'])
+        if decoder is None:
+            self.__ingest.add(event, None, event.get('receivedAt'))
             print('Received unsupported mesh model message:')
-            self.__print_msg_details(event)
-            print('    Opcode: ' + hex(event['opcode']))
-            print('    Payload: ', end='')
-            payload = event['payload']
-            if len(payload):
-                for byte in payload:
-                    print(uint8(byte['byte']), end=' ')
-                print()
+        else:
+            try:
+                record = decoder.decode(payload)
+            except ValueError as err:
+                print('Received malformed ' + decoder.name + ' message: ' + str(err))
             else:
-                print('None')
+                self.__ingest.add(event, record, event.get('receivedAt'))
+                print(decoder.name + ':')
+                self.__print_msg_details(event)
+                for line in decoder.lines(record):
+                    print('    ' + line)
+                self.__pending.complete(event)
+                return
+        self.__print_msg_details(event)
+        print('    Opcode: ' + hex(event['opcode']))
+        print('    Payload: ', end='')
+        if len(payload):
+            print(' '.join(uint8(byte) for byte in payload))
+        else:
+            print('None')
+        self.__pending.complete(event)
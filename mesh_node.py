@@ -1,4 +1,7 @@
 ''' Bluetooth mesh node module '''
+import asyncio
+import time
+from mesh_cache import Ttl_Cache
 from mesh_models import MODEL_ID_PARSE
 from byte_codec import uint8
 from byte_codec import uint16
@@ -20,43 +23,33 @@ class Node():
             'Delete Subscribe Address',
             'Overwrite Subscribe Addresses'
             ]
-    __node = {}
+    __DISCOVER_WINDOW = 8
+    DISCOVER_TTL = 60
 
-    def __init__(self, sem, nodes, subnets, app_keys, get_choice, publish):
-        self.__sem = sem
+    def __init__(self, pending, nodes, subnets, app_keys, store, get_choice):
+        self.__pending = pending
         self.__nodes = nodes
         self.__subnets = subnets
         self.__app_keys = app_keys
+        self.__store = store
         self.__get_choice = get_choice
-        self.__publish = publish
+        self.cache = Ttl_Cache(self.DISCOVER_TTL)
 
-    def __build_disc_json(self, address):
-        ''' Build the json object for performing a node discovery '''
-        node_disc = {
-                'id': 'randomId',
-                'type': 'operation',
-                'operation': {
-                    'type': 'node_discover',
-                    'address': address
-                    }
-                }
-        return node_disc
-
-    def __print(self):
-        print('Node: ' + uint16(self.__node['address']))
-        print('    UUID: ' + self.__node['uuid'])
-        print('    CID : ' + uint16(self.__node['cid']))
-        print('    PID : ' + uint16(self.__node['pid']))
-        print('    VID : ' + uint16(self.__node['vid']))
-        print('    CRPL: ' + uint16(self.__node['crpl']) + '\n')
+    def __print(self, node):
+        print('Node: ' + uint16(node['address']))
+        print('    UUID: ' + node['uuid'])
+        print('    CID : ' + uint16(node['cid']))
+        print('    PID : ' + uint16(node['pid']))
+        print('    VID : ' + uint16(node['vid']))
+        print('    CRPL: ' + uint16(node['crpl']) + '\n')
 
-        if self.__node['networkBeaconState']:
+        if node['networkBeaconState']:
             print('    Network Beacon ENABLED')
         else:
             print('    Network Beacon DISABLED')
-        print('    Time-to-live: ' + uint8(self.__node['timeToLive']) + '\n')
+        print('    Time-to-live: ' + uint8(node['timeToLive']) + '\n')
 
-        relay = self.__node['relayFeature']
+        relay = node['relayFeature']
         print('    Relay Feature:')
         if relay['support']:
             print('        Supported')
@@ -69,7 +62,7 @@ class Node():
         else:
             print('        NOT Supported')
 
-        proxy = self.__node['proxyFeature']
+        proxy = node['proxyFeature']
         print('    GATT Proxy Feature:')
         if proxy['support']:
             print('        Supported')
@@ -80,7 +73,7 @@ class Node():
         else:
             print('        NOT Supported')
 
-        friend = self.__node['friendFeature']
+        friend = node['friendFeature']
         print('    Friend Feature:')
         if friend['support']:
             print('        Supported')
@@ -91,7 +84,7 @@ class Node():
         else:
             print('        NOT Supported')
 
-        lpn = self.__node['lpnFeature']
+        lpn = node['lpnFeature']
         print('    Low Power Node Feature:')
         if lpn['state']:
             print('        Supported')
@@ -99,11 +92,11 @@ class Node():
             print('        NOT Supported')
 
         print('    Subnets:')
-        for subnet in self.__node['subnets']:
+        for subnet in node['subnets']:
             print('        - ' + uint16(subnet))
 
-        for idx, element in enumerate(self.__node['elements']):
-            if element['address'] == self.__node['address']:
+        for idx, element in enumerate(node['elements']):
+            if element['address'] == node['address']:
                 print('    Element ' + uint16(idx) + ' (PRIMARY):')
             else:
                 print('    Element ' + uint16(idx) + ':')
@@ -258,11 +251,11 @@ class Node():
         elif choice == 6:
             # Delete Subnet
             print('Acquiring subnets from node...')
-            self.__publish(self.__build_disc_json(address))
-            if not self.__sem.acquire():
+            node = self.__pending.run(self.lookup(address))
+            if node is None:
                 return
             choices = []
-            for subnet in self.__node['subnets']:
+            for subnet in node['subnets']:
                 choices.append(uint16(subnet))
             print('Which subnet would you like to delete from the node?')
             choice = self.__get_choice(choices)
@@ -282,11 +275,11 @@ class Node():
             if app_idx is None or app_idx == -1:
                 return app_idx
             print('Acquiring elements and models from node...')
-            self.__publish(self.__build_disc_json(address))
-            if not self.__sem.acquire():
+            node = self.__pending.run(self.lookup(address))
+            if node is None:
                 return
             choices = []
-            for element in self.__node['elements']:
+            for element in node['elements']:
                 choices.append(uint16(element['address']))
             if len(choices) == 0:
                 print('No elements on node with models to bind application keys to')
@@ -297,7 +290,7 @@ class Node():
                 return choice
             elem_addr = int(choices[choice], 0)
             choices = []
-            for model in self.__node['elements'][choice]['sigModels']:
+            for model in node['elements'][choice]['sigModels']:
                 choices.append(uint16(model['modelId']) + ' - ' + MODEL_ID_PARSE[model['modelId']])
             if len(choices) == 0:
                 print('No models in element to bind application keys to')
@@ -319,11 +312,11 @@ class Node():
         elif choice == 8:
             # Unbind Application Key
             print('Acquiring elements, models and application keys from node...')
-            self.__publish(self.__build_disc_json(address))
-            if not self.__sem.acquire():
+            node = self.__pending.run(self.lookup(address))
+            if node is None:
                 return
             choices = []
-            for element in self.__node['elements']:
+            for element in node['elements']:
                 choices.append(uint16(element['address']))
             if len(choices) == 0:
                 print('No elements on node with models to unbind an application key from')
@@ -335,7 +328,7 @@ class Node():
                 return element
             elem_addr = int(choices[element], 0)
             choices = []
-            for model in self.__node['elements'][element]['sigModels']:
+            for model in node['elements'][element]['sigModels']:
                 choices.append(uint16(model['modelId']) + ' - ' + MODEL_ID_PARSE[model['modelId']])
             if len(choices) == 0:
                 print('No models in element to unbind an application key from')
@@ -344,9 +337,9 @@ class Node():
             model = self.__get_choice(choices)
             if model is None or model == -1:
                 return model
-            model_id = int(choices[model], 0)
+            model_id = int(choices[model][:6], 0)
             choices = []
-            for app_key in self.__node['elements'][element]['sigModels'][model]['appKeyIndexes']:
+            for app_key in node['elements'][element]['sigModels'][model]['appIndexes']:
                 choices.append(uint16(app_key))
             if len(choices) == 0:
                 print('No application keys to unbind on model')
@@ -371,11 +364,11 @@ class Node():
             if app_idx is None or app_idx == -1:
                 return app_idx
             print('Acquiring elements, models and application keys from node...')
-            self.__publish(self.__build_disc_json(address))
-            if not self.__sem.acquire():
+            node = self.__pending.run(self.lookup(address))
+            if node is None:
                 return
             choices = []
-            for element in self.__node['elements']:
+            for element in node['elements']:
                 choices.append(uint16(element['address']))
             if len(choices) == 0:
                 print('No elements on node with models that can have their publish parameters set')
@@ -387,7 +380,7 @@ class Node():
                 return element
             elem_addr = int(choices[element], 0)
             choices = []
-            for model in self.__node['elements'][element]['sigModels']:
+            for model in node['elements'][element]['sigModels']:
                 choices.append(uint16(model['modelId']) + ' - ' + MODEL_ID_PARSE[model['modelId']])
             if len(choices) == 0:
                 print('No models in element to set publish parameters for')
@@ -432,11 +425,11 @@ class Node():
         elif choice == 10:
             # Add Subscribe Address
             print('Acquiring elements, models and application keys from node...')
-            self.__publish(self.__build_disc_json(address))
-            if not self.__sem.acquire():
+            node = self.__pending.run(self.lookup(address))
+            if node is None:
                 return
             choices = []
-            for element in self.__node['elements']:
+            for element in node['elements']:
                 choices.append(uint16(element['address']))
             if len(choices) == 0:
                 print('No elements on node with models that can have subscribe addresses added')
@@ -447,7 +440,7 @@ class Node():
                 return element
             elem_addr = int(choices[element], 0)
             choices = []
-            for model in self.__node['elements'][element]['sigModels']:
+            for model in node['elements'][element]['sigModels']:
                 choices.append(uint16(model['modelId']) + ' - ' + MODEL_ID_PARSE[model['modelId']])
             if len(choices) == 0:
                 print('No models in element to add subscribe addresses to')
@@ -471,11 +464,11 @@ class Node():
         elif choice == 11:
             # Delete Subscribe Address
             print('Acquiring elements, models and application keys from node...')
-            self.__publish(self.__build_disc_json(address))
-            if not self.__sem.acquire():
+            node = self.__pending.run(self.lookup(address))
+            if node is None:
                 return
             choices = []
-            for element in self.__node['elements']:
+            for element in node['elements']:
                 choices.append(uint16(element['address']))
             if len(choices) == 0:
                 print('No elements on node with models that can have subscribe addresses deleted')
@@ -487,7 +480,7 @@ class Node():
                 return element
             elem_addr = int(choices[element], 0)
             choices = []
-            for model in self.__node['elements'][element]['sigModels']:
+            for model in node['elements'][element]['sigModels']:
                 choices.append(uint16(model['modelId']) + ' - ' + MODEL_ID_PARSE[model['modelId']])
             if len(choices) == 0:
                 print('No models in element to delete subscribe addresses from')
@@ -496,9 +489,9 @@ class Node():
             model = self.__get_choice(choices)
             if model is None or model == -1:
                 return model
-            model_id = int(choices[model], 0)
+            model_id = int(choices[model][:6], 0)
             choices = []
-            for sub_addr in self.__node['elements'][element]['sigModels'][model]['subscribeAddresses']:
+            for sub_addr in node['elements'][element]['sigModels'][model]['subscribeAddresses']:
                 choices.append(uint16(sub_addr))
             if len(choices) == 0:
                 print('No subscribe address to delete from model')
@@ -510,7 +503,7 @@ class Node():
             sub_addr = int(choices[choice], 0)
             cfg_op = {
                     'type': 'node_configure',
-                    'configuration': 'subscribeAddressAdd',
+                    'configuration': 'subscribeAddressDelete',
                     'nodeAddress': address,
                     'elementAddress': elem_addr,
                     'modelId': model_id,
@@ -520,11 +513,11 @@ class Node():
         elif choice == 12:
             # Overwrite Subscribe Addresses
             print('Acquiring elements, models and application keys from node...')
-            self.__publish(self.__build_disc_json(address))
-            if not self.__sem.acquire():
+            node = self.__pending.run(self.lookup(address))
+            if node is None:
                 return
             choices = []
-            for element in self.__node['elements']:
+            for element in node['elements']:
                 choices.append(uint16(element['address']))
             if len(choices) == 0:
                 print('No elements on node with models that can have subscribe addresses ' +
@@ -537,7 +530,7 @@ class Node():
                 return element
             elem_addr = int(choices[element], 0)
             choices = []
-            for model in self.__node['elements'][element]['sigModels']:
+            for model in node['elements'][element]['sigModels']:
                 choices.append(uint16(model['modelId']) + ' - ' + MODEL_ID_PARSE[model['modelId']])
             if len(choices) == 0:
                 print('No models in element to overwrite subscribe addresses for')
@@ -558,16 +551,11 @@ class Node():
                     'subscribeAddress': sub_addr
                     }
 
-        configure = {
-                'id': 'randomId',
-                'type': 'operation',
-                'operation': cfg_op
-                }
         print('Sending configuration request to gateway. This may take serveral minutes...\n')
-        self.__publish(configure)
-        if not self.__sem.acquire():
+        node = self.__pending.run(self.set_config(cfg_op))
+        if node is None:
             return
-        self.__print()
+        self.__print(node)
 
     def discover(self):
         ''' Perform a node discovery '''
@@ -575,26 +563,134 @@ class Node():
         if address is None or address == -1:
             return address
         print('Discovering node. This may take a few minutes...')
-        self.__publish(self.__build_disc_json(address))
-        if not self.__sem.acquire():
+        node = self.__pending.run(self.fetch(address))
+        if node is None:
             return
-        self.__print()
+        self.__print(node)
+
+    def discover_all(self):
+        ''' Discover every node in the network with several discoveries in flight '''
+        window = input('Enter the number of concurrent discoveries (leave blank for ' +
+                str(self.__DISCOVER_WINDOW) + '): ')
+        try:
+            window = int(window, 0) if window else self.__DISCOVER_WINDOW
+        except ValueError:
+            print('Invalid number of concurrent discoveries')
+            return
+        if window < 1:
+            print('Invalid number of concurrent discoveries')
+            return
+        print('Acquiring network nodes from gateway...')
+        node_list = self.__pending.run(self.__nodes.fetch())
+        if node_list is None:
+            return
+        addresses = [node['address'] for node in node_list if node['address'] != 1]
+        if len(addresses) == 0:
+            print('No nodes to discover\n')
+            return
+        print('Discovering ' + str(len(addresses)) + ' nodes, ' + str(window) +
+                ' at a time. This may take a few minutes...')
+        start = time.monotonic()
+        results = self.__pending.run(self.discover_sweep(addresses, window,
+            self.__print_sweep_result))
+        self.__print_sweep_summary(results, time.monotonic() - start)
+
+    def __print_sweep_result(self, address, node, latency):
+        if node is None:
+            print('    ' + uint16(address) + ' FAILED  ' + '{:.2f}'.format(latency) + ' s')
+        else:
+            print('    ' + uint16(address) + ' OK      ' + '{:.2f}'.format(latency) + ' s')
+
+    def __print_sweep_summary(self, results, elapsed):
+        latencies = sorted(latency for _, node, latency in results if node is not None)
+        failed = [address for address, node, _ in results if node is None]
+        print('\nDiscovery Summary:')
+        print('    Nodes discovered: ' + str(len(latencies)) + ' of ' + str(len(results)))
+        print('    Total time      : ' + '{:.2f}'.format(elapsed) + ' s')
+        if len(latencies):
+            print('    Latency min     : ' + '{:.2f}'.format(latencies[0]) + ' s')
+            print('    Latency median  : ' + '{:.2f}'.format(latencies[len(latencies) // 2]) +
+                    ' s')
+            print('    Latency max     : ' + '{:.2f}'.format(latencies[-1]) + ' s')
+        if len(failed):
+            print('    Failed nodes    : ' + ', '.join(uint16(addr) for addr in sorted(failed)))
+        print('    Per-node latency:')
+        for address, node, latency in sorted(results, key=lambda result: result[0]):
+            if node is None:
+                print('        ' + uint16(address) + ': failed after ' +
+                        '{:.2f}'.format(latency) + ' s')
+            else:
+                print('        ' + uint16(address) + ': ' + '{:.2f}'.format(latency) + ' s')
+        print()
+
+    async def discover_sweep(self, addresses, window=__DISCOVER_WINDOW, on_result=None):
+        ''' Discover a list of nodes with at most window discoveries in flight. Results are
+        (address, node, latency) tuples in completion order, node is None for failures '''
+        in_flight = asyncio.Semaphore(window)
+
+        async def discover_one(address):
+            async with in_flight:
+                start = time.monotonic()
+                node = await self.fetch(address)
+                return address, node, time.monotonic() - start
+
+        results = []
+        for next_result in asyncio.as_completed([discover_one(addr) for addr in addresses]):
+            result = await next_result
+            results.append(result)
+            if on_result is not None:
+                on_result(*result)
+        return results
+
+    def __parse(self, event):
+        ''' Get the node details from a node discovery event '''
+        if event is None or event['error'] != 0 or event['status'] != 0:
+            return None
+        node = event.copy()
+        del node['type']
+        del node['timestamp']
+        del node['error']
+        del node['status']
+        return node
+
+    async def fetch(self, address):
+        ''' Perform a node discovery. Returns None if the discovery failed '''
+        node_disc = {
+                'type': 'node_discover',
+                'address': address
+                }
+        event = await self.__pending.request(node_disc, 'node_discover_result',
+                {'address': address})
+        return self.__parse(event)
+
+    async def lookup(self, address):
+        ''' Get the node details from the discovery cache, performing a node discovery if
+        there are no cached details younger than the cache TTL '''
+        node = self.cache.get(address)
+        if node is None:
+            node = await self.fetch(address)
+        return node
+
+    async def set_config(self, cfg_op):
+        ''' Send a node configuration. The gateway answers with the resulting node details '''
+        address = cfg_op['nodeAddress']
+        self.cache.invalidate(address)
+        event = await self.__pending.request(cfg_op, 'node_discover_result',
+                {'address': address})
+        node = self.__parse(event)
+        if node is None:
+            # The node may or may not have applied the configuration
+            self.cache.invalidate(address)
+        return node
 
     def discover_evt(self, event):
         ''' Receive node discovery event from gateway '''
         if event['error'] != 0:
             print('Error performing node discovery: ' + str(event['error']))
-            self.__node = {}
-            self.__sem.release()
-            return
-        if event['status'] != 0:
+        elif event['status'] != 0:
             print('Status performing node discovery: ' + str(event['status']))
-            self.__node = {}
-            self.__sem.release()
-            return
-        del event['type']
-        del event['timestamp']
-        del event['error']
-        del event['status']
-        self.__node = event.copy()
-        self.__sem.release()
+        else:
+            node = self.__parse(event)
+            self.cache.put(event['address'], node)
+            self.__store.save_node(node)
+        self.__pending.complete(event)
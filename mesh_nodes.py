@@ -4,18 +4,16 @@ from byte_codec import uint16
 class Nodes():
     ''' Bluetooth mesh nodes class '''
     __NODE_REQ = {
-            'id': 'randomId',
-            'type': 'operation',
-            'operation': {
-                'type': 'node_request'
-                }
+            'type': 'node_request'
             }
     __nodes = [dict]
 
-    def __init__(self, sem, get_choice, publish):
-        self.__sem = sem
+    def __init__(self, pending, inventory, store, addresses, get_choice):
+        self.__pending = pending
+        self.__inventory = inventory
+        self.__store = store
+        self.__addresses = addresses
         self.__get_choice = get_choice
-        self.__publish = publish
 
     def __print(self):
         print('Network Nodes:')
@@ -30,15 +28,22 @@ class Nodes():
             print('    Element Count: ' + str(node['elementCount']) + '\n')
         if len(self.__nodes) == 0:
             print('    No Nodes\n')
+        free, runs, largest, fragmentation = self.__addresses.fragmentation()
+        print('Unicast Addresses:')
+        print('    Free          : ' + str(free))
+        print('    Free Blocks   : ' + str(runs))
+        print('    Largest Block : ' + str(largest))
+        print('    Fragmentation : ' + '{:.1%}'.format(fragmentation) + '\n')
 
     def get_choice(self):
         ''' Get a node selection from the user '''
-        print('Acquiring network nodes from gateway...')
-        self.__publish(self.__NODE_REQ)
-        if not self.__sem.acquire():
+        if not self.__inventory.fresh('node_list'):
+            print('Acquiring network nodes from gateway...')
+        nodes = self.__pending.run(self.lookup())
+        if nodes is None:
             return None
         choices = []
-        for node in self.__nodes:
+        for node in nodes:
             if node['address'] != 1:
                 choices.append(uint16(node['address']))
         if len(choices) == 0:
@@ -53,12 +58,29 @@ class Nodes():
     def get(self):
         ''' Get a list of nodes from the gateway '''
         print('Getting network nodes from gateway...')
-        self.__publish(self.__NODE_REQ)
-        if not self.__sem.acquire():
+        if self.__pending.run(self.fetch()) is None:
             return
         self.__print()
 
+    async def fetch(self):
+        ''' Request the list of nodes from the gateway '''
+        event = await self.__pending.request(self.__NODE_REQ, 'node_list')
+        if event is None:
+            return None
+        return event['nodes']
+
+    async def lookup(self):
+        ''' Get the list of nodes from the inventory cache, requesting it from the gateway if
+        the cached list is stale '''
+        nodes = self.__inventory.get('node_list')
+        if nodes is None:
+            nodes = await self.fetch()
+        return nodes
+
     def evt(self, event):
         ''' Receive list of nodes from gateway '''
         self.__nodes = event['nodes'].copy()
-        self.__sem.release()
+        self.__inventory.update('node_list', self.__nodes)
+        self.__store.save_node_list(self.__nodes)
+        self.__addresses.rebuild(self.__nodes)
+        self.__pending.complete(event)
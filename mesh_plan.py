@@ -0,0 +1,287 @@
+''' Bluetooth mesh network desired state module '''
+import asyncio
+import heapq
+import json
+import math
+import time
+from byte_codec import uint16
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+PUBLISH_FIELDS = {
+        'address': 'publishAddress',
+        'appIndex': 'appIndex',
+        'friendCredentialFlag': 'friendCredentialFlag',
+        'timeToLive': 'timeToLive',
+        'period': 'period',
+        'periodUnits': 'periodUnits',
+        'retransmitCount': 'retransmitCount',
+        'retransmitInterval': 'retransmitInterval'
+        }
+
+def number(value):
+    ''' Get an integer from a desired state value, which may be a hex or decimal string '''
+    if isinstance(value, str):
+        return int(value, 0)
+    return int(value)
+
+def load_state(path):
+    ''' Read a desired state file. The file is JSON, or YAML if PyYAML is installed and the
+    file name ends in .yaml or .yml. Returns a dictionary of node settings by address '''
+    with open(path) as state_file:
+        if path.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise ValueError('PyYAML is required to read YAML files')
+            state = yaml.safe_load(state_file)
+        else:
+            state = json.load(state_file)
+    nodes = {}
+    for address, spec in state['nodes'].items():
+        for model in spec.get('models', []):
+            if 'companyId' in model:
+                raise ValueError('Vendor models are not supported: node ' + str(address))
+        if 'subnets' in spec and 0 not in [number(net_idx) for net_idx in spec['subnets']]:
+            raise ValueError('The subnets of node ' + str(address) +
+                    ' must include the primary subnet 0')
+        nodes[number(address)] = spec
+    return nodes
+
+def diff_node(address, spec, current):
+    ''' Get the node configuration operations that bring a node from its current discovery
+    result to the desired settings. Settings missing from the spec are left alone '''
+    first = []
+    last = []
+
+    def configure(configuration, **fields):
+        cfg_op = {
+                'type': 'node_configure',
+                'configuration': configuration,
+                'nodeAddress': address
+                }
+        cfg_op.update(fields)
+        return cfg_op
+
+    if 'networkBeacon' in spec and bool(spec['networkBeacon']) != current['networkBeaconState']:
+        first.append(configure('networkBeaconSet', state=bool(spec['networkBeacon'])))
+    if 'timeToLive' in spec and number(spec['timeToLive']) != current['timeToLive']:
+        first.append(configure('timeToLiveSet', value=number(spec['timeToLive'])))
+    if 'relay' in spec:
+        relay = current['relayFeature']
+        wanted = {
+                'state': bool(spec['relay'].get('state', relay['state'])),
+                'retransmitCount': number(spec['relay'].get('retransmitCount',
+                    relay['retransmitCount'])),
+                'retransmitInterval': number(spec['relay'].get('retransmitInterval',
+                    relay['retransmitInterval']))
+                }
+        if any(wanted[key] != relay[key] for key in wanted):
+            first.append(configure('relayFeatureSet', **wanted))
+    if 'proxy' in spec and bool(spec['proxy']) != current['proxyFeature']['state']:
+        first.append(configure('proxyFeatureSet', state=bool(spec['proxy'])))
+    if 'friend' in spec and bool(spec['friend']) != current['friendFeature']['state']:
+        first.append(configure('friendFeatureSet', state=bool(spec['friend'])))
+    if 'subnets' in spec:
+        wanted = [number(net_idx) for net_idx in spec['subnets']]
+        for net_idx in wanted:
+            if net_idx not in current['subnets']:
+                first.append(configure('subnetAdd', netIndex=net_idx))
+        for net_idx in current['subnets']:
+            # Deleting the primary subnet would cut the node off from the gateway
+            if net_idx not in wanted and net_idx != 0:
+                # Subnets are deleted after everything else so keys they carry stay usable
+                last.append(configure('subnetDelete', netIndex=net_idx))
+
+    models = {}
+    for element in current['elements']:
+        for model in element['sigModels']:
+            models[(element['address'], model['modelId'])] = model
+    for model_spec in spec.get('models', []):
+        elem_addr = number(model_spec.get('element', address))
+        model_id = number(model_spec['modelId'])
+        model = models.get((elem_addr, model_id))
+        if model is None:
+            raise ValueError('Node ' + uint16(address) + ' has no model ' + uint16(model_id) +
+                    ' on element ' + uint16(elem_addr))
+        target = {'elementAddress': elem_addr, 'modelId': model_id}
+        if 'appKeys' in model_spec:
+            wanted = [number(app_idx) for app_idx in model_spec['appKeys']]
+            for app_idx in wanted:
+                if app_idx not in model['appIndexes']:
+                    first.append(configure('appKeyBind', appIndex=app_idx, **target))
+            for app_idx in model['appIndexes']:
+                if app_idx not in wanted:
+                    last.insert(0, configure('appKeyUnbind', appIndex=app_idx, **target))
+        if 'publish' in model_spec:
+            pub = model['publishParameters'] or {}
+            wanted = {}
+            for key, field in PUBLISH_FIELDS.items():
+                value = model_spec['publish'].get(key, pub.get(key))
+                if key == 'friendCredentialFlag':
+                    value = bool(value)
+                elif key != 'periodUnits':
+                    value = number(value)
+                wanted[field] = value
+            if any(wanted[field] != pub.get(key) for key, field in PUBLISH_FIELDS.items()):
+                first.append(configure('publishParametersSet', **dict(target, **wanted)))
+        if 'subscribe' in model_spec:
+            first += diff_subscriptions(configure, target, model['subscribeAddresses'],
+                    [number(sub_addr) for sub_addr in model_spec['subscribe']])
+    return first + last
+
+def diff_subscriptions(configure, target, current, wanted):
+    ''' Get the fewest operations that turn one subscription list into another, either adding
+    and deleting addresses or overwriting the list and adding the rest '''
+    missing = [sub_addr for sub_addr in wanted if sub_addr not in current]
+    extra = [sub_addr for sub_addr in current if sub_addr not in wanted]
+    if len(wanted) and len(missing) + len(extra) > len(wanted):
+        ops = [configure('subscribeAddressOverwrite', subscribeAddress=wanted[0], **target)]
+        missing = wanted[1:]
+        extra = []
+    else:
+        ops = []
+    ops += [configure('subscribeAddressAdd', subscribeAddress=sub_addr, **target)
+            for sub_addr in missing]
+    ops += [configure('subscribeAddressDelete', subscribeAddress=sub_addr, **target)
+            for sub_addr in extra]
+    return ops
+
+def estimate(op_counts, window, op_seconds):
+    ''' Estimate the wall time of running per-node operation counts with window nodes worked
+    on at once, when each operation takes op_seconds '''
+    workers = [0.0] * min(window, max(len(op_counts), 1))
+    # Longest jobs first keeps the estimate close to what the scheduler achieves
+    for count in sorted(op_counts, reverse=True):
+        heapq.heappush(workers, heapq.heappop(workers) + count * op_seconds)
+    return max(workers)
+
+class Planner():
+    ''' Apply a desired state file to the network with the fewest node configurations '''
+    __MENU_CHOICES = [
+            'Dry Run',
+            'Apply',
+            'Rediscover Nodes and Apply'
+            ]
+    __WINDOW = 4
+    # Time a node configuration or discovery takes, used for estimates
+    OP_SECONDS = 5
+
+    def __init__(self, pending, node, get_choice, latency=None):
+        self.__pending = pending
+        self.__node = node
+        self.__get_choice = get_choice
+        self.__latency = latency
+
+    def menu(self):
+        ''' Plan or apply a desired state file '''
+        path = input('Enter the path of the desired state file: ')
+        try:
+            state = load_state(path)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as err:
+            print('Invalid desired state file: ' + str(err) + '\n')
+            return
+        print('What would you like to do?')
+        choice = self.__get_choice(self.__MENU_CHOICES)
+        if choice is None or choice == -1:
+            return choice
+        refresh = choice == 2
+        # A dry run may plan from old discovery results, applying only from current ones
+        max_age = math.inf if choice == 0 else None
+        unknown = len([addr for addr in state
+            if refresh or self.__known(addr, max_age) is None])
+        if unknown:
+            print('Discovering ' + str(unknown) + ' nodes...')
+        try:
+            ops = self.__pending.run(self.plan(state, refresh, max_age))
+        except (ValueError, KeyError, TypeError) as err:
+            print('Cannot plan desired state: ' + str(err) + '\n')
+            return
+        if ops is None:
+            print('Could not discover all nodes in the desired state file\n')
+            return
+        self.__print_plan(ops)
+        if choice == 0 or sum(len(node_ops) for node_ops in ops.values()) == 0:
+            return
+        start = time.monotonic()
+        results = self.__pending.run(self.apply(ops, on_result=self.__print_result))
+        failed = [address for address, done, total in results if done != total]
+        print('\nApplied ' + str(len(results) - len(failed)) + ' of ' + str(len(results)) +
+                ' nodes in ' + '{:.1f}'.format(time.monotonic() - start) + ' s')
+        if len(failed):
+            print('Failed nodes: ' + ', '.join(uint16(addr) for addr in sorted(failed)))
+        print()
+
+    def __print_plan(self, ops):
+        print('\nPlan:')
+        for address in sorted(ops):
+            age = self.__node.cache.age(address)
+            print('    Node ' + uint16(address) + ': ' + str(len(ops[address])) +
+                    ' operations (discovered ' + '{:.0f}'.format(age) + ' s ago)')
+            for cfg_op in ops[address]:
+                fields = ', '.join(key + '=' + str(value) for key, value in cfg_op.items()
+                        if key not in ('type', 'configuration', 'nodeAddress'))
+                print('        - ' + cfg_op['configuration'] + ' ' + fields)
+        counts = [len(node_ops) for node_ops in ops.values() if len(node_ops)]
+        # Use the measured node configuration latency once there is one
+        op_seconds = None
+        if self.__latency is not None:
+            op_seconds = self.__latency.median('node_configure')
+        basis = 'median measured configuration time'
+        if op_seconds is None:
+            op_seconds = self.OP_SECONDS
+            basis = 'assumed configuration time'
+        print('    Total operations: ' + str(sum(counts)))
+        print('    Estimated time  : ' +
+                '{:.0f}'.format(estimate(counts, self.__WINDOW, op_seconds)) + ' s (' +
+                str(self.__WINDOW) + ' nodes at a time, ' + '{:.2g}'.format(op_seconds) +
+                ' s ' + basis + ')\n')
+
+    def __print_result(self, address, done, total):
+        if done == total:
+            print('    ' + uint16(address) + ' OK      ' + str(done) + ' operations')
+        else:
+            print('    ' + uint16(address) + ' FAILED  after ' + str(done) + ' of ' +
+                    str(total) + ' operations')
+
+    def __known(self, address, max_age=None):
+        ''' Get the discovery result of a node that is at most max_age seconds old, by default
+        the discovery cache TTL '''
+        return self.__node.cache.peek(address, max_age)
+
+    async def plan(self, state, refresh=False, max_age=None, window=__WINDOW):
+        ''' Get the node configuration operations by node address that bring the network to
+        a desired state. Nodes without a discovery result at most max_age seconds old, by
+        default the discovery cache TTL, or all nodes if refresh is set, are discovered first.
+        Returns None if a discovery failed '''
+        unknown = [addr for addr in state if refresh or self.__known(addr, max_age) is None]
+        if len(unknown):
+            results = await self.__node.discover_sweep(unknown, window)
+            if any(node is None for _, node, _ in results):
+                return None
+        return {address: diff_node(address, spec, self.__known(address, math.inf))
+                for address, spec in state.items()}
+
+    async def apply(self, ops, window=__WINDOW, on_result=None):
+        ''' Send planned operations, one at a time per node and up to window nodes at a time.
+        A node stops at its first failed operation. Results are (address, done, total)
+        tuples in completion order '''
+        queue = [address for address in sorted(ops, key=lambda addr: -len(ops[addr]))
+                if len(ops[address])]
+        results = []
+
+        async def worker():
+            while len(queue):
+                address = queue.pop(0)
+                done = 0
+                for cfg_op in ops[address]:
+                    if await self.__node.set_config(cfg_op) is None:
+                        break
+                    done += 1
+                results.append((address, done, len(ops[address])))
+                if on_result is not None:
+                    on_result(*results[-1])
+
+        await asyncio.gather(*[worker() for _ in range(window)])
+        return results
@@ -1,20 +1,59 @@
 ''' Bluetooth mesh device provision module '''
+import collections
+import json
+import time
 from byte_codec import uint16
 
+def load_manifest(path):
+    ''' Read a provisioning manifest. The manifest is a JSON object with a list of devices, each
+    either a UUID string or an object with a UUID and optional netIndex, address and attention
+    values, and an optional element count. The netIndex and attention values of the manifest
+    apply to devices without their own. An address of 0 or no address lets the gateway pick
+    the lowest available address, unless the element count is known '''
+    with open(path) as manifest_file:
+        manifest = json.load(manifest_file)
+    jobs = []
+    for device in manifest['devices']:
+        if isinstance(device, str):
+            device = {'uuid': device}
+        jobs.append({
+            'uuid': str(device['uuid']),
+            'netIndex': int(device.get('netIndex', manifest.get('netIndex', 0))),
+            'address': int(device.get('address', 0)),
+            'attention': int(device.get('attention', manifest.get('attention', 0))),
+            'elementCount': int(device.get('elementCount', 0))
+            })
+    return jobs
+
 class Provision():
     ''' Bluetooth mesh device provision interface '''
     __prov_result = {}
+    __NODE_REQ = {
+            'type': 'node_request'
+            }
+    __BATCH_ATTEMPTS = 3
+    # Provisioning a device takes far longer than other gateway operations
+    PROVISION_TIMEOUT = 180
 
-    def __init__(self, sem, beacons, subnets, publish):
-        self.__sem = sem
+    def __init__(self, pending, inventory, beacons, subnets, addresses, latency=None):
+        self.__pending = pending
+        self.__inventory = inventory
         self.__beacons = beacons
         self.__subnets = subnets
-        self.__publish = publish
+        self.__addresses = addresses
+        self.__latency = latency
+
+    def __took(self):
+        ''' Describe how long provisioning takes, measured on this gateway if possible '''
+        median = None if self.__latency is None else self.__latency.median('provision')
+        if median is None:
+            return 'This may take several minutes'
+        return 'This usually takes about ' + '{:.0f}'.format(median) + ' s'
 
     def __print(self):
         if self.__prov_result['error'] != 0:
             print('Failed to provision device with UUID: ' + self.__prov_result['uuid'])
-            print('    Error: ' + int(self.__prov_result['error']))
+            print('    Error: ' + str(self.__prov_result['error']))
             return
 
         print('Provision Result:')
@@ -37,27 +76,151 @@ class Provision():
             except ValueError:
                 print('Invalid address')
                 continue
+            if addr != 0 and self.__print_conflicts(addr, 1):
+                continue
             break
         attn = int(input('Enter the attention timer for the provisioning process: '))
-        print('Provisioning ' + uuid + '. This may take several minutes.')
-        prov = {
-                'id': 'randomId',
-                'type': 'operation',
-                'operation': {
-                    'type': 'provision',
-                    'uuid': uuid,
-                    'netIndex': net_idx,
-                    'address': addr,
-                    'attention': attn
-                    }
-                }
-        self.__publish(prov)
-        if not self.__sem.acquire():
+        print('Provisioning ' + uuid + '. ' + self.__took() + '.')
+        if self.__pending.run(self.provision_device(uuid, net_idx, addr, attn)) is None:
             return
         self.__print()
 
+    def provision_batch(self):
+        ''' Provision every device listed in a manifest file '''
+        path = input('Enter the path of the provisioning manifest: ')
+        try:
+            jobs = load_manifest(path)
+        except (OSError, ValueError, KeyError, TypeError) as err:
+            print('Invalid provisioning manifest: ' + str(err) + '\n')
+            return
+        jobs = self.__pending.run(self.plan(jobs))
+        if jobs is None:
+            print('Could not get the node list, no addresses can be reserved\n')
+            return
+        if len(jobs) == 0:
+            print('No devices to provision\n')
+            return
+        print('Provisioning ' + str(len(jobs)) + ' devices, retrying each up to ' +
+                str(self.__BATCH_ATTEMPTS) + ' times. ' + self.__took() + ' per device...')
+        start = time.monotonic()
+        results = self.__pending.run(self.provision_all(jobs, self.__print_batch_result))
+        self.__print_batch_summary(results, time.monotonic() - start)
+
+    def __print_conflicts(self, addr, count):
+        ''' Print the nodes that already use addresses of a block. Returns True if there are
+        any '''
+        conflicts = self.__addresses.conflicts(addr, count)
+        for start, elements, uuid in conflicts:
+            print('Address ' + uint16(addr) + ' conflicts with node ' + uint16(start) + ' (' +
+                    str(elements) + ' elements' + (', UUID ' + uuid if uuid else '') + ')')
+        return len(conflicts) != 0
+
+    async def plan(self, jobs):
+        ''' Reserve addresses for a list of manifest devices against the current node list.
+        Returns the devices that can be provisioned without an address conflict, or None if
+        the node list could not be requested '''
+        if not self.__inventory.fresh('node_list'):
+            # The node list event rebuilds the address index
+            if await self.__pending.request(self.__NODE_REQ, 'node_list') is None:
+                return None
+        return [job for job in jobs if self.__plan(job)]
+
+    def __plan(self, job):
+        ''' Reserve the addresses of a manifest device. Devices with a known element count and
+        no address get the lowest free block. Returns False if the device cannot be
+        provisioned without an address conflict '''
+        count = max(job['elementCount'], 1)
+        if job['address'] == 0:
+            if job['elementCount'] == 0:
+                return True
+            job['address'] = self.__addresses.reserve(count, job['uuid'])
+            if job['address'] is None:
+                print('No free block of ' + str(count) + ' addresses for ' + job['uuid'])
+                return False
+            return True
+        if self.__print_conflicts(job['address'], count):
+            print('Skipping ' + job['uuid'])
+            return False
+        self.__addresses.hold(job['address'], count, job['uuid'])
+        return True
+
+    def __release(self, job):
+        ''' Release the addresses reserved for a manifest device '''
+        count = max(job['elementCount'], 1)
+        for start, elements, uuid in self.__addresses.conflicts(job['address'], count):
+            if uuid == job['uuid']:
+                self.__addresses.release(start, elements)
+
+    def __print_batch_result(self, uuid, event, attempts, elapsed):
+        timing = ' (attempt ' + str(attempts) + ', ' + '{:.1f}'.format(elapsed) + ' s)'
+        if event is None:
+            print('    ' + uuid + ' FAILED: timeout' + timing)
+        elif event['error'] != 0:
+            print('    ' + uuid + ' FAILED: error ' + str(event['error']) + timing)
+        else:
+            print('    ' + uuid + ' OK: address ' + uint16(event['address']) + timing)
+
+    def __print_batch_summary(self, results, elapsed):
+        provisioned = [result for result in results if self.__succeeded(result[1])]
+        print('\nProvisioning Summary:')
+        print('    Devices provisioned: ' + str(len(provisioned)) + ' of ' + str(len(results)))
+        print('    Attempts           : ' + str(sum(result[2] for result in results)))
+        print('    Total time         : ' + '{:.1f}'.format(elapsed) + ' s')
+        print('    Devices per hour   : ' +
+                '{:.1f}'.format(len(provisioned) * 3600 / max(elapsed, 1e-9)))
+        failed = [result[0] for result in results if not self.__succeeded(result[1])]
+        if len(failed):
+            print('    Failed devices     :')
+            for uuid in failed:
+                print('        - ' + uuid)
+        print()
+
+    def __succeeded(self, event):
+        return event is not None and event['error'] == 0
+
+    async def provision_all(self, jobs, on_result=None, attempts=__BATCH_ATTEMPTS):
+        ''' Provision a list of devices back to back. A failed device is queued again behind
+        the remaining devices until it has been tried the given number of times. Results are
+        (uuid, event, attempts, elapsed) tuples in completion order, event is None when the
+        last attempt timed out '''
+        queue = collections.deque((job, 1) for job in jobs)
+        results = []
+        while len(queue):
+            job, attempt = queue.popleft()
+            start = time.monotonic()
+            event = await self.provision_device(job['uuid'], job['netIndex'], job['address'],
+                    job['attention'])
+            if not self.__succeeded(event) and attempt < attempts:
+                queue.append((job, attempt + 1))
+                continue
+            if job['address'] != 0:
+                self.__release(job)
+            if self.__succeeded(event):
+                self.__addresses.assign(event['address'], event['elementCount'], job['uuid'])
+            result = (job['uuid'], event, attempt, time.monotonic() - start)
+            results.append(result)
+            if on_result is not None:
+                on_result(*result)
+        return results
+
+    async def provision_device(self, uuid, net_idx, addr, attn, timeout=PROVISION_TIMEOUT):
+        ''' Provision a device into a subnet. An address of 0 lets the gateway pick the lowest
+        available address '''
+        prov = {
+                'type': 'provision',
+                'uuid': uuid,
+                'netIndex': net_idx,
+                'address': addr,
+                'attention': attn
+                }
+        # A provisioned device stops beaconing and joins the node list
+        self.__inventory.invalidate('node_list', 'beacon_list')
+        return await self.__pending.request(prov, 'provision_result', {'uuid': uuid}, timeout)
+
     def evt(self, event):
-        del event['type']
-        del event['timestamp']
+        if event['error'] == 0:
+            self.__addresses.assign(event['address'], event['elementCount'], event['uuid'])
         self.__prov_result = event.copy()
-        self.__sem.release()
+        del self.__prov_result['type']
+        del self.__prov_result['timestamp']
+        self.__pending.complete(event)
@@ -2,10 +2,9 @@
 
 class Reset():
     ''' Bluetooth mesh node reset interface '''
-    def __init__(self, sem, nodes, publish):
-        self.__sem = sem
+    def __init__(self, pending, nodes):
+        self.__pending = pending
         self.__nodes = nodes
-        self.__publish = publish
 
     def reset(self):
         # TODO
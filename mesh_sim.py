@@ -0,0 +1,604 @@
+''' Local gateway simulator module '''
+import copy
+import json
+import random
+import threading
+import time
+import byte_codec
+import sync_sem
+import mesh_models
+
+DEVICE_ID = 'simulated-gateway'
+TOPIC_PREFIX = 'sim/'
+GATEWAY_ADDRESS = 1
+ALL_NODES = 0xFFFF
+# Seconds a message takes over the mesh and back, operations handled by the gateway itself take
+# a tenth of it and provisioning twenty times as long
+LATENCY = 0.2
+BEACONS = 10
+# Error of operations on nodes that do not answer, a negative errno as the gateway reports them
+ETIMEDOUT = -110
+EEXIST = -17
+FAULTS = ['drop', 'duplicate', 'reorder', 'delay']
+# Delayed messages arrive after the requests waiting for them have timed out
+DELAY_TIME = sync_sem.Requests.TIMEOUT + 5
+# Longest time a reordered message waits for the message it is swapped with
+REORDER_TIME = 1.0
+ELEMENT_MODELS = [[0x0000, 0x0002, 0x1000, 0x1002], [0x1000, 0x1002]]
+GATEWAY_MODELS = [[0x0000, 0x0001, 0x0003]]
+
+# Server model that receives each model message opcode
+SERVER_MODELS = {mesh_models.MODEL_MSG_OPCODES[msg]: mesh_models.SERVER_MODEL_IDS[model]
+        for model, msgs in mesh_models.SERVER_MODEL_MSGS.items() for msg in msgs}
+# Message name of each opcode
+MODEL_MSG_NAMES = {opcode: msg for msg, opcode in mesh_models.MODEL_MSG_OPCODES.items()}
+# Set message fields that are not part of the state they set
+TRANSIENT_FIELDS = ['tid', 'transition_time', 'delay']
+
+class Message():
+    ''' Received MQTT message, as handed to paho's on_message callback '''
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+class Local_Broker():
+    ''' In-process stand-in for an MQTT broker. Messages published to a topic are delivered to
+    each of its subscribers on the subscriber's event loop '''
+    def __init__(self):
+        self.__subscribers = {}
+        self.__lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, topic, loop, callback):
+        ''' Deliver the messages of a topic to a callback on an event loop '''
+        with self.__lock:
+            self.__subscribers.setdefault(topic, []).append((loop, callback))
+
+    def unsubscribe(self, callback):
+        ''' Stop delivering messages to a callback '''
+        with self.__lock:
+            for topic, subscribers in self.__subscribers.items():
+                self.__subscribers[topic] = [sub for sub in subscribers if sub[1] != callback]
+
+    def publish(self, topic, payload):
+        ''' Deliver a message to the subscribers of its topic. May be called from any thread '''
+        if isinstance(payload, str):
+            payload = payload.encode()
+        with self.__lock:
+            subscribers = list(self.__subscribers.get(topic, []))
+            self.published += 1
+        for loop, callback in subscribers:
+            loop.call_soon_threadsafe(callback, Message(topic, bytes(payload)))
+
+class Local_Client():
+    ''' Stand-in for the part of the paho MQTT client the CLI uses, connected to a
+    Local_Broker. Callbacks run on the event loop like they do under Mqtt_Loop '''
+    def __init__(self, loop, broker, client_id):
+        self.__loop = loop
+        self.__broker = broker
+        self.client_id = client_id
+        self.on_connect = None
+        self.on_message = None
+        self.on_subscribe = None
+        self.__mid = 0
+
+    def tls_set(self, **_kwargs):
+        ''' The local broker needs no credentials '''
+
+    def connect(self, _host, _port=None, _keepalive=None):
+        ''' Report a connection right away, the broker is always reachable '''
+        self.__loop.call_soon(self.on_connect, self, None, {}, 0)
+
+    def subscribe(self, topic, qos=0):
+        ''' Subscribe to a topic. Returns the result code and message ID like paho '''
+        self.__mid += 1
+        self.__broker.subscribe(topic, self.__loop, self.__deliver)
+        self.__loop.call_soon(self.on_subscribe, self, None, self.__mid, (qos,))
+        return 0, self.__mid
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        ''' Publish a message to the broker '''
+        self.__broker.publish(topic, b'' if payload is None else payload)
+
+    def disconnect(self):
+        ''' Stop receiving messages '''
+        self.__broker.unsubscribe(self.__deliver)
+
+    def __deliver(self, msg):
+        self.on_message(self, None, msg)
+
+class Local_Session():
+    ''' Stand-in for Mqtt_Loop driving a Local_Client. Local sessions never reconnect '''
+    def __init__(self, client):
+        self.__client = client
+        self.reconnects = 0
+
+    async def disconnect(self):
+        ''' Disconnect the client '''
+        self.__client.disconnect()
+
+class Fault_Injector():
+    ''' Faulty link that drops, duplicates, reorders or delays the messages sent over it. Each
+    rate is the probability of its fault per message. A reordered message is held back until
+    the next message has gone through. Delayed messages arrive after delay_time seconds '''
+    def __init__(self, loop, drop=0.0, duplicate=0.0, reorder=0.0, delay=0.0,
+            delay_time=DELAY_TIME, seed=None):
+        rates = [drop, duplicate, reorder, delay]
+        if any(rate < 0 for rate in rates) or sum(rates) > 1:
+            raise ValueError('Fault rates must be at least 0 and add up to at most 1')
+        self.__loop = loop
+        self.__rates = list(zip(FAULTS, rates))
+        self.__delay_time = delay_time
+        self.__random = random.Random(seed)
+        self.__held = []
+        self.__release = None
+        self.sent = 0
+        self.counts = dict.fromkeys(FAULTS, 0)
+
+    def send(self, deliver, payload):
+        ''' Send a message, deliver is called with the payload of each copy that arrives '''
+        self.sent += 1
+        fault = None
+        roll = self.__random.random()
+        for name, rate in self.__rates:
+            if roll < rate:
+                fault = name
+                break
+            roll -= rate
+        if fault is not None:
+            self.counts[fault] += 1
+        if fault == 'drop':
+            return
+        if fault == 'delay':
+            self.__loop.call_later(self.__delay_time, deliver, payload)
+            return
+        if fault == 'reorder':
+            self.__held.append((deliver, payload))
+            if self.__release is None:
+                self.__release = self.__loop.call_later(REORDER_TIME, self.__flush)
+            return
+        deliver(payload)
+        if fault == 'duplicate':
+            deliver(payload)
+        self.__flush()
+
+    def __flush(self):
+        if self.__release is not None:
+            self.__release.cancel()
+            self.__release = None
+        held = self.__held
+        self.__held = []
+        for deliver, payload in held:
+            deliver(payload)
+
+def feature(support, state):
+    ''' Node feature of a discovery result '''
+    return {'support': support, 'state': state}
+
+class Virtual_Gateway():
+    ''' Gateway simulator that handles the operations published to the c2d topic of a
+    Local_Broker and publishes the events a gateway would answer with to the d2c topic. It
+    runs a virtual mesh network of configured nodes with two elements each, a Generic OnOff and a
+    Generic Level Server on each element. Replies take latency seconds, +/- 50%, and go through
+    an optional Fault_Injector '''
+    def __init__(self, loop, broker, c2d_topic, d2c_topic, nodes, latency=LATENCY,
+            beacons=BEACONS, faults=None, seed=None):
+        self.__loop = loop
+        self.__faults = faults
+        self.__broker = broker
+        self.__d2c_topic = d2c_topic
+        self.__latency = latency
+        self.__random = random.Random(seed)
+        self.__subnets = [0]
+        self.__app_keys = {0: 0}
+        self.__subscriptions = []
+        self.__client_timeout = 10
+        self.__nodes = {}
+        # Model state and health of each element address and node address
+        self.__states = {}
+        self.__health = {}
+        self.__beacons = [self.__beacon() for _ in range(beacons)]
+        self.__add_node(GATEWAY_ADDRESS, self.__uuid(), 'gateway', 0, GATEWAY_MODELS)
+        for idx in range(nodes):
+            self.__add_node(2 + 2 * idx, self.__uuid(), 'light', 0, ELEMENT_MODELS, True)
+        self.__handlers = {
+                'beacon_request': self.__beacon_request,
+                'provision': self.__provision,
+                'subnet_request': self.__subnet_request,
+                'subnet_add': self.__subnet_add,
+                'subnet_generate': self.__subnet_add,
+                'subnet_delete': self.__subnet_delete,
+                'app_key_request': self.__app_key_request,
+                'app_key_add': self.__app_key_add,
+                'app_key_generate': self.__app_key_add,
+                'app_key_delete': self.__app_key_delete,
+                'node_request': self.__node_request,
+                'node_discover': self.__node_discover,
+                'node_configure': self.__node_configure,
+                'health_fault_get': self.__health_faults,
+                'health_fault_clear': self.__health_faults,
+                'health_fault_test': self.__health_faults,
+                'health_period_get': self.__health_period,
+                'health_period_set': self.__health_period,
+                'health_attention_get': self.__health_attention,
+                'health_attention_set': self.__health_attention,
+                'health_client_timeout_get': self.__client_timeout_request,
+                'health_client_timeout_set': self.__client_timeout_request,
+                'subscribe': self.__subscribe,
+                'unsubscribe': self.__unsubscribe,
+                'subscribe_list_request': self.__subscribe_list_request,
+                'send_model_message': self.__send_model_message
+                }
+        self.operations = 0
+        self.events = 0
+        broker.subscribe(c2d_topic, loop, self.__receive)
+
+    def node_count(self):
+        ''' Get the number of nodes, the gateway included '''
+        return len(self.__nodes)
+
+    def __uuid(self):
+        return '{:032x}'.format(self.__random.getrandbits(128))
+
+    def __beacon(self):
+        return {
+                'uuid': self.__uuid(),
+                'deviceType': 'light',
+                'oobInfo': 'none',
+                'uriHash': self.__random.getrandbits(32)
+                }
+
+    def __add_node(self, address, uuid, device_type, net_idx, element_models, configured=False):
+        ''' Add a node. Models of configured nodes are bound to application key 0 and each
+        element subscribes to group address 0xC000 plus its element index '''
+        elements = []
+        for elem, models in enumerate(element_models):
+            elements.append({
+                'address': address + elem,
+                'sigModels': [{
+                    'modelId': model_id,
+                    'appIndexes': [0] if configured else [],
+                    'subscribeAddresses': [0xC000 + elem] if configured else [],
+                    'publishParameters': {
+                        'address': 0,
+                        'appIndex': 0,
+                        'friendCredentialFlag': False,
+                        'timeToLive': 0,
+                        'period': 0,
+                        'periodUnits': '100ms',
+                        'retransmitCount': 0,
+                        'retransmitInterval': 0
+                        }
+                    } for model_id in models],
+                'vendorModels': []
+                })
+            self.__states[address + elem] = {}
+        self.__nodes[address] = {
+                'address': address,
+                'uuid': uuid,
+                'deviceType': device_type,
+                'netIndex': net_idx,
+                'elementCount': len(elements),
+                'cid': 0x0059,
+                'pid': 0,
+                'vid': 0,
+                'crpl': 40,
+                'networkBeaconState': True,
+                'timeToLive': 5,
+                'relayFeature': dict(feature(True, True), retransmitCount=2,
+                    retransmitInterval=20),
+                'proxyFeature': feature(True, True),
+                'friendFeature': feature(True, False),
+                'lpnFeature': feature(False, False),
+                'subnets': [net_idx],
+                'elements': elements
+                }
+        self.__health[address] = {'faults': [], 'divisor': 0, 'attention': 0}
+
+    def __free_address(self, count):
+        ''' Get the lowest unicast address with count free addresses from it '''
+        used = set()
+        for node in self.__nodes.values():
+            used.update(range(node['address'], node['address'] + node['elementCount']))
+        address = 2
+        while any(addr in used for addr in range(address, address + count)):
+            address += 1
+        return address
+
+    def __receive(self, msg):
+        try:
+            operation = json.loads(msg.payload)['operation']
+            handler = self.__handlers[operation['type']]
+        except (ValueError, KeyError, TypeError):
+            print('Simulator: ignoring message on ' + msg.topic)
+            return
+        self.operations += 1
+        handler(operation)
+
+    def __reply(self, event, delay):
+        ''' Publish an event after delay seconds, +/- 50% '''
+        event['timestamp'] = int(time.time() * 1000)
+        payload = json.dumps({'type': 'event', 'event': event})
+        self.__loop.call_later(delay * self.__random.uniform(0.5, 1.5), self.__publish, payload)
+
+    def __publish(self, payload):
+        if self.__faults is None:
+            self.__deliver(payload)
+        else:
+            self.__faults.send(self.__deliver, payload)
+
+    def __deliver(self, payload):
+        self.events += 1
+        self.__broker.publish(self.__d2c_topic, payload)
+
+    def __local(self, event):
+        ''' Reply to an operation the gateway handles without the mesh '''
+        self.__reply(event, self.__latency / 10)
+
+    def __beacon_request(self, _operation):
+        self.__local({'type': 'beacon_list', 'beacons': [dict(beacon)
+            for beacon in self.__beacons]})
+
+    def __provision(self, operation):
+        uuid = operation['uuid']
+        beacon = next((beacon for beacon in self.__beacons if beacon['uuid'] == uuid), None)
+        count = len(ELEMENT_MODELS)
+        address = operation['address'] or self.__free_address(count)
+        error = 0
+        if beacon is None or operation['netIndex'] not in self.__subnets:
+            error = ETIMEDOUT
+        elif any(addr in self.__states for addr in range(address, address + count)):
+            error = EEXIST
+        else:
+            self.__beacons.remove(beacon)
+            self.__add_node(address, uuid, beacon['deviceType'], operation['netIndex'],
+                    ELEMENT_MODELS)
+        self.__reply({
+            'type': 'provision_result',
+            'uuid': uuid,
+            'error': error,
+            'address': address if error == 0 else 0,
+            'elementCount': count if error == 0 else 0
+            }, self.__latency * 20)
+
+    def __subnet_list(self):
+        self.__local({'type': 'subnet_list', 'subnetList': [{'netIndex': net_idx}
+            for net_idx in self.__subnets]})
+
+    def __subnet_request(self, _operation):
+        self.__subnet_list()
+
+    def __subnet_add(self, operation):
+        if operation['netIndex'] not in self.__subnets:
+            self.__subnets.append(operation['netIndex'])
+        self.__subnet_list()
+
+    def __subnet_delete(self, operation):
+        if operation['netIndex'] != 0 and operation['netIndex'] in self.__subnets:
+            self.__subnets.remove(operation['netIndex'])
+        self.__subnet_list()
+
+    def __app_key_list(self):
+        self.__local({'type': 'app_key_list', 'appKeyList': [{
+            'appIndex': app_idx,
+            'netIndex': net_idx
+            } for app_idx, net_idx in sorted(self.__app_keys.items())]})
+
+    def __app_key_request(self, _operation):
+        self.__app_key_list()
+
+    def __app_key_add(self, operation):
+        if operation['netIndex'] in self.__subnets:
+            self.__app_keys.setdefault(operation['appIndex'], operation['netIndex'])
+        self.__app_key_list()
+
+    def __app_key_delete(self, operation):
+        self.__app_keys.pop(operation['appIndex'], None)
+        self.__app_key_list()
+
+    def __node_request(self, _operation):
+        self.__local({'type': 'node_list', 'nodes': [{
+            'address': node['address'],
+            'uuid': node['uuid'],
+            'deviceType': node['deviceType'],
+            'netIndex': node['netIndex'],
+            'elementCount': node['elementCount']
+            } for node in self.__nodes.values()]})
+
+    def __discover_result(self, address):
+        node = self.__nodes.get(address)
+        if node is None:
+            self.__reply({'type': 'node_discover_result', 'error': ETIMEDOUT, 'status': 0,
+                'address': address}, self.__latency * 5)
+            return
+        # Copy the details, they change with later configurations
+        event = copy.deepcopy(node)
+        event.update({'type': 'node_discover_result', 'error': 0, 'status': 0})
+        self.__reply(event, self.__latency)
+
+    def __node_discover(self, operation):
+        self.__discover_result(operation['address'])
+
+    def __node_configure(self, operation):
+        address = operation['nodeAddress']
+        node = self.__nodes.get(address)
+        if node is not None:
+            self.__configure(node, operation)
+        self.__discover_result(address)
+
+    def __configure(self, node, operation):
+        config = operation['configuration']
+        if config == 'networkBeaconSet':
+            node['networkBeaconState'] = operation['state']
+        elif config == 'timeToLiveSet':
+            node['timeToLive'] = operation['value']
+        elif config == 'relayFeatureSet':
+            node['relayFeature'].update(state=operation['state'],
+                    retransmitCount=operation['retransmitCount'],
+                    retransmitInterval=operation['retransmitInterval'])
+        elif config == 'proxyFeatureSet':
+            node['proxyFeature']['state'] = operation['state']
+        elif config == 'friendFeatureSet':
+            node['friendFeature']['state'] = operation['state']
+        elif config == 'subnetAdd':
+            if operation['netIndex'] not in node['subnets']:
+                node['subnets'].append(operation['netIndex'])
+        elif config == 'subnetDelete':
+            if operation['netIndex'] in node['subnets']:
+                node['subnets'].remove(operation['netIndex'])
+        else:
+            model = self.__model(node, operation['elementAddress'], operation['modelId'])
+            if model is not None:
+                self.__configure_model(model, operation)
+
+    @staticmethod
+    def __model(node, elem_addr, model_id):
+        for element in node['elements']:
+            if element['address'] == elem_addr:
+                for model in element['sigModels']:
+                    if model['modelId'] == model_id:
+                        return model
+        return None
+
+    def __configure_model(self, model, operation):
+        config = operation['configuration']
+        subs = model['subscribeAddresses']
+        if config == 'appKeyBind':
+            if operation['appIndex'] in self.__app_keys and \
+                    operation['appIndex'] not in model['appIndexes']:
+                model['appIndexes'].append(operation['appIndex'])
+        elif config == 'appKeyUnbind':
+            if operation['appIndex'] in model['appIndexes']:
+                model['appIndexes'].remove(operation['appIndex'])
+        elif config == 'publishParametersSet':
+            model['publishParameters'] = {
+                    'address': operation['publishAddress'],
+                    'appIndex': operation['appIndex'],
+                    'friendCredentialFlag': operation['friendCredentialFlag'],
+                    'timeToLive': operation['timeToLive'],
+                    'period': operation['period'],
+                    'periodUnits': operation['periodUnits'],
+                    'retransmitCount': operation['retransmitCount'],
+                    'retransmitInterval': operation['retransmitInterval']
+                    }
+        elif config == 'subscribeAddressAdd':
+            if operation['subscribeAddress'] not in subs:
+                subs.append(operation['subscribeAddress'])
+        elif config == 'subscribeAddressDelete':
+            if operation['subscribeAddress'] in subs:
+                subs.remove(operation['subscribeAddress'])
+        elif config == 'subscribeAddressOverwrite':
+            subs[:] = [operation['subscribeAddress']]
+
+    def __health_faults(self, operation):
+        health = self.__health.get(operation['address'])
+        if health is None:
+            return
+        if operation['type'] == 'health_fault_clear':
+            health['faults'] = []
+        self.__reply({
+            'type': 'health_faults_registered',
+            'address': operation['address'],
+            'testId': operation.get('testId', 0),
+            'companyId': operation['companyId'],
+            'faults': [{'fault': fault} for fault in health['faults']]
+            }, self.__latency)
+
+    def __health_period(self, operation):
+        health = self.__health.get(operation['address'])
+        if health is None:
+            return
+        health['divisor'] = operation.get('divisor', health['divisor'])
+        self.__reply({'type': 'health_period', 'address': operation['address'],
+            'divisor': health['divisor']}, self.__latency)
+
+    def __health_attention(self, operation):
+        health = self.__health.get(operation['address'])
+        if health is None:
+            return
+        health['attention'] = operation.get('attention', health['attention'])
+        self.__reply({'type': 'health_attention', 'address': operation['address'],
+            'attention': health['attention']}, self.__latency)
+
+    def __client_timeout_request(self, operation):
+        self.__client_timeout = operation.get('timeout', self.__client_timeout)
+        self.__local({'type': 'health_client_timeout', 'timeout': self.__client_timeout})
+
+    def __subscribe_list(self):
+        self.__local({'type': 'subscribe_list', 'addressList': [{'address': address}
+            for address in self.__subscriptions]})
+
+    def __subscribe(self, operation):
+        for entry in operation['addressList']:
+            if entry['address'] not in self.__subscriptions:
+                self.__subscriptions.append(entry['address'])
+        self.__subscribe_list()
+
+    def __unsubscribe(self, operation):
+        for entry in operation['addressList']:
+            if entry['address'] in self.__subscriptions:
+                self.__subscriptions.remove(entry['address'])
+        self.__subscribe_list()
+
+    def __subscribe_list_request(self, _operation):
+        self.__subscribe_list()
+
+    def __destinations(self, address, model_id, app_idx):
+        ''' Generate the addresses of the elements with a model bound to app_idx that a message
+        to an address reaches '''
+        for node in self.__nodes.values():
+            for idx, element in enumerate(node['elements']):
+                for model in element['sigModels']:
+                    if model['modelId'] != model_id or app_idx not in model['appIndexes']:
+                        continue
+                    if address == element['address'] or address in \
+                            model['subscribeAddresses'] or (address == ALL_NODES and idx == 0):
+                        yield element['address'], model
+
+    def __send_model_message(self, operation):
+        opcode = operation['opcode']
+        name = MODEL_MSG_NAMES.get(opcode)
+        model_id = SERVER_MODELS.get(opcode)
+        if name is None or model_id is None:
+            return
+        try:
+            record = mesh_models.DECODERS[opcode].decode(
+                    byte_codec.payload_from_wire(operation['payload']))
+        except ValueError:
+            return
+        fields = [field.name for field in mesh_models.DECODERS[opcode].fields]
+        status = mesh_models.MODEL_MSG_STATUS.get(name)
+        for elem_addr, model in self.__destinations(operation['address'], model_id,
+                operation['appIndex']):
+            state = self.__states[elem_addr]
+            changed = False
+            for field, value in zip(fields, record):
+                if field not in TRANSIENT_FIELDS and value is not None and \
+                        state.get(field) != value:
+                    state[field] = value
+                    changed = True
+            if status is not None:
+                self.__model_reply(operation, elem_addr, GATEWAY_ADDRESS, status, state)
+            pub = model['publishParameters']
+            if changed and pub['address'] != 0 and status is not None:
+                self.__model_reply(operation, elem_addr, pub['address'], status, state)
+
+    def __model_reply(self, operation, source, destination, status, state):
+        ''' Send a status message, the gateway relays it if it subscribes to the destination '''
+        if destination not in self.__subscriptions:
+            return
+        encoder = mesh_models.ENCODERS[status]
+        values = {}
+        for field in encoder.required:
+            key = field.name[len('present_'):] if field.name.startswith('present_') else \
+                    field.name
+            values[field.name] = state.get(key, 0)
+        self.__reply({
+            'type': 'receive_model_message',
+            'netIndex': operation['netIndex'],
+            'appIndex': operation['appIndex'],
+            'sourceAddress': source,
+            'destinationAddress': destination,
+            'opcode': encoder.opcode,
+            'payload': byte_codec.payload_to_wire(encoder.encode(**values))
+            }, self.__latency)
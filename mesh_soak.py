@@ -0,0 +1,193 @@
+''' Long-running soak test module '''
+import asyncio
+import collections
+import csv
+import os
+import random
+import statistics
+import threading
+import time
+
+INTERVAL = 60
+CONCURRENCY = 4
+# Latencies kept per operation for the results, a uniform sample so that memory stays flat
+RESERVOIR = 10000
+# Share of the run left out of trend checks while caches fill up
+WARMUP = 0.2
+# Growth over the checked part of the run, relative to the mean, that fails the soak test
+TOLERANCE = 0.1
+# Growth below these amounts always passes, whatever the mean
+SLACK = {
+        'rss': 4 * 1024 * 1024,
+        'threads': 1,
+        'pending': 2,
+        'latency': 0.05
+        }
+
+Sample = collections.namedtuple('Sample',
+        ['elapsed', 'rss', 'threads', 'pending', 'latency', 'operations', 'failed'])
+
+def rss():
+    ''' Get the resident set size of the process in bytes. Returns None without /proc '''
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def slope(points):
+    ''' Get the least squares slope of (x, y) points, or None with fewer than two x values '''
+    if len(set(x for x, _ in points)) < 2:
+        return None
+    mean_x = statistics.fmean(x for x, _ in points)
+    mean_y = statistics.fmean(y for _, y in points)
+    num = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    den = sum((x - mean_x) ** 2 for x, _ in points)
+    return num / den
+
+def trends(samples, warmup=WARMUP, tolerance=TOLERANCE):
+    ''' Check the tracked values of the samples after the warmup share of the run for upward
+    trends. Returns the (name, growth, mean) of each value whose growth over the checked part
+    of the run, following its least squares line, is above tolerance times its mean and above
+    its slack '''
+    if len(samples) == 0:
+        return []
+    start = samples[-1].elapsed * warmup
+    checked = [sample for sample in samples if sample.elapsed >= start]
+    found = []
+    for name, slack in SLACK.items():
+        points = [(sample.elapsed, getattr(sample, name)) for sample in checked
+                if getattr(sample, name) is not None]
+        rate = slope(points)
+        if rate is None:
+            continue
+        growth = rate * (points[-1][0] - points[0][0])
+        mean = statistics.fmean(y for _, y in points)
+        if growth > max(tolerance * abs(mean), slack):
+            found.append((name, growth, mean))
+    return found
+
+class Soak():
+    ''' Soak test that keeps concurrency workers repeating operations on random nodes for
+    duration seconds and samples the process every interval seconds. Operations are (name,
+    coroutine function) pairs, the function gets a node address and its coroutine returns None
+    if the gateway did not answer in time. Unanswered and raising operations count as failed '''
+    def __init__(self, operations, pending, duration, interval=INTERVAL,
+            concurrency=CONCURRENCY, seed=None, out=None, output=None):
+        self.__operations = operations
+        self.__addresses = []
+        self.__pending = pending
+        self.__duration = duration
+        self.__interval = interval
+        self.__concurrency = concurrency
+        self.__random = random.Random(seed)
+        self.__out = out
+        self.__output = output
+        self.__latencies = []
+        self.__by_operation = {name: [] for name, _ in operations}
+        self.__answered = collections.Counter()
+        self.__failed = collections.Counter()
+        self.__operations_done = 0
+        self.samples = []
+
+    async def run(self, addresses, stopping):
+        ''' Run the soak test on node addresses until its duration is up or the stopping event
+        is set. Returns the samples '''
+        self.__addresses = addresses
+        start = time.monotonic()
+        deadline = start + self.__duration
+        workers = [asyncio.ensure_future(self.__worker(deadline, stopping))
+                for _ in range(self.__concurrency)]
+        writer = None
+        output = None
+        if self.__output is not None:
+            output = open(self.__output, 'w', newline='')
+            writer = csv.writer(output)
+            writer.writerow(Sample._fields)
+        try:
+            while time.monotonic() < deadline and not stopping.is_set():
+                try:
+                    await asyncio.wait_for(stopping.wait(), min(self.__interval,
+                        max(deadline - time.monotonic(), 0)))
+                except asyncio.TimeoutError:
+                    pass
+                sample = self.__sample(time.monotonic() - start)
+                self.samples.append(sample)
+                if writer is not None:
+                    writer.writerow(sample)
+                    output.flush()
+                self.__print(self.__describe(sample))
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if output is not None:
+                output.close()
+        return self.samples
+
+    async def __worker(self, deadline, stopping):
+        while time.monotonic() < deadline and not stopping.is_set():
+            name, operation = self.__random.choice(self.__operations)
+            start = time.monotonic()
+            try:
+                result = await operation(self.__random.choice(self.__addresses))
+            except Exception as err:
+                self.__print('ERROR: ' + name + ' failed: ' + repr(err))
+                result = None
+            self.__operations_done += 1
+            if result is None:
+                self.__failed[name] += 1
+                continue
+            elapsed = time.monotonic() - start
+            self.__latencies.append(elapsed)
+            self.__answered[name] += 1
+            kept = self.__by_operation[name]
+            if len(kept) < RESERVOIR:
+                kept.append(elapsed)
+            else:
+                idx = self.__random.randrange(self.__answered[name])
+                if idx < RESERVOIR:
+                    kept[idx] = elapsed
+
+    def __sample(self, elapsed):
+        latencies = self.__latencies
+        self.__latencies = []
+        return Sample(round(elapsed, 3), rss(), threading.active_count(), self.__pending.count(),
+                statistics.median(latencies) if latencies else None, self.__operations_done,
+                sum(self.__failed.values()))
+
+    @staticmethod
+    def __describe(sample):
+        line = '{:>8.0f} s'.format(sample.elapsed)
+        if sample.rss is not None:
+            line += '  RSS ' + '{:.1f}'.format(sample.rss / 1024 / 1024) + ' MiB'
+        line += '  threads ' + str(sample.threads) + '  pending ' + str(sample.pending)
+        if sample.latency is not None:
+            line += '  latency p50 ' + '{:.3f}'.format(sample.latency) + ' s'
+        line += '  operations ' + str(sample.operations) + '  failed ' + str(sample.failed)
+        return line
+
+    def __print(self, line):
+        print(line, file=self.__out, flush=True)
+
+    def report(self, warmup=WARMUP, tolerance=TOLERANCE):
+        ''' Print the latency of each operation and the upward trends found. Returns True if
+        there were none '''
+        self.__print('SOAK TEST RESULTS')
+        self.__print('    Operation               Answered    Failed    p50 s    p99 s')
+        for name, latencies in self.__by_operation.items():
+            latencies = sorted(latencies)
+            line = '    ' + '{:<22}'.format(name) + '{:>8}'.format(self.__answered[name]) + \
+                    '{:>10}'.format(self.__failed[name])
+            if latencies:
+                line += '{:>9.3f}'.format(latencies[len(latencies) // 2])
+                line += '{:>9.3f}'.format(latencies[min(int(len(latencies) * 0.99),
+                    len(latencies) - 1)])
+            self.__print(line)
+        found = trends(self.samples, warmup, tolerance)
+        for name, growth, mean in found:
+            self.__print('FAILED: ' + name + ' trends upward, growing ' + '{:.3g}'.format(growth) +
+                    ' over the run with mean ' + '{:.3g}'.format(mean))
+        if not found:
+            self.__print('PASSED: no upward trends')
+        return not found
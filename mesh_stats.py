@@ -0,0 +1,154 @@
+''' Gateway operation latency statistics module '''
+import os
+import threading
+
+# Values are recorded in microseconds, with 2 ** (SUB_BITS - 1) buckets per power of two above
+# 2 ** SUB_BITS, so a bucket is at most 1/64 wider than its lower bound
+SUB_BITS = 7
+HALF = 1 << (SUB_BITS - 1)
+# Bucket bounds of the Prometheus histograms in seconds
+BOUNDS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30, 60, 120, 300]
+PERCENTILES = [50, 90, 99]
+
+def bucket(value):
+    ''' Get the bucket index of a non-negative integer value '''
+    exponent = max(value.bit_length() - SUB_BITS, 0)
+    return (exponent << (SUB_BITS - 1)) + (value >> exponent)
+
+def bucket_bounds(index):
+    ''' Get the lowest value and the highest value plus one of a bucket '''
+    if index < 2 * HALF:
+        return index, index + 1
+    exponent = (index >> (SUB_BITS - 1)) - 1
+    low = (index - (exponent << (SUB_BITS - 1))) << exponent
+    return low, low + (1 << exponent)
+
+class Histogram():
+    ''' HDR-style histogram of durations in seconds: log-linear buckets of whole microseconds
+    that keep the relative error of every percentile below 2% in a fixed, small size '''
+    def __init__(self):
+        self.__counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        ''' Add a duration '''
+        index = bucket(max(int(seconds * 1e6), 0))
+        self.__counts[index] = self.__counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def percentile(self, percent):
+        ''' Get the duration that percent of the recorded durations are at or below, as the
+        middle of its bucket. Returns None if the histogram is empty '''
+        if self.count == 0:
+            return None
+        rank = max(self.count * percent / 100, 1)
+        seen = 0
+        for index in sorted(self.__counts):
+            seen += self.__counts[index]
+            if seen >= rank:
+                low, high = bucket_bounds(index)
+                return min(max((low + high - 1) / 2e6, self.min), self.max)
+        return self.max
+
+    def cumulative(self, bounds):
+        ''' Get the number of durations at or below each bound in seconds. Buckets that straddle
+        a bound count as above it '''
+        counts = [0] * len(bounds)
+        for index, count in self.__counts.items():
+            high = bucket_bounds(index)[1] / 1e6
+            for idx, bound in enumerate(bounds):
+                if high <= bound:
+                    counts[idx] += count
+        return counts
+
+class Latency_Stats():
+    ''' Round-trip latency of gateway operations, from publishing the operation to receiving
+    the event that answers it, in one histogram per operation type '''
+    def __init__(self):
+        self.__histograms = {}
+        self.__answers = {}
+        self.__timeouts = {}
+        self.__lock = threading.Lock()
+
+    def record(self, operation, evt_type, seconds):
+        ''' Add the latency of an operation answered by an event type '''
+        with self.__lock:
+            histogram = self.__histograms.get(operation)
+            if histogram is None:
+                histogram = self.__histograms[operation] = Histogram()
+            histogram.record(seconds)
+            self.__answers[operation] = evt_type
+
+    def timeout(self, operation):
+        ''' Count an operation that was not answered in time '''
+        with self.__lock:
+            self.__timeouts[operation] = self.__timeouts.get(operation, 0) + 1
+
+    def median(self, operation):
+        ''' Get the median latency of an operation type, or None if none was answered '''
+        with self.__lock:
+            histogram = self.__histograms.get(operation)
+            return None if histogram is None else histogram.percentile(50)
+
+    def report(self):
+        ''' Print the latency percentiles of each operation type '''
+        with self.__lock:
+            operations = sorted(set(self.__histograms) | set(self.__timeouts))
+            if len(operations) == 0:
+                print('No gateway operations answered yet\n')
+                return
+            print('OPERATION LATENCY (ms from publishing an operation to its answer event)')
+            print('    {:<27}{:>7}{:>9}{:>9}{:>9}{:>9}{:>9}{:>9}'.format('Operation', 'Count',
+                'Timeouts', 'Min', 'p50', 'p90', 'p99', 'Max'))
+            for operation in operations:
+                histogram = self.__histograms.get(operation, Histogram())
+                line = '    {:<27}{:>7}{:>9}'.format(operation, histogram.count,
+                        self.__timeouts.get(operation, 0))
+                if histogram.count:
+                    values = [histogram.min] + [histogram.percentile(percent)
+                            for percent in PERCENTILES] + [histogram.max]
+                    line += ''.join('{:>9.1f}'.format(value * 1000) for value in values)
+                print(line)
+            print()
+
+    def prometheus(self):
+        ''' Get the statistics in the Prometheus text exposition format '''
+        lines = [
+                '# HELP mesh_operation_latency_seconds Round-trip latency of gateway operations',
+                '# TYPE mesh_operation_latency_seconds histogram'
+                ]
+        with self.__lock:
+            for operation in sorted(self.__histograms):
+                histogram = self.__histograms[operation]
+                labels = 'operation="' + operation + '",event="' + \
+                        self.__answers[operation] + '"'
+                for bound, count in zip(BOUNDS, histogram.cumulative(BOUNDS)):
+                    lines.append('mesh_operation_latency_seconds_bucket{' + labels + ',le="' +
+                            '{:g}'.format(bound) + '"} ' + str(count))
+                lines.append('mesh_operation_latency_seconds_bucket{' + labels + ',le="+Inf"} ' +
+                        str(histogram.count))
+                lines.append('mesh_operation_latency_seconds_sum{' + labels + '} ' +
+                        repr(histogram.total))
+                lines.append('mesh_operation_latency_seconds_count{' + labels + '} ' +
+                        str(histogram.count))
+            lines.append('# HELP mesh_operation_timeouts_total Gateway operations not ' +
+                    'answered in time')
+            lines.append('# TYPE mesh_operation_timeouts_total counter')
+            for operation in sorted(self.__timeouts):
+                lines.append('mesh_operation_timeouts_total{operation="' + operation + '"} ' +
+                        str(self.__timeouts[operation]))
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path):
+        ''' Write the Prometheus text to a file. The file is replaced in one step, so a
+        collector never reads it half written '''
+        temp = path + '.tmp'
+        with open(temp, 'w') as metrics:
+            metrics.write(self.prometheus())
+        os.replace(temp, path)
@@ -0,0 +1,299 @@
+''' Bluetooth mesh topology snapshot module '''
+import os
+import sqlite3
+import threading
+import time
+
+class Topology_Store():
+    ''' SQLite snapshot of the node list and node discovery results of a mesh gateway '''
+    __SCHEMA_VERSION = 1
+    __SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS node_list (
+        gateway TEXT NOT NULL,
+        address INTEGER NOT NULL,
+        uuid TEXT,
+        device_type TEXT,
+        net_index INTEGER,
+        element_count INTEGER,
+        PRIMARY KEY (gateway, address)
+    );
+    CREATE TABLE IF NOT EXISTS nodes (
+        gateway TEXT NOT NULL,
+        address INTEGER NOT NULL,
+        uuid TEXT,
+        cid INTEGER,
+        pid INTEGER,
+        vid INTEGER,
+        crpl INTEGER,
+        network_beacon INTEGER,
+        ttl INTEGER,
+        relay_support INTEGER,
+        relay_state INTEGER,
+        relay_count INTEGER,
+        relay_interval INTEGER,
+        proxy_support INTEGER,
+        proxy_state INTEGER,
+        friend_support INTEGER,
+        friend_state INTEGER,
+        lpn_state INTEGER,
+        discovered_at REAL,
+        PRIMARY KEY (gateway, address)
+    );
+    CREATE TABLE IF NOT EXISTS node_subnets (
+        gateway TEXT NOT NULL,
+        node INTEGER NOT NULL,
+        net_index INTEGER NOT NULL,
+        PRIMARY KEY (gateway, node, net_index)
+    );
+    CREATE TABLE IF NOT EXISTS elements (
+        gateway TEXT NOT NULL,
+        node INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        address INTEGER NOT NULL,
+        PRIMARY KEY (gateway, node, position)
+    );
+    CREATE TABLE IF NOT EXISTS models (
+        id INTEGER PRIMARY KEY,
+        gateway TEXT NOT NULL,
+        node INTEGER NOT NULL,
+        element INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        company_id INTEGER,
+        model_id INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS models_node ON models (gateway, node);
+    CREATE TABLE IF NOT EXISTS bindings (
+        model INTEGER NOT NULL REFERENCES models (id) ON DELETE CASCADE,
+        app_index INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS subscriptions (
+        model INTEGER NOT NULL REFERENCES models (id) ON DELETE CASCADE,
+        address INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS publish_parameters (
+        model INTEGER PRIMARY KEY REFERENCES models (id) ON DELETE CASCADE,
+        address INTEGER,
+        app_index INTEGER,
+        friend_credential INTEGER,
+        ttl INTEGER,
+        period INTEGER,
+        period_units TEXT,
+        retransmit_count INTEGER,
+        retransmit_interval INTEGER
+    );
+    '''
+
+    def __init__(self):
+        self.__gateway = None
+        self.__db = None
+        self.__lock = threading.Lock()
+
+    def open(self, path, gateway):
+        ''' Open the snapshot database and select the gateway whose topology is stored. Until
+        the store is opened, saving does nothing and loading returns nothing '''
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Handlers may run on a different thread than the one that opened the store
+        db = sqlite3.connect(path, check_same_thread=False)
+        try:
+            db.execute('PRAGMA foreign_keys = ON')
+            version = db.execute('PRAGMA user_version').fetchone()[0]
+            if version not in (0, self.__SCHEMA_VERSION):
+                raise sqlite3.DatabaseError('Unsupported topology snapshot version ' +
+                        str(version))
+            with db:
+                db.executescript(self.__SCHEMA)
+                db.execute('PRAGMA user_version = ' + str(self.__SCHEMA_VERSION))
+        except sqlite3.Error:
+            db.close()
+            raise
+        with self.__lock:
+            if self.__db is not None:
+                self.__db.close()
+            self.__gateway = gateway
+            self.__db = db
+
+    def close(self):
+        ''' Close the snapshot database '''
+        with self.__lock:
+            if self.__db is not None:
+                self.__db.close()
+                self.__db = None
+
+    def save_node_list(self, node_list):
+        ''' Replace the stored node list with the list received from the gateway '''
+        if self.__db is None:
+            return
+        rows = [(self.__gateway, node['address'], node.get('uuid'), node.get('deviceType'),
+            node.get('netIndex'), node.get('elementCount')) for node in node_list]
+        addresses = [node['address'] for node in node_list]
+        with self.__lock, self.__db:
+            self.__db.execute('DELETE FROM node_list WHERE gateway = ?', (self.__gateway,))
+            self.__db.executemany('INSERT INTO node_list VALUES (?, ?, ?, ?, ?, ?)', rows)
+            # Forget discovery results of nodes that have left the network
+            for address in self.__db.execute('SELECT address FROM nodes WHERE gateway = ?',
+                    (self.__gateway,)).fetchall():
+                if address[0] not in addresses:
+                    self.__delete_node(address[0])
+
+    def load_node_list(self):
+        ''' Get the stored node list in the gateway's node list format '''
+        if self.__db is None:
+            return []
+        with self.__lock:
+            rows = self.__db.execute('SELECT address, uuid, device_type, net_index, ' +
+                    'element_count FROM node_list WHERE gateway = ? ORDER BY address',
+                    (self.__gateway,)).fetchall()
+        return [{
+            'address': address,
+            'uuid': uuid,
+            'deviceType': device_type,
+            'netIndex': net_index,
+            'elementCount': element_count
+            } for address, uuid, device_type, net_index, element_count in rows]
+
+    def save_node(self, node):
+        ''' Replace the stored discovery result of a node '''
+        if self.__db is None:
+            return
+        relay = node.get('relayFeature', {})
+        proxy = node.get('proxyFeature', {})
+        friend = node.get('friendFeature', {})
+        lpn = node.get('lpnFeature', {})
+        address = node['address']
+        with self.__lock, self.__db:
+            self.__delete_node(address)
+            self.__db.execute('INSERT INTO nodes VALUES ' +
+                    '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (self.__gateway, address, node.get('uuid'), node.get('cid'),
+                        node.get('pid'), node.get('vid'), node.get('crpl'),
+                        node.get('networkBeaconState'), node.get('timeToLive'),
+                        relay.get('support'), relay.get('state'), relay.get('retransmitCount'),
+                        relay.get('retransmitInterval'), proxy.get('support'),
+                        proxy.get('state'), friend.get('support'), friend.get('state'),
+                        lpn.get('state'), time.time()))
+            self.__db.executemany('INSERT INTO node_subnets VALUES (?, ?, ?)',
+                    [(self.__gateway, address, net_idx) for net_idx in node.get('subnets', [])])
+            for position, element in enumerate(node.get('elements', [])):
+                self.__db.execute('INSERT INTO elements VALUES (?, ?, ?, ?)',
+                        (self.__gateway, address, position, element['address']))
+                models = [(None, model, model.get('appIndexes', []))
+                        for model in element.get('sigModels', [])]
+                models += [(model['companyId'], model, model.get('appIndex', []))
+                        for model in element.get('vendorModels', [])]
+                for model_pos, (company_id, model, app_indexes) in enumerate(models):
+                    self.__save_model(address, element['address'], model_pos, company_id,
+                            model, app_indexes)
+
+    def __save_model(self, address, elem_addr, position, company_id, model, app_indexes):
+        cursor = self.__db.execute('INSERT INTO models (gateway, node, element, position, ' +
+                'company_id, model_id) VALUES (?, ?, ?, ?, ?, ?)',
+                (self.__gateway, address, elem_addr, position, company_id, model['modelId']))
+        model_row = cursor.lastrowid
+        self.__db.executemany('INSERT INTO bindings VALUES (?, ?)',
+                [(model_row, app_idx) for app_idx in app_indexes])
+        self.__db.executemany('INSERT INTO subscriptions VALUES (?, ?)',
+                [(model_row, sub_addr) for sub_addr in model.get('subscribeAddresses', [])])
+        pub = model.get('publishParameters')
+        if pub is not None:
+            self.__db.execute('INSERT INTO publish_parameters VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (model_row, pub.get('address'), pub.get('appIndex'),
+                        pub.get('friendCredentialFlag'), pub.get('timeToLive'),
+                        pub.get('period'), pub.get('periodUnits'), pub.get('retransmitCount'),
+                        pub.get('retransmitInterval')))
+
+    def __delete_node(self, address):
+        params = (self.__gateway, address)
+        self.__db.execute('DELETE FROM nodes WHERE gateway = ? AND address = ?', params)
+        self.__db.execute('DELETE FROM node_subnets WHERE gateway = ? AND node = ?', params)
+        self.__db.execute('DELETE FROM elements WHERE gateway = ? AND node = ?', params)
+        self.__db.execute('DELETE FROM models WHERE gateway = ? AND node = ?', params)
+
+    def delete_node(self, address):
+        ''' Forget the discovery result of a node '''
+        if self.__db is None:
+            return
+        with self.__lock, self.__db:
+            self.__delete_node(address)
+
+    def load_nodes(self):
+        ''' Get all stored discovery results in the gateway's node discovery format, as
+        (node, discovered_at) pairs where discovered_at is the time.time() of the discovery '''
+        if self.__db is None:
+            return []
+        with self.__lock:
+            rows = self.__db.execute('SELECT * FROM nodes WHERE gateway = ? ORDER BY address',
+                    (self.__gateway,)).fetchall()
+            return [(self.__load_node(row), row[-1]) for row in rows]
+
+    def __load_node(self, row):
+        (_, address, uuid, cid, pid, vid, crpl, beacon, ttl, relay_support, relay_state,
+                relay_count, relay_interval, proxy_support, proxy_state, friend_support,
+                friend_state, lpn_state, _) = row
+        params = (self.__gateway, address)
+        node = {
+                'address': address,
+                'uuid': uuid,
+                'cid': cid,
+                'pid': pid,
+                'vid': vid,
+                'crpl': crpl,
+                'networkBeaconState': bool(beacon),
+                'timeToLive': ttl,
+                'relayFeature': {
+                    'support': bool(relay_support),
+                    'state': bool(relay_state),
+                    'retransmitCount': relay_count,
+                    'retransmitInterval': relay_interval
+                    },
+                'proxyFeature': {'support': bool(proxy_support), 'state': bool(proxy_state)},
+                'friendFeature': {'support': bool(friend_support), 'state': bool(friend_state)},
+                'lpnFeature': {'state': bool(lpn_state)},
+                'subnets': [net_idx for (net_idx,) in self.__db.execute('SELECT net_index ' +
+                    'FROM node_subnets WHERE gateway = ? AND node = ? ORDER BY net_index',
+                    params)],
+                'elements': []
+                }
+        elements = {}
+        for (elem_addr,) in self.__db.execute('SELECT address FROM elements WHERE ' +
+                'gateway = ? AND node = ? ORDER BY position', params):
+            element = {'address': elem_addr, 'sigModels': [], 'vendorModels': []}
+            elements[elem_addr] = element
+            node['elements'].append(element)
+        for model_row, elem_addr, company_id, model_id in self.__db.execute('SELECT id, ' +
+                'element, company_id, model_id FROM models WHERE gateway = ? AND node = ? ' +
+                'ORDER BY element, position', params).fetchall():
+            model = {
+                    'modelId': model_id,
+                    'subscribeAddresses': [sub_addr for (sub_addr,) in self.__db.execute(
+                        'SELECT address FROM subscriptions WHERE model = ?', (model_row,))],
+                    'publishParameters': self.__load_publish(model_row)
+                    }
+            app_indexes = [app_idx for (app_idx,) in self.__db.execute(
+                'SELECT app_index FROM bindings WHERE model = ?', (model_row,))]
+            if company_id is None:
+                model['appIndexes'] = app_indexes
+                elements[elem_addr]['sigModels'].append(model)
+            else:
+                model['companyId'] = company_id
+                model['appIndex'] = app_indexes
+                elements[elem_addr]['vendorModels'].append(model)
+        return node
+
+    def __load_publish(self, model_row):
+        row = self.__db.execute('SELECT address, app_index, friend_credential, ttl, period, ' +
+                'period_units, retransmit_count, retransmit_interval FROM publish_parameters ' +
+                'WHERE model = ?', (model_row,)).fetchone()
+        if row is None:
+            return None
+        return {
+                'address': row[0],
+                'appIndex': row[1],
+                'friendCredentialFlag': bool(row[2]),
+                'timeToLive': row[3],
+                'period': row[4],
+                'periodUnits': row[5],
+                'retransmitCount': row[6],
+                'retransmitInterval': row[7]
+                }
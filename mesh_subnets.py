@@ -10,18 +10,14 @@ class Subnets():
             'Get Subnets'
             ]
     __SUBNET_REQ = {
-            'id': 'randomId',
-            'type': 'operation',
-            'operation': {
-                'type' : 'subnet_request'
-                }
+            'type' : 'subnet_request'
             }
     __subnets = [dict]
 
-    def __init__(self, sem, get_choice, publish):
-        self.__sem = sem
+    def __init__(self, pending, inventory, get_choice):
+        self.__pending = pending
+        self.__inventory = inventory
         self.__get_choice = get_choice
-        self.__publish = publish
 
     def __print(self):
         ''' Print the list of current subnets '''
@@ -34,12 +30,13 @@ class Subnets():
 
     def get_choice(self):
         ''' Get a subnet selection from the user '''
-        print('Acquiring subnets from gateway...')
-        self.__publish(self.__SUBNET_REQ)
-        if not self.__sem.acquire():
+        if not self.__inventory.fresh('subnet_list'):
+            print('Acquiring subnets from gateway...')
+        subnets = self.__pending.run(self.lookup())
+        if subnets is None:
             return None
         choices = []
-        for subnet in self.__subnets:
+        for subnet in subnets:
             choices.append(uint16(subnet['netIndex']))
         if len(choices) == 0:
             print('No subnets to choose from. Try adding subnets to the gateway first.')
@@ -51,12 +48,60 @@ class Subnets():
             choice = self.__get_choice(choices)
         if choice is None or choice == -1:
             return choice
-        return self.__subnets[choice]['netIndex']
+        return subnets[choice]['netIndex']
+
+    async def __request(self, operation):
+        event = await self.__pending.request(operation, 'subnet_list')
+        if event is None:
+            return None
+        return event['subnetList']
+
+    async def fetch(self):
+        ''' Request the list of subnets from the gateway '''
+        return await self.__request(self.__SUBNET_REQ)
+
+    async def lookup(self):
+        ''' Get the list of subnets from the inventory cache, requesting it from the gateway
+        if the cached list is stale '''
+        subnets = self.__inventory.get('subnet_list')
+        if subnets is None:
+            subnets = await self.fetch()
+        return subnets
+
+    async def add(self, net_key, net_idx):
+        ''' Add a subnet with a known network key to the gateway '''
+        subnet_add = {
+                'type': 'subnet_add',
+                'netKey': net_key,
+                'netIndex': net_idx
+                }
+        self.__inventory.invalidate('subnet_list')
+        return await self.__request(subnet_add)
+
+    async def generate(self, net_idx):
+        ''' Have the gateway generate a subnet '''
+        subnet_gen = {
+                'type': 'subnet_generate',
+                'netIndex': net_idx
+                }
+        self.__inventory.invalidate('subnet_list')
+        return await self.__request(subnet_gen)
+
+    async def delete(self, net_idx):
+        ''' Delete a subnet from the gateway '''
+        subnet_del = {
+                'type': 'subnet_delete',
+                'netIndex': net_idx
+                }
+        # Application keys bound to the subnet go with it
+        self.__inventory.invalidate('subnet_list', 'app_key_list')
+        return await self.__request(subnet_del)
 
     def evt(self, event):
         ''' Receive a subnet list event from the gateway '''
         self.__subnets = event['subnetList'].copy()
-        self.__sem.release()
+        self.__inventory.update('subnet_list', self.__subnets)
+        self.__pending.complete(event)
 
     def menu(self):
         ''' Run subnet menu for user '''
@@ -68,44 +113,25 @@ class Subnets():
         if self.__MENU_CHOICES[choice] == 'Add Subnet':
             net_key = input('Enter 128-bit network key in hexadecimal format: ')
             net_idx = int(input('Enter unsigned 16-bit network index: '), 0)
-            subnet_add = {
-                    'id': 'randomId',
-                    'type': 'operation',
-                    'operation': {
-                        'type': 'subnet_add',
-                        'netKey': net_key,
-                        'netIndex': net_idx
-                        }
-                    }
             print('Adding subnet...')
-            self.__publish(subnet_add)
-            if not self.__sem.acquire():
+            if self.__pending.run(self.add(net_key, net_idx)) is None:
                 return
             self.__print()
 
         elif self.__MENU_CHOICES[choice] == 'Generate Subnet':
             net_idx = int(input('Enter unsigned 16-bit network index: '), 0)
-            subnet_gen = {
-                    'id': 'randomId',
-                    'type': 'operation',
-                    'operation': {
-                        'type': 'subnet_generate',
-                        'netIndex': net_idx
-                        }
-                    }
             print('Generating subnet...')
-            self.__publish(subnet_gen)
-            if not self.__sem.acquire():
+            if self.__pending.run(self.generate(net_idx)) is None:
                 return
             self.__print()
 
         elif self.__MENU_CHOICES[choice] == 'Delete Subnet':
-            self.__publish(self.__SUBNET_REQ)
-            if not self.__sem.acquire():
+            subnets = self.__pending.run(self.lookup())
+            if subnets is None:
                 return
 
             choices = []
-            for subnet in self.__subnets:
+            for subnet in subnets:
                 if subnet['netIndex'] != 0:
                     choices.append(uint16(subnet['netIndex']))
 
@@ -118,23 +144,13 @@ class Subnets():
             if choice is None or choice == -1:
                 return choice
 
-            subnet_del = {
-                    'id': 'randomId',
-                    'type': 'operation',
-                    'operation': {
-                        'type': 'subnet_delete',
-                        'netIndex': int(choices[choice], 0)
-                        }
-                    }
             print('Deleteing subnet...')
-            self.__publish(subnet_del)
-            if not self.__sem.acquire():
+            if self.__pending.run(self.delete(int(choices[choice], 0))) is None:
                 return
             self.__print()
 
         elif self.__MENU_CHOICES[choice] == 'Get Subnets':
             print('Getting subnets...')
-            self.__publish(self.__SUBNET_REQ)
-            if not self.__sem.acquire():
+            if self.__pending.run(self.fetch()) is None:
                 return
             self.__print()
@@ -9,10 +9,9 @@ class Subscriptions():
             'Get subscription list'
             ]
 
-    def __init__(self, sem, get_choice, publish):
-        self.__sem = sem
+    def __init__(self, pending, get_choice):
+        self.__pending = pending
         self.__get_choice = get_choice
-        self.__publish = publish
         self.__subsciptions = [dict]
 
     def __print(self):
@@ -32,35 +31,14 @@ class Subscriptions():
         if choice == 0:
             # Subscribe
             addr = int(input('Enter unsigned 16-bit mesh address to subscribe to: '), 0)
-            subscribe = {
-                    'id': 'randomId',
-                    'type': 'operation',
-                    'operation': {
-                        'type': 'subscribe',
-                        'addressList': [
-                            {
-                                'address': addr
-                                }
-                            ]
-                        }
-                    }
             print('Subscribing...')
-            self.__publish(subscribe)
-            if not self.__sem.acquire():
+            if self.__pending.run(self.subscribe([addr])) is None:
                 return
             self.__print()
         elif choice == 1:
             # Unsubscribe
-            subscribe_list_req = {
-                    'id': 'randomId',
-                    'type': 'operation',
-                    'operation': {
-                        'type': 'subscribe_list_request'
-                        }
-                    }
             print('Acquiring subscription list...')
-            self.__publish(subscribe_list_req)
-            if not self.__sem.acquire():
+            if self.__pending.run(self.fetch()) is None:
                 return
             choices = []
             for sub in self.__subscriptions:
@@ -70,40 +48,48 @@ class Subscriptions():
             if choice is None or choice == -1:
                 return choice
             addr = int(choices[choice], 0)
-            unsubscribe = {
-                    'id': 'randomId',
-                    'type': 'operation',
-                    'operation': {
-                        'type': 'unsubscribe',
-                        'addressList': [
-                            {
-                                'address': addr
-                                }
-                            ]
-                        }
-                    }
             print('Unsubscribing...')
-            self.__publish(unsubscribe)
-            if not self.__sem.acquire():
+            if self.__pending.run(self.unsubscribe([addr])) is None:
                 return
             self.__print()
 
         elif choice == 2:
             # Get subscriptin list
-            subscribe_list_req = {
-                    'id': 'randomId',
-                    'type': 'operation',
-                    'operation': {
-                        'type': 'subscribe_list_request'
-                        }
-                    }
             print('Acquiring subscription list...')
-            self.__publish(subscribe_list_req)
-            if not self.__sem.acquire():
+            if self.__pending.run(self.fetch()) is None:
                 return
             self.__print()
 
+    async def __request(self, operation):
+        event = await self.__pending.request(operation, 'subscribe_list')
+        if event is None:
+            return None
+        return event['addressList']
+
+    async def fetch(self):
+        ''' Request the list of subscribed addresses from the gateway '''
+        subscribe_list_req = {
+                'type': 'subscribe_list_request'
+                }
+        return await self.__request(subscribe_list_req)
+
+    async def subscribe(self, addresses):
+        ''' Subscribe to mesh model messages destined for a list of addresses '''
+        subscribe = {
+                'type': 'subscribe',
+                'addressList': [{'address': addr} for addr in addresses]
+                }
+        return await self.__request(subscribe)
+
+    async def unsubscribe(self, addresses):
+        ''' Unsubscribe from mesh model messages destined for a list of addresses '''
+        unsubscribe = {
+                'type': 'unsubscribe',
+                'addressList': [{'address': addr} for addr in addresses]
+                }
+        return await self.__request(unsubscribe)
+
     def evt(self, event):
         ''' Receive subscription list from gateway '''
         self.__subscriptions = event['addressList'].copy()
-        self.__sem.release()
+        self.__pending.complete(event)
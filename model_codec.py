@@ -0,0 +1,278 @@
+''' Bluetooth mesh model message payload codec module '''
+import collections
+import struct
+from byte_codec import uint8
+from byte_codec import uint16
+
+def on_off(value):
+    ''' Get the display form of an OnOff state '''
+    return 'ON' if value else 'OFF'
+
+def uint16_list(values):
+    ''' Get the display form of a list of 16-bit values, e.g. property IDs '''
+    return ', '.join(uint16(value) for value in values) if len(values) else 'None'
+
+def hex_bytes(value):
+    ''' Get the display form of a variable length byte field '''
+    return ' '.join(uint8(byte) for byte in value) if len(value) else 'None'
+
+# Struct format of each field type. Unsigned 24-bit fields are read as 3 bytes and converted
+_FORMATS = {
+        'uint8': 'B',
+        'int16': 'h',
+        'uint16': 'H',
+        'int32': 'i',
+        'uint24': '3s'
+        }
+
+class Field():
+    ''' Fixed size payload field '''
+    def __init__(self, label, kind, formatter=str):
+        self.label = label
+        self.name = label.lower().replace(' ', '_')
+        self.kind = kind
+        self.format = _FORMATS[kind]
+        self.formatter = formatter
+
+ON_OFF = Field('OnOff', 'uint8', on_off)
+TID = Field('TID', 'uint8', uint8)
+TRANSITION_TIME = Field('Transition Time', 'uint8', uint8)
+DELAY = Field('Delay', 'uint8', uint8)
+REMAINING_TIME = Field('Remaining Time', 'uint8', uint8)
+PROPERTY_ID = Field('Property ID', 'uint16', uint16)
+ACCESS = Field('User Access', 'uint8', uint8)
+# Trailing variable length fields: a list of 16-bit property IDs, or raw bytes
+PROPERTY_IDS = ('Property IDs', 'uint16s', uint16_list)
+PROPERTY_VALUE = ('Property Value', 'bytes', hex_bytes)
+
+def _set(state, *fields):
+    ''' Layout of a set message that carries a state, a TID and optional transition time and
+    delay '''
+    return [state, *fields, TID], [TRANSITION_TIME, DELAY], None
+
+def _status(label, kind, formatter=str):
+    ''' Layout of a status message with a present state and optional target state and
+    remaining time '''
+    return ([Field('Present ' + label, kind, formatter)],
+            [Field('Target ' + label, kind, formatter), REMAINING_TIME], None)
+
+_EMPTY = [], [], None
+_LEVEL = Field('Level', 'int16')
+_POWER = Field('Power', 'uint16')
+_GLOBAL = [
+        Field('Global Latitude', 'int32'),
+        Field('Global Longitude', 'int32'),
+        Field('Global Altitude', 'int16')
+        ], [], None
+_LOCAL = [
+        Field('Local North', 'int16'),
+        Field('Local East', 'int16'),
+        Field('Local Altitude', 'int16'),
+        Field('Floor Number', 'uint8'),
+        Field('Uncertainty', 'uint16', uint16)
+        ], [], None
+_RANGE = [Field('Range Min', 'uint16'), Field('Range Max', 'uint16')], [], None
+
+# Payload layout of each model message as (required fields, optional fields, trailing field).
+# Optional fields are either all present or all absent
+LAYOUTS = {
+        'Generic OnOff Get': _EMPTY,
+        'Generic OnOff Set': _set(ON_OFF),
+        'Generic OnOff Set Unacknowledged': _set(ON_OFF),
+        'Generic OnOff Status': _status('OnOff', 'uint8', on_off),
+        'Generic Level Get': _EMPTY,
+        'Generic Level Set': _set(_LEVEL),
+        'Generic Level Set Unacknowledged': _set(_LEVEL),
+        'Generic Level Status': _status('Level', 'int16'),
+        'Generic Delta Set': _set(Field('Delta Level', 'int32')),
+        'Generic Delta Set Unacknowledged': _set(Field('Delta Level', 'int32')),
+        'Generic Move Set': _set(Field('Delta Level', 'int16')),
+        'Generic Mode Set Unacknowledged': _set(Field('Delta Level', 'int16')),
+        'Generic Default Transition Time Get': _EMPTY,
+        'Generic Default Transition Time Set': ([TRANSITION_TIME], [], None),
+        'Generic Default Transition Time Set Unacknowledged': ([TRANSITION_TIME], [], None),
+        'Generic Default Transition Time Status': ([TRANSITION_TIME], [], None),
+        'Generic OnPowerUp Get': _EMPTY,
+        'Generic OnPowerUp Status': ([Field('OnPowerUp', 'uint8')], [], None),
+        'Generic OnPowerUp Set': ([Field('OnPowerUp', 'uint8')], [], None),
+        'Generic OnPowerUp Set Unacknowledged': ([Field('OnPowerUp', 'uint8')], [], None),
+        'Generic Power Level Get': _EMPTY,
+        'Generic Power Level Set': _set(_POWER),
+        'Generic Power Level Set Unacknowledged': _set(_POWER),
+        'Generic Power Level Status': _status('Power', 'uint16'),
+        'Generic Power Last Get': _EMPTY,
+        'Generic Power Last Status': ([_POWER], [], None),
+        'Generic Power Default Get': _EMPTY,
+        'Generic Power Default Status': ([_POWER], [], None),
+        'Generic Power Range Get': _EMPTY,
+        'Generic Power Range Status': ([Field('Status Code', 'uint8', uint8)] + _RANGE[0],
+            [], None),
+        'Generic Power Default Set': ([_POWER], [], None),
+        'Generic Power Default Set Unacknowledged': ([_POWER], [], None),
+        'Generic Power Range Set': _RANGE,
+        'Generic Power Range Set Unacknowledged': _RANGE,
+        'Generic Battery Get': _EMPTY,
+        'Generic Battery Status': ([
+            Field('Battery Level', 'uint8'),
+            Field('Time To Discharge', 'uint24'),
+            Field('Time To Charge', 'uint24'),
+            Field('Flags', 'uint8', uint8)
+            ], [], None),
+        'Generic Location Global Get': _EMPTY,
+        'Generic Location Global Status': _GLOBAL,
+        'Generic Location Local Get': _EMPTY,
+        'Generic Location Local Status': _LOCAL,
+        'Generic Location Global Set': _GLOBAL,
+        'Generic Location Global Set Unacknowledged': _GLOBAL,
+        'Generic Location Local Set': _LOCAL,
+        'Generic Location Local Set Unacknowledged': _LOCAL,
+        'Generic Manufacturer Properties Get': _EMPTY,
+        'Generic Manufacturer Properties Status': ([], [], PROPERTY_IDS),
+        'Generic Manufacturer Property Get': ([PROPERTY_ID], [], None),
+        'Generic Manufacturer Property Set': ([PROPERTY_ID, ACCESS], [], None),
+        'Generic Manufacturer Property Set Unacknowledged': ([PROPERTY_ID, ACCESS], [], None),
+        'Generic Manufacturer Property Status': ([PROPERTY_ID], [ACCESS], PROPERTY_VALUE),
+        'Generic Admin Properties Get': _EMPTY,
+        'Generic Admin Properties Status': ([], [], PROPERTY_IDS),
+        'Generic Admin Property Get': ([PROPERTY_ID], [], None),
+        'Generic Admin Property Set': ([PROPERTY_ID, ACCESS], [], PROPERTY_VALUE),
+        'Generic Admin Property Set Unacknowledged': ([PROPERTY_ID, ACCESS], [], PROPERTY_VALUE),
+        'Generic Admin Property Status': ([PROPERTY_ID], [ACCESS], PROPERTY_VALUE),
+        'Generic User Properties Get': _EMPTY,
+        'Generic User Properties Status': ([], [], PROPERTY_IDS),
+        'Generic User Property Get': ([PROPERTY_ID], [], None),
+        'Generic User Property Set': ([PROPERTY_ID], [], PROPERTY_VALUE),
+        'Generic User Property Set Unacknowledged': ([PROPERTY_ID], [], PROPERTY_VALUE),
+        'Generic User Property Status': ([PROPERTY_ID], [ACCESS], PROPERTY_VALUE),
+        'Generic Client Properties Get': ([PROPERTY_ID], [], None),
+        'Generic Client Properties Status': ([], [], PROPERTY_IDS)
+        }
+
+class Decoder():
+    ''' Decoder of the payload of one model message into a record, a named tuple with one
+    item per field. Absent optional fields are None '''
+    __UINT16 = struct.Struct('<H')
+
+    def __init__(self, name, opcode, layout):
+        required, optional, trailing = layout
+        self.name = name
+        self.opcode = opcode
+        self.fields = required + optional
+        fmt = '<' + ''.join(field.format for field in required)
+        self.__required = struct.Struct(fmt)
+        self.__full = struct.Struct(fmt + ''.join(field.format for field in optional))
+        self.__missing = (None,) * len(optional)
+        self.__trailing = trailing
+        self.__uint24 = [idx for idx, field in enumerate(self.fields) if field.kind == 'uint24']
+        names = [field.name for field in self.fields]
+        if trailing is not None:
+            names.append(trailing[0].lower().replace(' ', '_'))
+        self.record = collections.namedtuple(name.replace(' ', '_'), names)
+
+    def decode(self, payload):
+        ''' Get the record of a bytes-like payload. Raises ValueError if the payload is too
+        short or has bytes left over '''
+        size = len(payload)
+        if size >= self.__full.size:
+            values = self.__full.unpack_from(payload)
+            end = self.__full.size
+        elif size >= self.__required.size:
+            values = self.__required.unpack_from(payload) + self.__missing
+            end = self.__required.size
+        else:
+            raise ValueError(self.name + ' payload is too short: ' + str(size) + ' bytes')
+        if self.__trailing is not None:
+            rest = bytes(payload[end:])
+            if self.__trailing[1] == 'uint16s':
+                if len(rest) % 2:
+                    raise ValueError(self.name + ' payload has an odd number of ID bytes')
+                rest = [value for value, in self.__UINT16.iter_unpack(rest)]
+            values += (rest,)
+        elif size != end:
+            raise ValueError(self.name + ' payload has ' + str(size - end) + ' extra bytes')
+        if self.__uint24:
+            values = list(values)
+            for idx in self.__uint24:
+                values[idx] = int.from_bytes(values[idx], 'little')
+        return self.record._make(values)
+
+    def lines(self, record):
+        ''' Get the display lines of a decoded record, skipping absent optional fields '''
+        lines = []
+        for field, value in zip(self.fields, record):
+            if value is not None:
+                lines.append(field.label + ': ' + field.formatter(value))
+        if self.__trailing is not None:
+            lines.append(self.__trailing[0] + ': ' + self.__trailing[2](record[-1]))
+        return lines
+
+def decoders(opcodes):
+    ''' Get the decoder of each opcode in a dictionary of opcodes by message name '''
+    return {opcode: Decoder(name, opcode, LAYOUTS[name]) for name, opcode in opcodes.items()}
+
+class Encoder():
+    ''' Encoder of the payload of one model message from its field values, named as in the
+    records of its Decoder '''
+    def __init__(self, name, opcode, layout):
+        required, optional, trailing = layout
+        self.name = name
+        self.opcode = opcode
+        self.required = required
+        self.optional = optional
+        self.trailing = trailing
+        self.has_tid = TID in required
+        fmt = '<' + ''.join(field.format for field in required)
+        self.__required = struct.Struct(fmt)
+        self.__full = struct.Struct(fmt + ''.join(field.format for field in optional))
+        self.__required_names = [field.name for field in required]
+        self.__optional_names = [field.name for field in optional]
+        self.__trailing_name = None
+        if trailing is not None:
+            self.__trailing_name = trailing[0].lower().replace(' ', '_')
+        self.__uint24 = [idx for idx, field in enumerate(required + optional)
+                if field.kind == 'uint24']
+
+    def encode(self, **fields):
+        ''' Get the payload of the message as bytes. Optional fields are left out unless one of
+        them or a trailing value is given, the others then default to 0. Raises ValueError if a
+        field is missing, unknown or out of range '''
+        try:
+            values = [fields.pop(name) for name in self.__required_names]
+        except KeyError as err:
+            raise ValueError(self.name + ' needs a value for ' + str(err)) from None
+        rest = b''
+        if self.__trailing_name is not None:
+            rest = fields.pop(self.__trailing_name, b'')
+        packer = self.__required
+        # A trailing value follows the optional fields, so it needs them in place
+        if len(rest) or any(name in fields for name in self.__optional_names):
+            values += [fields.pop(name, 0) for name in self.__optional_names]
+            packer = self.__full
+        if len(fields):
+            raise ValueError(self.name + ' has no field ' + ', '.join(fields))
+        try:
+            for idx in self.__uint24:
+                values[idx] = values[idx].to_bytes(3, 'little')
+            payload = packer.pack(*values)
+            if self.trailing is not None and self.trailing[1] == 'uint16s':
+                rest = struct.pack('<' + str(len(rest)) + 'H', *rest)
+        except (struct.error, OverflowError) as err:
+            raise ValueError(self.name + ' field out of range: ' + str(err)) from None
+        return payload + bytes(rest)
+
+def encoders(opcodes):
+    ''' Get the encoder of each message name in a dictionary of opcodes by message name '''
+    return {name: Encoder(name, opcode, LAYOUTS[name]) for name, opcode in opcodes.items()}
+
+class Transactions():
+    ''' Transaction identifiers of the messages sent to each destination address. Every new
+    message to a destination gets the next TID, so that it is not taken for a retransmission
+    of the previous one '''
+    def __init__(self):
+        self.__next = {}
+
+    def next(self, address):
+        ''' Get the TID of a new message to a destination address '''
+        tid = self.__next.get(address, 0)
+        self.__next[address] = (tid + 1) % 256
+        return tid
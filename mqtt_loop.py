@@ -0,0 +1,113 @@
+''' MQTT asyncio integration module '''
+
+import asyncio
+import selectors
+import time
+import paho.mqtt.client as mqtt
+
+class Counting_Selector(selectors.DefaultSelector):
+    ''' Event loop selector that counts loop iterations '''
+    def __init__(self):
+        super().__init__()
+        self.iterations = 0
+        self.wakeups = 0
+        self.__start = time.monotonic()
+        self.__last_time = self.__start
+        self.__last_iterations = 0
+
+    def select(self, timeout=None):
+        ready = super().select(timeout)
+        self.iterations += 1
+        if ready:
+            self.wakeups += 1
+        return ready
+
+    def rate(self):
+        ''' Get the loop iterations per second since the previous call and since start '''
+        now = time.monotonic()
+        recent = (self.iterations - self.__last_iterations) / max(now - self.__last_time, 1e-9)
+        overall = self.iterations / max(now - self.__start, 1e-9)
+        self.__last_time = now
+        self.__last_iterations = self.iterations
+        return recent, overall
+
+class Mqtt_Loop():
+    ''' Drive the network I/O of a paho MQTT client from an asyncio event loop. The loop sleeps
+    in select() until the socket, a timer or the loop's wakeup pipe is ready '''
+    __RECONNECT_MIN = 1
+    __RECONNECT_MAX = 30
+
+    def __init__(self, loop, client, keepalive):
+        self.__loop = loop
+        self.__client = client
+        # Keepalive pings only need servicing a few times per keepalive period
+        self.__misc_interval = max(keepalive / 4, 1)
+        self.__misc = None
+        self.__reconnect = None
+        self.__disconnecting = False
+        self.__closed = asyncio.Event()
+        self.reconnects = 0
+        client.on_socket_open = self.__on_socket_open
+        client.on_socket_close = self.__on_socket_close
+        client.on_socket_register_write = self.__on_socket_register_write
+        client.on_socket_unregister_write = self.__on_socket_unregister_write
+
+    def __on_socket_open(self, _client, _userdata, sock):
+        self.__closed.clear()
+        self.__loop.add_reader(sock, self.__read)
+        self.__misc = self.__loop.create_task(self.__misc_loop())
+
+    def __on_socket_close(self, _client, _userdata, sock):
+        self.__loop.remove_reader(sock)
+        if self.__misc is not None:
+            self.__misc.cancel()
+            self.__misc = None
+        self.__closed.set()
+        if not self.__disconnecting and self.__reconnect is None:
+            self.__reconnect = self.__loop.create_task(self.__reconnect_loop())
+
+    def __on_socket_register_write(self, _client, _userdata, sock):
+        self.__loop.add_writer(sock, self.__client.loop_write)
+
+    def __on_socket_unregister_write(self, _client, _userdata, sock):
+        self.__loop.remove_writer(sock)
+
+    def __read(self):
+        self.__client.loop_read()
+        # TLS sockets can hold already decrypted data that the selector cannot see
+        sock = self.__client.socket()
+        while sock is not None and hasattr(sock, 'pending') and sock.pending():
+            self.__client.loop_read()
+            sock = self.__client.socket()
+
+    async def __misc_loop(self):
+        ''' Service keepalive pings and timeouts '''
+        while self.__client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(self.__misc_interval)
+
+    async def __reconnect_loop(self):
+        ''' Reconnect after the connection was lost, backing off between attempts '''
+        delay = self.__RECONNECT_MIN
+        try:
+            while not self.__disconnecting:
+                print('Connection to MQTT broker lost. Reconnecting...')
+                try:
+                    self.__client.reconnect()
+                    self.reconnects += 1
+                    return
+                except OSError:
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.__RECONNECT_MAX)
+        finally:
+            self.__reconnect = None
+
+    async def disconnect(self, timeout=1):
+        ''' Disconnect from the broker and wait for the socket to close '''
+        self.__disconnecting = True
+        if self.__reconnect is not None:
+            self.__reconnect.cancel()
+        self.__client.disconnect()
+        try:
+            await asyncio.wait_for(self.__closed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
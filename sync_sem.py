@@ -1,22 +1,160 @@
-''' Semsphore module '''
+''' Gateway request synchronization module '''
 
-import threading
+import asyncio
+import itertools
+import time
+import uuid
 
-class Sem():
-    ''' Semaphore '''
-    __SEM_TIMEOUT = 15
-    __sem = threading.BoundedSemaphore(1)
+class Request():
+    ''' Pending gateway request '''
+    def __init__(self, req_id, evt_type, match, future, operation=None):
+        self.id = req_id
+        self.evt_type = evt_type
+        self.match = match or {}
+        self.future = future
+        self.operation = operation
+        # Time the operation was published, None for requests that only wait for an event
+        self.sent = None
 
-    def acquire(self):
-        ''' Acquire semaphore '''
-        if not self.__sem.acquire(blocking=True, timeout=self.__SEM_TIMEOUT):
+    def matches(self, event):
+        ''' Check if an event carries the expected values for this request '''
+        for key, value in self.match.items():
+            if key not in event or event[key] != value:
+                return False
+        return True
+
+class Requests():
+    ''' Table of pending gateway requests keyed by request ID and expected event type. The
+    table belongs to an asyncio event loop and is only modified from that loop. The round trip
+    of each answered or timed out operation is recorded in stats if given '''
+    TIMEOUT = 15
+
+    def __init__(self, publish, stats=None):
+        self.__publish = publish
+        self.__stats = stats
+        self.__loop = None
+        self.__prefix = uuid.uuid4().hex[:8]
+        self.__ids = itertools.count(1)
+        self.__pending = {}
+        self.__waiting = {}
+
+    def attach(self, loop):
+        ''' Attach the request table to the event loop that runs the MQTT session '''
+        self.__loop = loop
+
+    def new_id(self):
+        ''' Get a request ID that is unique for this session '''
+        return self.__prefix + '-' + str(next(self.__ids))
+
+    def message(self, operation):
+        ''' Wrap an operation in a gateway operation message with a unique ID '''
+        return {
+                'id': self.new_id(),
+                'type': 'operation',
+                'operation': operation
+                }
+
+    def post(self, operation):
+        ''' Publish an operation that has no response event. Safe to call from any thread once
+        the table is attached to an event loop '''
+        if self.__loop is None:
+            raise RuntimeError('Request table is not attached to an event loop')
+        if self.__in_loop():
+            self.__publish(self.message(operation))
+        else:
+            self.__loop.call_soon_threadsafe(self.__publish, self.message(operation))
+
+    async def request(self, operation, evt_type, match=None, timeout=TIMEOUT):
+        ''' Publish an operation and wait for its response event. Only events whose fields
+        agree with the match dictionary will complete the request. Returns None on timeout '''
+        msg = self.message(operation)
+        req = Request(msg['id'], evt_type, match, self.__loop.create_future(),
+                operation['type'])
+        return await self.__wait(req, msg, timeout)
+
+    async def wait(self, evt_type, match=None, timeout=TIMEOUT):
+        ''' Wait for an event without publishing an operation, e.g. a further answer to an
+        operation sent to a group address. Returns None on timeout '''
+        req = Request(self.new_id(), evt_type, match, self.__loop.create_future())
+        return await self.__wait(req, None, timeout)
+
+    async def __wait(self, req, msg, timeout):
+        self.__pending[req.id] = req
+        self.__waiting.setdefault(req.evt_type, {})[req.id] = req
+        try:
+            if msg is not None:
+                req.sent = time.monotonic()
+                self.__publish(msg)
+            return await asyncio.wait_for(req.future, timeout)
+        except asyncio.TimeoutError:
             print("ERROR: timeout waiting for response\n")
+            self.__timeout(req)
+            return None
+        except asyncio.CancelledError:
+            # Callers without a timeout of their own, e.g. fan-out acknowledgements, cancel
+            # the request when their timeout expires
+            self.__timeout(req)
+            raise
+        finally:
+            self.__remove(req)
+
+    def run(self, coro):
+        ''' Run a coroutine on the event loop and wait for its result. Must be called from a
+        thread other than the event loop thread, e.g. the interactive menu '''
+        return asyncio.run_coroutine_threadsafe(coro, self.__loop).result()
+
+    def call(self, operation, evt_type, match=None, timeout=TIMEOUT):
+        ''' Publish an operation and wait for its response event from outside the event loop '''
+        return self.run(self.request(operation, evt_type, match, timeout))
+
+    def complete(self, event, received=None):
+        ''' Complete the request an event is a response to. Events carrying a request ID
+        complete that request, otherwise the oldest matching request for the event type is
+        completed. Returns False if no request was waiting for the event. Called from a thread
+        other than the event loop thread, the request is completed on the loop and a
+        concurrent.futures.Future of the result is returned instead '''
+        if received is None:
+            received = time.monotonic()
+        if not self.__in_loop():
+            # The round trip ends when the event is handled, not when the loop gets to it
+            return asyncio.run_coroutine_threadsafe(self.__complete(event, received),
+                    self.__loop)
+        req = self.__pending.get(event.get('id'))
+        if req is None:
+            for waiter in self.__waiting.get(event['type'], {}).values():
+                if waiter.matches(event):
+                    req = waiter
+                    break
+        if req is None:
             return False
+        self.__remove(req)
+        if not req.future.done():
+            req.future.set_result(event)
+            if self.__stats is not None and req.sent is not None:
+                self.__stats.record(req.operation, event['type'], received - req.sent)
         return True
 
-    def release(self):
-        ''' Release semaphore '''
+    async def __complete(self, event, received):
+        return self.complete(event, received)
+
+    def count(self):
+        ''' Get the number of requests waiting for a response '''
+        return len(self.__pending)
+
+    def __in_loop(self):
         try:
-            self.__sem.release()
-        except ValueError:
-            pass
+            return asyncio.get_running_loop() is self.__loop
+        except RuntimeError:
+            return False
+
+    def __timeout(self, req):
+        if self.__stats is not None and req.sent is not None:
+            self.__stats.timeout(req.operation)
+
+    def __remove(self, req):
+        self.__pending.pop(req.id, None)
+        waiters = self.__waiting.get(req.evt_type)
+        if waiters is not None:
+            waiters.pop(req.id, None)
+            if not waiters:
+                del self.__waiting[req.evt_type]
@@ -0,0 +1,73 @@
+''' Gateway event queue tests '''
+import threading
+import time
+import pytest
+import event_queue
+
+class Handler():
+    ''' Event handler that waits until it is released '''
+    def __init__(self):
+        self.events = []
+        self.release = threading.Event()
+
+    def __call__(self, event):
+        self.release.wait(5)
+        self.events.append(event)
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        event_queue.Event_Queue(Handler(), policy='wait')
+
+def test_events_are_handled_in_order():
+    handler = Handler()
+    handler.release.set()
+    events = event_queue.Event_Queue(handler, 10)
+    events.start()
+    for idx in range(5):
+        assert events.put({'type': 'node_list', 'idx': idx})
+    events.stop(5)
+    assert [event['idx'] for event in handler.events] == list(range(5))
+    assert events.handled == events.received == 5
+
+def test_drop_policy():
+    events = event_queue.Event_Queue(Handler(), 2, 'drop')
+    assert events.put(1)
+    assert events.put(2)
+    assert not events.put(3)
+    assert (events.received, events.dropped, events.blocked) == (3, 1, 0)
+    assert events.depth() == events.max_depth == 2
+
+def test_block_policy_times_out():
+    events = event_queue.Event_Queue(Handler(), 1, 'block', 0.01)
+    assert events.put(1)
+    assert not events.put(2)
+    assert (events.received, events.dropped, events.blocked) == (2, 1, 1)
+
+def test_block_policy_waits_for_room():
+    handler = Handler()
+    events = event_queue.Event_Queue(handler, 1, 'block', 5)
+    events.start()
+    assert events.put(1)
+    # The worker holds the first event, so the queue fills up once more
+    while events.depth():
+        time.sleep(0.001)
+    assert events.put(2)
+    threading.Timer(0.05, handler.release.set).start()
+    assert events.put(3)
+    events.stop(5)
+    assert handler.events == [1, 2, 3]
+    assert (events.dropped, events.blocked) == (0, 1)
+
+def test_failing_handler():
+    def handler(event):
+        if event == 1:
+            raise KeyError(event)
+        handled.append(event)
+    handled = []
+    events = event_queue.Event_Queue(handler)
+    events.start()
+    events.put(1)
+    events.put(2)
+    events.stop(5)
+    assert handled == [2]
+    assert events.handled == 2
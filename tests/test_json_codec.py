@@ -0,0 +1,49 @@
+''' Gateway message JSON codec tests '''
+import json
+import pytest
+import json_codec
+
+BACKENDS = ['json'] + (['orjson'] if json_codec.orjson is not None else [])
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_event(backend):
+    codec = json_codec.Json_Codec(backend=backend)
+    msg = {'type': 'event', 'event': {'type': 'node_list', 'nodes': []}}
+    assert codec.loads_event(json.dumps(msg).encode()) == msg
+    assert codec.loads_event(json.dumps(msg)) == msg
+    assert (codec.received, codec.skipped, codec.errors) == (2, 0, 0)
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_operation_is_skipped(backend):
+    codec = json_codec.Json_Codec(backend=backend)
+    msg = {'id': '1', 'type': 'operation', 'operation': {'type': 'node_request'}}
+    assert codec.loads_event(json.dumps(msg).encode()) is None
+    assert (codec.received, codec.skipped, codec.errors) == (1, 1, 0)
+    assert codec.parse_mean() == 0.0
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_parsed_non_event(backend):
+    codec = json_codec.Json_Codec(backend=backend)
+    payload = json.dumps({'type': 'operation', 'note': 'event'}).encode()
+    assert codec.loads_event(payload) is None
+    assert (codec.received, codec.skipped, codec.errors) == (1, 0, 0)
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('payload', [b'{"type": "event", ', b'["event"]', b'"event"'])
+def test_errors(backend, payload):
+    codec = json_codec.Json_Codec(backend=backend)
+    assert codec.loads_event(payload) is None
+    assert (codec.received, codec.skipped, codec.errors) == (1, 0, 1)
+    assert codec.parse_mean() >= 0.0
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_dumps(backend):
+    codec = json_codec.Json_Codec(default=bytes.hex, backend=backend)
+    encoded = codec.dumps({'payload': b'\x01\x02'})
+    assert json.loads(encoded) == {'payload': '0102'}
+
+def test_missing_orjson(monkeypatch):
+    monkeypatch.setattr(json_codec, 'orjson', None)
+    with pytest.raises(ValueError):
+        json_codec.Json_Codec(backend='orjson')
+    assert json_codec.Json_Codec().backend == 'json'
@@ -0,0 +1,66 @@
+''' Unicast address allocator tests '''
+from mesh_addresses import Address_Allocator
+from mesh_addresses import UNICAST_MAX
+
+NODE_LIST = [
+        {'address': 1, 'elementCount': 1, 'uuid': 'gateway'},
+        {'address': 2, 'elementCount': 3, 'uuid': 'a'},
+        {'address': 8, 'elementCount': 2, 'uuid': 'b'}
+        ]
+
+def allocator():
+    addresses = Address_Allocator()
+    addresses.rebuild(NODE_LIST)
+    return addresses
+
+def test_first_fit():
+    addresses = allocator()
+    assert addresses.first_fit(1) == 5
+    assert addresses.first_fit(3) == 5
+    assert addresses.first_fit(4) == 10
+    assert addresses.first_fit(0) is None
+    assert addresses.first_fit(UNICAST_MAX) is None
+
+def test_assign_and_release():
+    addresses = allocator()
+    addresses.assign(5, 3, 'c')
+    assert addresses.first_fit(1) == 10
+    addresses.release(2, 3)
+    assert addresses.first_fit(3) == 2
+    assert addresses.conflicts(2, 3) == []
+
+def test_reserve():
+    addresses = allocator()
+    assert addresses.reserve(2, 'c') == 5
+    assert addresses.reserve(2, 'd') == 10
+    assert addresses.conflicts(5, 1) == [(5, 2, 'c')]
+
+def test_conflicts():
+    addresses = allocator()
+    assert addresses.conflicts(4, 1) == [(2, 3, 'a')]
+    assert addresses.conflicts(3, 6) == [(2, 3, 'a'), (8, 2, 'b')]
+    assert addresses.conflicts(5, 3) == []
+    assert addresses.conflicts(10, 1) == []
+
+def test_held_blocks_survive_rebuild():
+    addresses = allocator()
+    assert addresses.reserve(2, 'c') == 5
+    addresses.rebuild(NODE_LIST)
+    assert addresses.conflicts(5, 2) == [(5, 2, 'c')]
+    addresses.release(5, 2)
+    addresses.rebuild(NODE_LIST)
+    assert addresses.conflicts(5, 2) == []
+
+def test_held_block_taken_by_node():
+    addresses = allocator()
+    addresses.hold(5, 2, 'c')
+    addresses.rebuild(NODE_LIST + [{'address': 6, 'elementCount': 1, 'uuid': 'd'}])
+    assert addresses.conflicts(5, 2) == [(6, 1, 'd')]
+
+def test_fragmentation():
+    addresses = allocator()
+    free, runs, largest, fragmentation = addresses.fragmentation()
+    assert free == UNICAST_MAX - 6
+    assert runs == 2
+    assert largest == UNICAST_MAX - 9
+    assert fragmentation == 1 - largest / free
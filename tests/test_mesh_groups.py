@@ -0,0 +1,104 @@
+''' Group address optimization tests '''
+import asyncio
+from mesh_cache import Ttl_Cache
+from mesh_groups import Group_Optimizer
+
+ONOFF_SERVER = 0x1000
+LEVEL_SERVER = 0x1002
+
+class Nodes():
+    ''' Node list source '''
+    def __init__(self, addresses):
+        self.__addresses = addresses
+
+    async def lookup(self):
+        return [{'address': address} for address in [1] + self.__addresses]
+
+class Node():
+    ''' Node discovery cache '''
+    def __init__(self):
+        self.cache = Ttl_Cache(60)
+
+def discovered(address, subscriptions, model_id=ONOFF_SERVER):
+    ''' Get a discovery result with one element per list of subscribe addresses '''
+    return {
+            'address': address,
+            'elements': [{
+                'address': address + idx,
+                'sigModels': [{'modelId': model_id, 'subscribeAddresses': subs}]
+                } for idx, subs in enumerate(subscriptions)]
+            }
+
+def optimizer(results, addresses=None):
+    node = Node()
+    for result in results:
+        node.cache.put(result['address'], result)
+    if addresses is None:
+        addresses = [result['address'] for result in results]
+    return Group_Optimizer(Nodes(addresses), node)
+
+def plan(groups, addresses, model_id=ONOFF_SERVER):
+    return asyncio.run(groups.plan(addresses, model_id))
+
+def test_group_reaches_destinations():
+    groups = optimizer([discovered(2, [[0xC000]]), discovered(3, [[0xC000]]),
+        discovered(4, [[0xC000]])])
+    result = plan(groups, [2, 3, 4])
+    assert result.groups == [(0xC000, [2, 3, 4])]
+    assert result.unicasts == []
+    assert result.messages() == 1
+    assert result.targets() == 3
+    assert result.destinations() == ([0xC000], {0xC000: [2, 3, 4]})
+
+def test_only_requested_elements_are_targets():
+    # The group reaches the second element of each node, which was not requested
+    groups = optimizer([discovered(2, [[0xC000], [0xC001]]),
+        discovered(4, [[0xC000], [0xC001]])])
+    result = plan(groups, [2, 4])
+    assert result.groups == [(0xC000, [2, 4])]
+    result = plan(groups, [2, 3, 4])
+    assert result.groups == [(0xC000, [2, 4])]
+    assert result.unicasts == [3]
+    assert result.targets() == 3
+
+def test_group_with_other_subscribers_is_not_used():
+    groups = optimizer([discovered(2, [[0xC000]]), discovered(3, [[0xC000]]),
+        discovered(4, [[0xC000]])])
+    result = plan(groups, [2, 3])
+    assert result.groups == []
+    assert result.unicasts == [2, 3]
+    assert result.messages() == result.targets() == 2
+
+def test_nodes_without_the_model_are_sent_to():
+    groups = optimizer([discovered(2, [[0xC000]]), discovered(3, [[0xC000]]),
+        discovered(4, [[0xC000]], LEVEL_SERVER)])
+    result = plan(groups, [2, 3, 4])
+    assert result.groups == [(0xC000, [2, 3])]
+    assert result.unicasts == [4]
+    assert result.messages() == 2
+    assert result.targets() == 3
+
+def test_groups_do_not_overlap():
+    groups = optimizer([discovered(2, [[0xC000, 0xC001]]), discovered(3, [[0xC000, 0xC001]]),
+        discovered(4, [[0xC001]])])
+    result = plan(groups, [2, 3, 4])
+    assert result.groups == [(0xC001, [2, 3, 4])]
+    assert result.unicasts == []
+
+def test_unknown_nodes():
+    groups = optimizer([discovered(2, [[0xC000]]), discovered(3, [[0xC000]])], [2, 3, 5])
+    result = plan(groups, [2, 3, 5])
+    assert result.groups == [(0xC000, [2, 3])]
+    assert result.unicasts == [5]
+    assert result.unknown_nodes == [5]
+
+def test_stale_results_are_not_used():
+    node = Node()
+    node.cache.put(2, discovered(2, [[0xC000]]))
+    node.cache.put(3, discovered(3, [[0xC000]]), 0)
+    node.cache.ttl = 1
+    groups = Group_Optimizer(Nodes([2, 3]), node)
+    result = plan(groups, [2, 3])
+    assert result.groups == []
+    assert result.unicasts == [2, 3]
+    assert result.unknown_nodes == [3]
@@ -0,0 +1,62 @@
+''' Received model message analytics tests '''
+import pytest
+import mesh_ingest
+
+numpy = pytest.importorskip('numpy')
+
+def table(rows, **columns):
+    ''' Get a table of (timestamp, source) rows with extra columns '''
+    result = {
+            'timestamp': numpy.array([row[0] for row in rows], numpy.float64),
+            'source': numpy.array([row[1] for row in rows], numpy.int32)
+            }
+    result.update({name: numpy.array(values) for name, values in columns.items()})
+    return result
+
+def test_rates():
+    sources, counts, per_minute = mesh_ingest.rates(table([(0, 2), (30, 2), (60, 3)]))
+    assert list(sources) == [2, 3]
+    assert list(counts) == [2, 1]
+    assert list(per_minute) == [2, 1]
+
+def test_duty_cycles():
+    # Node 2 is on for 10 of 40 seconds, node 3 has a single report and no duration
+    rows = [(0, 2), (10, 2), (40, 2), (5, 3), (20, 4), (30, 4)]
+    sources, duty = mesh_ingest.duty_cycles(table(rows, present_onoff=[1, 0, 1, 1, 1, 1]),
+            'present_onoff')
+    result = dict(zip(sources, duty))
+    assert result[2] == pytest.approx(0.25)
+    assert result[4] == pytest.approx(1.0)
+    assert numpy.isnan(result[3])
+
+def test_duty_cycles_unsorted():
+    rows = [(40, 2), (0, 2), (10, 2)]
+    sources, duty = mesh_ingest.duty_cycles(table(rows, present_onoff=[1, 1, 0]),
+            'present_onoff')
+    assert list(sources) == [2]
+    assert duty[0] == pytest.approx(0.25)
+
+def test_latencies():
+    sent = {
+            'timestamp': numpy.array([0.0, 10.0, 0.0, 5.0]),
+            'destination': numpy.array([2, 2, 3, 4], numpy.int32),
+            'statusOpcode': numpy.array([0x8204, 0x8204, 0x8204, 0x8208], numpy.int32)
+            }
+    received = table([(0.5, 2), (10.2, 2), (50.0, 3), (6.0, 4), (1.0, 5)])
+    sources, delays = mesh_ingest.latencies(sent, received, 0x8204, 30)
+    assert list(sources) == [2, 2]
+    assert list(delays) == pytest.approx([0.5, 0.2])
+
+def test_latencies_without_sent_messages():
+    sent = {
+            'timestamp': numpy.empty(0),
+            'destination': numpy.empty(0, numpy.int32),
+            'statusOpcode': numpy.empty(0, numpy.int32)
+            }
+    sources, delays = mesh_ingest.latencies(sent, table([(1.0, 2)]), 0x8204, 30)
+    assert len(sources) == len(delays) == 0
+
+def test_concatenate():
+    joined = mesh_ingest.concatenate([table([(1, 2)]), {}, table([(2, 3)])])
+    assert list(joined['source']) == [2, 3]
+    assert mesh_ingest.concatenate([]) == {}
@@ -0,0 +1,51 @@
+''' Gateway event journal tests '''
+import pytest
+import mesh_journal
+
+def segment(*records):
+    data = mesh_journal.MAGIC
+    for timestamp, payload in records:
+        data += mesh_journal.HEADER.pack(len(payload), timestamp) + payload
+    return data
+
+def read(data):
+    return [(timestamp, bytes(payload)) for timestamp, payload in mesh_journal.records(data)]
+
+def test_records():
+    assert read(segment((1.5, b'{}'), (2.5, b''), (3.5, b'[1]'))) == \
+            [(1.5, b'{}'), (2.5, b''), (3.5, b'[1]')]
+    assert read(mesh_journal.MAGIC) == []
+
+def test_not_a_segment():
+    with pytest.raises(ValueError):
+        read(b'JUNK\x01' + segment((1.0, b'{}'))[len(mesh_journal.MAGIC):])
+
+@pytest.mark.parametrize('cut', [1, mesh_journal.HEADER.size - 1, mesh_journal.HEADER.size + 3])
+def test_truncated_tail(cut):
+    data = segment((1.0, b'first'), (2.0, b'second'))
+    last = mesh_journal.HEADER.size + len(b'second')
+    assert read(data[:len(data) - last + cut]) == [(1.0, b'first')]
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_journal_round_trip(tmp_path, compress):
+    journal = mesh_journal.Journal()
+    journal.open(str(tmp_path), 64, compress)
+    payloads = [bytes([idx]) * 20 for idx in range(10)]
+    for idx, payload in enumerate(payloads):
+        journal.append(payload, float(idx))
+    journal.close()
+    paths = mesh_journal.segments(str(tmp_path))
+    assert len(paths) == journal.segments > 1
+    assert all(path.endswith('.seg.z') == compress for path in paths)
+    replayed = [(timestamp, bytes(payload))
+            for timestamp, payload in mesh_journal.replay(str(tmp_path))]
+    assert replayed == [(float(idx), payload) for idx, payload in enumerate(payloads)]
+
+def test_truncated_segment_file(tmp_path):
+    path = tmp_path / 'journal-20240101-000000-000001.seg'
+    data = segment((1.0, b'first'), (2.0, b'second'))
+    path.write_bytes(data[:-3])
+    empty = tmp_path / 'journal-20240101-000000-000002.seg'
+    empty.write_bytes(b'')
+    assert [(timestamp, bytes(payload))
+            for timestamp, payload in mesh_journal.replay(str(tmp_path))] == [(1.0, b'first')]
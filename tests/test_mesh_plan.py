@@ -0,0 +1,110 @@
+''' Desired state planning tests '''
+import json
+import pytest
+import mesh_plan
+
+def configure(configuration, **fields):
+    cfg_op = {'type': 'node_configure', 'configuration': configuration, 'nodeAddress': 2}
+    cfg_op.update(fields)
+    return cfg_op
+
+def current_node():
+    return {
+            'address': 2,
+            'networkBeaconState': True,
+            'timeToLive': 7,
+            'relayFeature': {'support': True, 'state': False, 'retransmitCount': 1,
+                'retransmitInterval': 20},
+            'proxyFeature': {'support': True, 'state': False},
+            'friendFeature': {'support': True, 'state': False},
+            'lpnFeature': {'state': False},
+            'subnets': [0, 1],
+            'elements': [{
+                'address': 2,
+                'sigModels': [{
+                    'modelId': 0x1000,
+                    'appIndexes': [0, 1],
+                    'subscribeAddresses': [0xC000],
+                    'publishParameters': None
+                    }],
+                'vendorModels': []
+                }]
+            }
+
+def test_matching_spec_plans_nothing():
+    spec = {
+            'networkBeacon': True,
+            'timeToLive': 7,
+            'relay': {'state': False},
+            'subnets': [0, 1],
+            'models': [{'modelId': '0x1000', 'appKeys': [0, 1], 'subscribe': ['0xC000']}]
+            }
+    assert mesh_plan.diff_node(2, spec, current_node()) == []
+
+def test_settings():
+    spec = {'timeToLive': 5, 'relay': {'state': True}, 'proxy': True}
+    assert mesh_plan.diff_node(2, spec, current_node()) == [
+            configure('timeToLiveSet', value=5),
+            configure('relayFeatureSet', state=True, retransmitCount=1, retransmitInterval=20),
+            configure('proxyFeatureSet', state=True)
+            ]
+
+def test_removals_come_last():
+    spec = {'subnets': [0, 2], 'models': [{'modelId': 0x1000, 'appKeys': [0, 2]}]}
+    target = {'elementAddress': 2, 'modelId': 0x1000}
+    assert mesh_plan.diff_node(2, spec, current_node()) == [
+            configure('subnetAdd', netIndex=2),
+            configure('appKeyBind', appIndex=2, **target),
+            configure('appKeyUnbind', appIndex=1, **target),
+            configure('subnetDelete', netIndex=1)
+            ]
+
+def test_primary_subnet_is_kept():
+    node = current_node()
+    node['subnets'] = [0]
+    spec = {'subnets': [1]}
+    assert mesh_plan.diff_node(2, spec, node) == [configure('subnetAdd', netIndex=1)]
+
+def test_missing_model():
+    with pytest.raises(ValueError):
+        mesh_plan.diff_node(2, {'models': [{'modelId': 0x1002}]}, current_node())
+
+def test_publish():
+    spec = {'models': [{'modelId': 0x1000, 'publish': {'address': '0xC001', 'appIndex': 0,
+        'timeToLive': 7, 'period': 0, 'periodUnits': '100ms', 'retransmitCount': 0,
+        'retransmitInterval': 0}}]}
+    ops = mesh_plan.diff_node(2, spec, current_node())
+    assert len(ops) == 1
+    assert ops[0]['configuration'] == 'publishParametersSet'
+    assert ops[0]['publishAddress'] == 0xC001
+    assert ops[0]['friendCredentialFlag'] is False
+
+@pytest.mark.parametrize('current, wanted, expected', [
+    ([0xC000], [0xC000], []),
+    ([0xC000], [0xC000, 0xC001], [('subscribeAddressAdd', 0xC001)]),
+    ([0xC000, 0xC001], [0xC001], [('subscribeAddressDelete', 0xC000)]),
+    ([0xC000, 0xC001, 0xC002], [0xC003], [('subscribeAddressOverwrite', 0xC003)]),
+    ([0xC000, 0xC001], [0xC002, 0xC003],
+        [('subscribeAddressOverwrite', 0xC002), ('subscribeAddressAdd', 0xC003)]),
+    ([0xC000], [], [('subscribeAddressDelete', 0xC000)])
+    ])
+def test_diff_subscriptions(current, wanted, expected):
+    target = {'elementAddress': 2, 'modelId': 0x1000}
+    ops = mesh_plan.diff_subscriptions(configure, target, current, wanted)
+    assert [(cfg_op['configuration'], cfg_op['subscribeAddress']) for cfg_op in ops] == expected
+    assert all(cfg_op['elementAddress'] == 2 for cfg_op in ops)
+
+def test_load_state(tmp_path):
+    path = tmp_path / 'state.json'
+    path.write_text(json.dumps({'nodes': {'0x0002': {'subnets': [0, 1]}}}))
+    assert mesh_plan.load_state(str(path)) == {2: {'subnets': [0, 1]}}
+
+def test_load_state_needs_primary_subnet(tmp_path):
+    path = tmp_path / 'state.json'
+    path.write_text(json.dumps({'nodes': {'0x0002': {'subnets': [1]}}}))
+    with pytest.raises(ValueError):
+        mesh_plan.load_state(str(path))
+
+def test_estimate():
+    assert mesh_plan.estimate([3, 3, 2, 1], 2, 1) == 5
+    assert mesh_plan.estimate([], 4, 1) == 0
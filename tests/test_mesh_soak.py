@@ -0,0 +1,48 @@
+''' Soak test trend detection tests '''
+import pytest
+import mesh_soak
+from mesh_soak import Sample
+
+def samples(count, rss=None, threads=None, pending=None, latency=None):
+    ''' Get samples one minute apart whose values come from functions of the sample index '''
+    def value(func, idx):
+        return None if func is None else func(idx)
+    return [Sample(idx * 60.0, value(rss, idx), value(threads, idx), value(pending, idx),
+        value(latency, idx), idx * 100, 0) for idx in range(count)]
+
+def test_slope():
+    assert mesh_soak.slope([(0, 1), (1, 3), (2, 5)]) == pytest.approx(2)
+    assert mesh_soak.slope([(0, 5), (1, 5), (2, 5)]) == 0
+    assert mesh_soak.slope([(1, 1), (1, 2)]) is None
+    assert mesh_soak.slope([]) is None
+
+def test_no_samples():
+    assert mesh_soak.trends([]) == []
+
+def test_flat_run_passes():
+    found = mesh_soak.trends(samples(20, rss=lambda idx: 50e6, threads=lambda idx: 5,
+        pending=lambda idx: 4 + idx % 2, latency=lambda idx: 0.2))
+    assert found == []
+
+def test_memory_growth_fails():
+    found = mesh_soak.trends(samples(20, rss=lambda idx: 50e6 + idx * 1e6))
+    assert [name for name, _, _ in found] == ['rss']
+    name, growth, mean = found[0]
+    assert growth == pytest.approx(15e6)
+    # The warmup leaves out the first 4 samples
+    assert mean == pytest.approx(50e6 + 11.5e6)
+
+def test_growth_below_slack_passes():
+    # Growth of 1 MiB is above a tenth of a tiny mean but below the memory slack
+    assert mesh_soak.trends(samples(20, rss=lambda idx: idx * 60e3)) == []
+
+def test_warmup_is_ignored():
+    # Pending requests pile up while the run starts, then stay flat
+    found = mesh_soak.trends(samples(20, pending=lambda idx: 0 if idx < 2 else 50))
+    assert found == []
+    found = mesh_soak.trends(samples(20, pending=lambda idx: 0 if idx < 2 else 50), warmup=0)
+    assert [name for name, _, _ in found] == ['pending']
+
+def test_missing_values_are_skipped():
+    found = mesh_soak.trends(samples(20, latency=lambda idx: None if idx % 2 else 0.1 * idx))
+    assert [name for name, _, _ in found] == ['latency']
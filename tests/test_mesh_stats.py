@@ -0,0 +1,50 @@
+''' Operation latency histogram tests '''
+import math
+import random
+import pytest
+import mesh_stats
+from mesh_stats import Histogram
+
+def test_bucket_bounds():
+    generator = random.Random(1)
+    for value in list(range(1000)) + [generator.randrange(1 << 40) for _ in range(1000)]:
+        low, high = mesh_stats.bucket_bounds(mesh_stats.bucket(value))
+        assert low <= value < high
+        assert high - low <= max(low / mesh_stats.HALF, 1)
+
+def test_empty():
+    assert Histogram().percentile(50) is None
+
+@pytest.mark.parametrize('percent', [1, 50, 90, 99, 100])
+def test_percentile_bounds(percent):
+    generator = random.Random(1)
+    durations = sorted(generator.lognormvariate(-3, 1) for _ in range(10000))
+    histogram = Histogram()
+    for seconds in durations:
+        histogram.record(seconds)
+    exact = durations[math.ceil(len(durations) * percent / 100) - 1]
+    assert histogram.percentile(percent) == pytest.approx(exact, rel=0.02)
+    assert histogram.min <= histogram.percentile(percent) <= histogram.max
+
+def test_single_value():
+    histogram = Histogram()
+    histogram.record(0.25)
+    assert histogram.percentile(50) == 0.25
+    assert histogram.count == 1
+
+def test_cumulative():
+    histogram = Histogram()
+    for seconds in [0.001, 0.02, 0.3, 7]:
+        histogram.record(seconds)
+    assert histogram.cumulative([0.005, 0.05, 1, 10]) == [1, 2, 3, 4]
+
+def test_latency_stats():
+    stats = mesh_stats.Latency_Stats()
+    stats.record('node_request', 'node_list', 0.1)
+    stats.timeout('node_request')
+    assert stats.median('node_request') == pytest.approx(0.1, rel=0.02)
+    assert stats.median('provision') is None
+    text = stats.prometheus()
+    assert 'mesh_operation_latency_seconds_count{operation="node_request",' + \
+            'event="node_list"} 1' in text
+    assert 'mesh_operation_timeouts_total{operation="node_request"} 1' in text
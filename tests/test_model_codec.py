@@ -0,0 +1,73 @@
+''' Model message payload codec tests '''
+import pytest
+import model_codec
+from mesh_models import MODEL_MSG_OPCODES
+
+VALUES = {
+        'uint8': 200,
+        'int16': -300,
+        'uint16': 60000,
+        'int32': -70000,
+        'uint24': 0x123456
+        }
+TRAILING = {
+        'uint16s': [0x0001, 0x1234],
+        'bytes': b'\x01\x02\x03'
+        }
+
+DECODERS = model_codec.decoders(MODEL_MSG_OPCODES)
+ENCODERS = model_codec.encoders(MODEL_MSG_OPCODES)
+
+def fields_of(name, optional):
+    required, optional_fields, trailing = model_codec.LAYOUTS[name]
+    fields = {field.name: VALUES[field.kind] for field in required}
+    if optional:
+        fields.update({field.name: VALUES[field.kind] for field in optional_fields})
+        if trailing is not None:
+            fields[trailing[0].lower().replace(' ', '_')] = TRAILING[trailing[1]]
+    return fields
+
+@pytest.mark.parametrize('name', sorted(MODEL_MSG_OPCODES))
+@pytest.mark.parametrize('optional', [False, True])
+def test_round_trip(name, optional):
+    fields = fields_of(name, optional)
+    payload = ENCODERS[name].encode(**fields)
+    record = DECODERS[MODEL_MSG_OPCODES[name]].decode(payload)
+    decoded = record._asdict()
+    for field, value in fields.items():
+        assert decoded[field] == value
+    _, optional_fields, _ = model_codec.LAYOUTS[name]
+    if not optional and optional_fields:
+        assert all(decoded[field.name] is None for field in optional_fields)
+
+def test_short_payload():
+    decoder = DECODERS[MODEL_MSG_OPCODES['Generic Level Status']]
+    with pytest.raises(ValueError):
+        decoder.decode(b'\x01')
+
+def test_extra_bytes():
+    decoder = DECODERS[MODEL_MSG_OPCODES['Generic OnOff Status']]
+    with pytest.raises(ValueError):
+        decoder.decode(b'\x01\x00')
+
+def test_odd_property_ids():
+    decoder = DECODERS[MODEL_MSG_OPCODES['Generic User Properties Status']]
+    with pytest.raises(ValueError):
+        decoder.decode(b'\x01\x00\x02')
+
+def test_encode_errors():
+    encoder = ENCODERS['Generic OnOff Set']
+    with pytest.raises(ValueError):
+        encoder.encode(tid=1)
+    with pytest.raises(ValueError):
+        encoder.encode(onoff=1, tid=1, level=3)
+    with pytest.raises(ValueError):
+        encoder.encode(onoff=256, tid=1)
+
+def test_transactions():
+    tids = model_codec.Transactions()
+    assert [tids.next(2) for _ in range(3)] == [0, 1, 2]
+    assert tids.next(3) == 0
+    for _ in range(253):
+        tids.next(2)
+    assert tids.next(2) == 0
@@ -0,0 +1,118 @@
+''' Gateway request table tests '''
+import asyncio
+import threading
+import pytest
+import mesh_stats
+import sync_sem
+
+class Table():
+    ''' Request table on a new event loop with its published messages '''
+    def __init__(self):
+        self.published = []
+        self.stats = mesh_stats.Latency_Stats()
+        self.pending = sync_sem.Requests(self.published.append, self.stats)
+        self.loop = asyncio.new_event_loop()
+        self.pending.attach(self.loop)
+
+    def run(self, coro):
+        try:
+            return self.loop.run_until_complete(coro)
+        finally:
+            self.loop.close()
+
+def node_list():
+    return {'type': 'node_request'}
+
+def test_request_completed_by_id():
+    table = Table()
+
+    async def scenario():
+        request = asyncio.ensure_future(table.pending.request(node_list(), 'node_list'))
+        await asyncio.sleep(0)
+        msg = table.published[0]
+        assert msg['type'] == 'operation' and msg['operation'] == node_list()
+        assert table.pending.count() == 1
+        assert table.pending.complete({'type': 'node_list', 'id': msg['id'], 'nodes': []})
+        return await request
+
+    assert table.run(scenario())['nodes'] == []
+    assert table.pending.count() == 0
+    assert table.stats.median('node_request') is not None
+
+def test_match_requires_every_key():
+    table = Table()
+
+    async def scenario():
+        request = asyncio.ensure_future(table.pending.request({'type': 'node_discover'},
+            'node_discover_result', {'address': 2}))
+        await asyncio.sleep(0)
+        assert not table.pending.complete({'type': 'node_discover_result'})
+        assert not table.pending.complete({'type': 'node_discover_result', 'address': 3})
+        assert table.pending.complete({'type': 'node_discover_result', 'address': 2})
+        return await request
+
+    assert table.run(scenario())['address'] == 2
+
+def test_oldest_matching_request_first():
+    table = Table()
+
+    async def scenario():
+        first = asyncio.ensure_future(table.pending.wait('node_list'))
+        second = asyncio.ensure_future(table.pending.wait('node_list'))
+        await asyncio.sleep(0)
+        table.pending.complete({'type': 'node_list', 'nodes': [1]})
+        table.pending.complete({'type': 'node_list', 'nodes': [2]})
+        return await first, await second
+
+    first, second = table.run(scenario())
+    assert first['nodes'] == [1]
+    assert second['nodes'] == [2]
+
+def test_timeout():
+    table = Table()
+    assert table.run(table.pending.request(node_list(), 'node_list', timeout=0.01)) is None
+    assert table.pending.count() == 0
+    assert 'mesh_operation_timeouts_total{operation="node_request"} 1' in \
+            table.stats.prometheus()
+
+def test_caller_timeout_counts():
+    table = Table()
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(table.pending.request(node_list(), 'node_list', None), 0.01)
+
+    table.run(scenario())
+    assert table.pending.count() == 0
+    assert 'mesh_operation_timeouts_total{operation="node_request"} 1' in \
+            table.stats.prometheus()
+
+def test_complete_from_thread():
+    table = Table()
+    results = []
+
+    async def scenario():
+        request = asyncio.ensure_future(table.pending.request(node_list(), 'node_list'))
+        await asyncio.sleep(0)
+        event = {'type': 'node_list', 'id': table.published[0]['id']}
+        thread = threading.Thread(target=lambda: results.append(table.pending.complete(event)))
+        thread.start()
+        answer = await request
+        thread.join()
+        assert results[0].result(1) is True
+        return answer
+
+    assert table.run(scenario())['type'] == 'node_list'
+
+def test_unexpected_event():
+    table = Table()
+
+    async def scenario():
+        return table.pending.complete({'type': 'node_list'})
+
+    assert table.run(scenario()) is False
+
+def test_post_needs_loop():
+    pending = sync_sem.Requests(lambda msg: None)
+    with pytest.raises(RuntimeError):
+        pending.post(node_list())
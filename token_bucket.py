@@ -0,0 +1,25 @@
+''' Token bucket rate limiting module '''
+import asyncio
+import time
+
+class Token_Bucket():
+    ''' Pace operations to an average rate per second, allowing bursts of up to burst
+    operations after idle time '''
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.__tokens = burst
+        self.__last = time.monotonic()
+
+    def __refill(self):
+        now = time.monotonic()
+        self.__tokens = min(self.burst, self.__tokens + (now - self.__last) * self.rate)
+        self.__last = now
+
+    async def acquire(self):
+        ''' Wait until an operation may proceed '''
+        self.__refill()
+        while self.__tokens < 1:
+            await asyncio.sleep((1 - self.__tokens) / self.rate)
+            self.__refill()
+        self.__tokens -= 1